@@ -0,0 +1,71 @@
+# benchmark.py
+## times OrderParser.parsePost against the old find/replace parser
+
+# imports
+import sys
+import timeit
+from resources.order_parser import OrderParser
+
+# legacy parser (quadratic in the number of lines per post)
+class LegacyOrderParser(OrderParser):
+
+    def parsePost(self, post):
+        orders, postText = list(), post['message']
+        postAuthor = post['author']['ID']
+        cmdMarker, cmdEnd = self.CMD_MARKER, self.CMD_END
+        while (cmdEnd in postText):
+            orderText = self._getValueFromBetween(postText, cmdMarker, cmdEnd)
+            if "<br>" in orderText:
+                replaceText = orderText.replace("<br>", (cmdEnd + cmdMarker))
+                postText = postText.replace(orderText, replaceText)
+                orderText = orderText[:orderText.find("<br>")]
+            orderData = self.parseOrderData(orderText)
+            if self.isIgnoreOrder(orderData): break
+            else:
+                orderData['author'] = postAuthor
+                orders.append(orderData)
+                postText = postText[(postText.find(cmdEnd) + len(cmdEnd)):]
+        return orders
+
+# synthetic threads
+def makePost(ID, blocks, lines):
+    """makes a post with blocks of orders, each lines long"""
+    message = "Orders for this week:<br>"
+    for block in xrange(blocks):
+        orders = ['add_team 1v1 &quot;Team %d-%d-%d&quot; %d %d' %
+                  (ID, block, line, ID, line) for line in xrange(lines)]
+        message += (OrderParser.CMD_MARKER + "<br>".join(orders) +
+                    OrderParser.CMD_END + "<br>some chatter<br>")
+    return {'ID': ID, 'message': message,
+            'author': {'ID': ID % 50, 'name': 'player'}}
+
+def makeThread(posts, blocks, lines):
+    return [makePost(ID, blocks, lines) for ID in xrange(posts)]
+
+def parseThread(parser, thread):
+    orders = list()
+    for post in thread: orders += parser.parsePost(post)
+    return orders
+
+def compare(posts, blocks, lines, repeat=3):
+    """returns the best times (seconds) for the legacy and new parsers"""
+    thread = makeThread(posts, blocks, lines)
+    legacy, current = LegacyOrderParser(0), OrderParser(0)
+    if parseThread(legacy, thread) != parseThread(current, thread):
+        raise AssertionError("parsers disagree on %d/%d/%d" %
+                             (posts, blocks, lines))
+    timeFn = lambda parser: min(timeit.repeat(lambda:
+        parseThread(parser, thread), repeat=repeat, number=1))
+    return timeFn(legacy), timeFn(current)
+
+# run benchmark
+if __name__ == '__main__':
+    sizes = [(100, 2, 5), (200, 4, 25), (50, 1, 500), (5, 1, 5000),
+             (2, 1, 20000)]
+    if len(sys.argv) == 4: sizes = [tuple(int(arg) for arg in sys.argv[1:])]
+    print "%6s %6s %6s %10s %10s %8s" % ("posts", "blocks", "lines",
+                                         "legacy", "current", "speedup")
+    for posts, blocks, lines in sizes:
+        legacyTime, currentTime = compare(posts, blocks, lines)
+        print "%6d %6d %6d %9.3fs %9.3fs %7.1fx" % (posts, blocks, lines,
+            legacyTime, currentTime, legacyTime / max(currentTime, 1e-9))
@@ -6,14 +6,23 @@
 # imports
 import os
 import json
-from threading import Thread
-from flask import Flask, Response, redirect, request
+import uuid
+import hashlib
+import itertools
+from datetime import datetime
+from functools import wraps
+from flask import Flask, Response, redirect, request, g, \
+    has_request_context, stream_with_context
 from sheetDB import Credentials
 from resources.constants import GOOGLE_CREDS, GLOBAL_MANAGER, OWNER_ID,\
-    CSL_VERSION
+    CSL_VERSION, POOL_TTL, RUN_WORKERS, RUN_DEADLINE, JOB_WORKERS, JOB_TTL,\
+    RESPONSE_TTL, RESPONSE_CACHE_SIZE, TIMEFORMAT, JOB_CACHE_SIZE,\
+    CACHE_GENERATIONS_SIZE
 from resources.league_manager import LeagueManager
 from resources.global_manager import GlobalManager
-from resources.utility import WLHandler
+from resources.scheduler import Scheduler, Executor, Task
+from resources.utility import WLHandler, TTLCache
+from resources.run_stats import statsStore
 
 # google app engine fixes
 def fixAppengine():
@@ -34,6 +43,23 @@ LEAGUE_PREFIX = '/<string:clusterID>/<string:leagueName>'
 CLUSTER_PREFIX = '/<string:clusterID>'
 KW_REGISTER = "REGISTER"
 
+# connection pools (shared by every request and /run thread)
+credsPool = TTLCache(POOL_TTL)
+databasePool = TTLCache(POOL_TTL)
+managerPool = TTLCache(POOL_TTL)
+
+# background jobs (opt-in with ?async=1 on run endpoints)
+executor = Executor(JOB_WORKERS)
+jobs = TTLCache(JOB_TTL, JOB_CACHE_SIZE)
+
+# league GET responses, keyed by (cluster, league, path, generation) and
+# dropped on writes; each write moves its cluster (or, under the None key,
+# every cluster) to a new generation, so a GET that overlapped a write
+# can't leave its result where later GETs would find it
+responseCache = TTLCache(RESPONSE_TTL, RESPONSE_CACHE_SIZE)
+cacheGenerations = TTLCache(POOL_TTL, CACHE_GENERATIONS_SIZE)
+_generationCounter = itertools.count(1)
+
 # errors
 class AuthError(Exception):
     """raised for auth issues"""
@@ -41,11 +67,26 @@ class AuthError(Exception):
 
 # helper functions
 def creds():
-    return Credentials(GOOGLE_CREDS)
+    """fetches pooled Google credentials, logging in again if expired"""
+    credentials = credsPool.fetch(GOOGLE_CREDS,
+                                  lambda: Credentials(GOOGLE_CREDS))
+    _refreshClient(credentials)
+    return credentials
+
+def _refreshClient(credentials):
+    """the client property renews the access token pooled handles share"""
+    return credentials.client
+
+def database(sheetID):
+    """fetches a pooled Database handle for a spreadsheet ID"""
+    credentials = creds()
+    return databasePool.fetch(sheetID, lambda:
+        credentials.getDatabase(sheetID, checkFormat=False))
 
 def globalManager():
-    return GlobalManager(creds().getDatabase(GLOBAL_MANAGER,
-                                             checkFormat=False))
+    """fetches the pooled GlobalManager, whose snapshot all requests share"""
+    return managerPool.fetch(GLOBAL_MANAGER, lambda:
+        GlobalManager(database(GLOBAL_MANAGER)))
 
 def buildAuthURL(state=None):
     authURL = "https://www.warlight.net/CLOT/Auth"
@@ -61,9 +102,16 @@ def fetchLeague(clusterID, leagueName):
     cluster = fetchCluster(clusterID)
     return cluster.fetchLeague(leagueName)
 
+def fetchWritableLeague(clusterID, leagueName):
+    """fetches a league for a write, refusing if its admin isn't valid"""
+    cluster = fetchCluster(clusterID)
+    cluster.checkAdmin()
+    return cluster.fetchLeague(leagueName)
+
 def fetchCluster(clusterID):
-    cluster = creds().getDatabase(clusterID, checkFormat=False)
-    return LeagueManager(cluster, globalManager())
+    cluster = LeagueManager(database(clusterID), globalManager())
+    if has_request_context(): g.setdefault('clusters', list()).append(cluster)
+    return cluster
 
 def packageDict(data):
     return Response(json.dumps(data), mimetype='application/json')
@@ -107,14 +155,115 @@ def validateAuth(token, clotpass):
             (data['isMember'].lower() == 'true'),
             data['name'].encode('ascii', 'replace'))
 
-def fetchLeagueData(clusterID, leagueName, fetchFn):
+def _parseTime(value):
+    """parses sheet-style, ISO (as packaged) or date-only timestamps"""
+    for timeFormat in (TIMEFORMAT, '%Y-%m-%dT%H:%M:%S.%fZ',
+                       '%Y-%m-%dT%H:%M:%S', '%Y-%m-%d'):
+        try: return datetime.strptime(value, timeFormat)
+        except ValueError: continue
+    raise ValueError("Unrecognized time: " + str(value))
+
+def listingQuery(req):
+    """
+    reads listing options for team/game/template listings from req
+    (query args: offset, limit, team, ongoing, active, finishedAfter,
+    fields as a comma-separated list)
+    """
+    args, query = req.args, dict()
+    for key in ('offset', 'limit', 'team'):
+        if key in args: query[key] = max(0, int(args[key]))
+    for key in ('ongoing', 'active'):
+        if key in args: query[key] = _isTrue(args[key])
+    if 'finishedAfter' in args:
+        query['finishedAfter'] = _parseTime(args['finishedAfter'])
+    if 'fields' in args:
+        query['fields'] = [f for f in args['fields'].split(',') if len(f)]
+    return query
+
+def leagueData(clusterID, leagueName, fetchFn):
     result, leagues = dict(), fetchLeagues(clusterID, leagueName)
     for league in leagues: result[league.name] = fetchFn(league)
-    return packageDict(result)
+    return result
+
+def fetchLeagueData(clusterID, leagueName, fetchFn):
+    return packageDict(leagueData(clusterID, leagueName, fetchFn))
+
+def streamLeagueData(clusterID, fetchFn):
+    """
+    streams {league name: fetchFn(league)} for every league in a cluster,
+    building and serializing one league at a time; if a league fails
+    partway, the object is closed with 'error' and 'message' keys
+    """
+    cluster = fetchCluster(clusterID)
+    leagues = cluster.iterLeagues()
+    def generate():
+        yield '{'
+        separator = ''
+        try:
+            for league in leagues:
+                entry = (json.dumps(league.name) + ': ' +
+                         json.dumps(fetchFn(league)))
+                yield separator + entry
+                separator = ', '
+        except Exception as e:
+            yield (separator + '"error": true, "message": ' +
+                   json.dumps(str(e)))
+        finally:
+            try: cluster.flushLog() # logged while streaming
+            except Exception: pass
+        yield '}'
+    return Response(stream_with_context(generate()),
+                    mimetype='application/json')
+
+def _tagResponse(data):
+    body = json.dumps(data)
+    return body, hashlib.sha1(body).hexdigest()
+
+def cachedResponse(clusterID, leagueName, makeFn):
+    """
+    serves JSON from makeFn() through responseCache, with an ETag;
+    requests whose If-None-Match carries the current ETag get a 304
+    """
+    generation = _cacheGeneration(clusterID)
+    key = (str(clusterID), str(leagueName), request.full_path, generation)
+    body, tag = responseCache.fetch(key, lambda: _tagResponse(makeFn()))
+    if _cacheGeneration(clusterID) != generation: responseCache.invalidate(key)
+    if request.if_none_match.contains(tag): response = Response(status=304)
+    else: response = Response(body, mimetype='application/json')
+    response.set_etag(tag)
+    return response
+
+def _cacheGeneration(clusterID):
+    """identifies the writes a cluster's cached responses have seen"""
+    return (cacheGenerations.get(None, 0),
+            cacheGenerations.get(str(clusterID), 0))
+
+def invalidateCluster(clusterID=None):
+    """drops cached responses for a cluster (by default, every cluster)"""
+    clusterKey = None if clusterID is None else str(clusterID)
+    cacheGenerations.set(clusterKey, next(_generationCounter))
+    if clusterKey is None: responseCache.clear()
+    else: responseCache.invalidateMatching(lambda key: key[0] == clusterKey)
+
+def invalidates(func):
+    """
+    route decorator for writes: invalidates the cluster's responses,
+    unless the request failed authentication (and so wrote nothing)
+    """
+    @wraps(func)
+    def func_wrapper(*args, **kwargs):
+        authorized = True
+        try: return func(*args, **kwargs)
+        except AuthError:
+            authorized = False
+            raise
+        finally:
+            if authorized: invalidateCluster(kwargs['clusterID'])
+    return func_wrapper
 
 def runLeagueOrder(clusterID, leagueName, req, order, orderFn):
     verifyAgent(req)
-    league = fetchLeague(clusterID, leagueName)
+    league = fetchWritableLeague(clusterID, leagueName)
     orderFn(league, order)
     return packageDict(league.parent.events)
 
@@ -141,12 +290,94 @@ def _getOrderList(req):
         index += 1
     return results
 
-def _runSingleCluster(cluster, globalMgr, events):
-    """runs a single cluster (helper for run function)"""
+def _routeOrders(orders):
+    """
+    groups orders by their league, keeping each order's position;
+    orders that aren't objects are left out
+    """
+    names, routed = list(), dict()
+    for index, order in enumerate(orders):
+        if not isinstance(order, dict): continue
+        name = str(order.get('league'))
+        if name not in routed: names.append(name)
+        routed.setdefault(name, list()).append((index, order))
+    return [(name, routed[name]) for name in names]
+
+def _failedOrders(batch, message):
+    return [{'type': order.get('type'), 'error': True, 'message': message}
+            for _index, order in batch]
+
+def runClusterOrders(cluster, agent, orders):
+    """
+    executes orders addressed to any leagues in a loaded cluster, building
+    each League once; returns a result dict per order, in request order
+    """
+    results = [None if isinstance(order, dict) else {'type': None,
+               'league': None, 'error': True,
+               'message': "Order must be an object"} for order in orders]
+    for name, batch in _routeOrders(orders):
+        try:
+            league = cluster.fetchLeague(name)
+            leagueResults = league.executeOrders(agent,
+                [order for _index, order in batch])
+        except Exception as e:
+            leagueResults = _failedOrders(batch, str(e))
+        for (index, _order), result in zip(batch, leagueResults):
+            result['league'] = name
+            results[index] = result
+    return results
+
+def _runSingleCluster(cluster, globalMgr, plan=False):
+    """runs (or plans a run of) a single cluster (helper for run function)"""
     manager = LeagueManager(cluster, globalMgr)
-    manager.run()
-    for event in manager.events['events']:
-        events.append(event)
+    if not plan:
+        manager.run()
+        return manager.events
+    return dict(manager.events, plan=manager.run(dryRun=True))
+
+def _numericArg(req, key, default, lower, upper, process_fn=int):
+    """
+    fetches a numeric query argument clamped between lower and upper,
+    falling back on a default if it's missing or malformed
+    """
+    try: value = process_fn(req.args.get(key, default))
+    except (TypeError, ValueError): return default
+    if value != value: return default # NaN
+    return min(max(value, lower), upper)
+
+def _aggregateRun(tasks):
+    """combines finished cluster tasks into a single /run report"""
+    report = {'error': False, 'events': list(), 'clusters': list()}
+    for task in tasks:
+        clusterReport = task.report
+        clusterReport['cluster'] = clusterReport.pop('label')
+        events = task.result if task.finished.is_set() else None
+        if events is not None:
+            report['events'] += events['events']
+            clusterReport['error'] = (clusterReport['error'] or
+                                      events['error'])
+            if 'plan' in events: clusterReport['plan'] = events['plan']
+        if clusterReport['error'] or clusterReport['timedOut']:
+            report['error'] = True
+        report['clusters'].append(clusterReport)
+    return report
+
+def runClusters(workers=RUN_WORKERS, deadline=RUN_DEADLINE, plan=False):
+    """
+    runs every cluster on a bounded pool of workers,
+    waiting at most deadline seconds on each cluster
+    with plan, only reports what each cluster's run would do
+    """
+    tasks, clusters = list(), creds().getAllDatabases(checkFormat=False)
+    globalMgr = globalManager()
+    for cluster in clusters:
+        if cluster.sheet.ID == globalMgr.database.sheet.ID: continue
+        databasePool.set(cluster.sheet.ID, cluster)
+        tasks.append(Task(cluster.sheet.ID, _runSingleCluster, cluster,
+                          globalMgr, plan))
+    try: return _aggregateRun(Scheduler(workers, deadline).run(tasks))
+    finally:
+        if not plan: invalidateCluster()
 
 def _fetchAgentAndCluster(req, clusterID):
     verifyAgent(req)
@@ -154,6 +385,72 @@ def _fetchAgentAndCluster(req, clusterID):
     agent = req.args.get('agent')
     return agent, cluster
 
+def _isTrue(value):
+    return str(value).lower() in {'1', 'true'}
+
+def _isAsync(req):
+    return _isTrue(req.args.get('async', ''))
+
+def _isPlan(req):
+    return _isTrue(req.args.get('plan', ''))
+
+def submitJob(fn, *args):
+    """
+    queues fn(job, *args) on the background executor
+    returns a message containing the new job's ID
+    """
+    job = Task(uuid.uuid4().hex, fn)
+    job.args = (job,) + args
+    jobs.set(job.label, job)
+    executor.submit(job)
+    return packageDict({'error': False, 'job': job.label})
+
+def _releaseCluster(job):
+    """keeps only a finished job's phases and events, not its cluster"""
+    cluster = job.context.get('cluster')
+    if cluster is None: return
+    job.context.update(phases=list(cluster.phases), events=cluster.events)
+    del job.context['cluster']
+
+def _runClusterJob(job, clusterID):
+    """background version of runCluster"""
+    try:
+        cluster = job.context['cluster'] = fetchCluster(clusterID)
+        cluster.run()
+    finally:
+        _releaseCluster(job)
+        invalidateCluster(clusterID)
+    return cluster.events
+
+def _runLeagueJob(job, clusterID, agent, leagueName):
+    """background version of runLeague"""
+    try:
+        cluster = job.context['cluster'] = fetchCluster(clusterID)
+        cluster.runLeague(agent, leagueName)
+    finally:
+        _releaseCluster(job)
+        invalidateCluster(clusterID)
+    return cluster.events
+
+def _jobState(job):
+    if job.finished.is_set():
+        return 'failed' if job.error is not None else 'finished'
+    return 'running' if job.started.is_set() else 'queued'
+
+def jobStatus(job):
+    """packages a background job's progress as a dict"""
+    status = job.report
+    status['job'] = status.pop('label')
+    status['status'] = _jobState(job)
+    cluster = job.context.get('cluster')
+    if cluster is not None:
+        status['phases'] = list(cluster.phases)
+        status['events'] = cluster.events
+    elif 'events' in job.context: # finished; its cluster was released
+        status['phases'] = job.context['phases']
+        status['events'] = job.context['events']
+    return status
+
 # [START app]
 ## toplevel
 @app.route('/')
@@ -168,6 +465,13 @@ def version():
     """fetches the CSL standard version supported by this bot"""
     return CSL_VERSION
 
+@app.route('/jobs/<string:jobID>')
+def fetchJob(jobID):
+    """fetches the progress or results of a background run"""
+    job = jobs.get(jobID)
+    if job is None: return packageMessage("Nonexistent job", error=True)
+    return packageDict(jobStatus(job))
+
 @app.route('/agentToken')
 def getAgentToken():
     """lets agents/interfaces get their tokens"""
@@ -201,15 +505,14 @@ def login():
 
 @app.route('/run')
 def run():
-    """runs all clusters linked to the cslbot instance"""
-    events, clusters = list(), creds().getAllDatabases(checkFormat=False)
-    globalMgr = globalManager()
-    for cluster in clusters:
-        if cluster.sheet.ID == globalMgr.database.sheet.ID: continue
-        clusterThread = Thread(target=_runSingleCluster,
-            args=(cluster, globalMgr, events))
-        clusterThread.start()
-    return packageDict({'events': events, 'error': False})
+    """
+    runs all clusters linked to the cslbot instance
+    (query args: workers and deadline - capped at their defaults,
+     plan - to only report planned writes)
+    """
+    return packageDict(runClusters(_numericArg(request, 'workers',
+        RUN_WORKERS, 1, RUN_WORKERS), _numericArg(request, 'deadline',
+        RUN_DEADLINE, 1, RUN_DEADLINE, float), _isPlan(request)))
 
 ## cluster operations
 @app.route(clusterPath(), strict_slashes=False)
@@ -218,28 +521,57 @@ def clusterCommands(clusterID):
     """fetches commands for all leagues in the cluster"""
     return packageDict(_clusterCommands(clusterID))
 
+@app.route(clusterPath('/stats'))
+def clusterStats(clusterID):
+    """fetches operation counts and phase times from recent cluster runs"""
+    runs = statsStore.fetch(clusterID)
+    return packageDict({'latest': (runs[-1] if len(runs) else None),
+                        'runs': runs})
+
 @app.route(clusterPath('/authorize'))
 def authorize(clusterID):
     """authorizes a cluster-admin relationship"""
     return redirect(buildAuthURL(clusterID))
 
 @app.route(clusterPath('/run'), methods=['GET', 'POST'])
+@invalidates
 def runCluster(clusterID):
-    """runs all leagues in the cluster"""
+    """
+    runs all leagues in the cluster (in the background with ?async=1);
+    with ?plan=1, only reports the writes and API calls it would make
+    """
     verifyAgent(request)
+    if _isAsync(request): return submitJob(_runClusterJob, clusterID)
     cluster = fetchCluster(clusterID)
+    if _isPlan(request):
+        return packageDict(dict(cluster.events, plan=cluster.run(dryRun=True)))
     cluster.run()
     return packageDict(cluster.events)
 
 ## league operations
+@app.route(clusterPath('/executeOrders'), methods=['GET', 'POST'])
+@invalidates
+def executeClusterOrders(clusterID):
+    """executes orders for many leagues, each naming its own league"""
+    verifyAgent(request)
+    cluster = fetchCluster(clusterID)
+    cluster.checkAdmin()
+    results = runClusterOrders(cluster, request.args.get('agent'),
+                               _getOrderList(request))
+    return packageDict({'error': any(r['error'] for r in results),
+                        'results': results, 'events': cluster.events})
+
 @app.route(leaguePath(), strict_slashes=False)
 def showLeague(clusterID, leagueName):
+    return cachedResponse(clusterID, leagueName, lambda:
+        _showLeague(clusterID, leagueName))
+
+def _showLeague(clusterID, leagueName):
     league = fetchLeague(clusterID, leagueName)
     teams = league.fetchAllTeams()
     games = league.fetchAllGames()
     templates = league.fetchAllTemplates()
-    return packageDict({'teams': teams, 'games': games,
-        'templates': templates})
+    return {'teams': teams, 'games': games, 'templates': templates}
 
 @app.route(leaguePath('/commands'))
 def leagueCommands(clusterID, leagueName):
@@ -253,23 +585,32 @@ def leagueCommands(clusterID, leagueName):
 @app.route(leaguePath('/allTemplates'))
 def fetchGroup(clusterID, leagueName):
     urlRule = rule(request).replace('all', '').lower()
-    fetchFn = {'teams': lambda lg: lg.fetchAllTeams(),
-        'games': lambda lg: lg.fetchAllGames(),
-        'templates': lambda lg: lg.fetchAllTemplates()}[urlRule]
-    return fetchLeagueData(clusterID, leagueName, fetchFn)
+    query = listingQuery(request)
+    fetchFn = {'teams': lambda lg: lg.fetchAllTeams(query),
+        'games': lambda lg: lg.fetchAllGames(query),
+        'templates': lambda lg: lg.fetchAllTemplates(query)}[urlRule]
+    if leagueName == LeagueManager.LG_ALL:
+        return streamLeagueData(clusterID, fetchFn)
+    return cachedResponse(clusterID, leagueName, lambda:
+        leagueData(clusterID, leagueName, fetchFn))
 
 @app.route(leaguePath('/team/<int:ID>'))
 @app.route(leaguePath('/game/<int:ID>'))
 @app.route(leaguePath('/template/<int:ID>'))
 def fetchEntity(clusterID, leagueName, ID):
+    entityType = rule(request, 2)
+    return cachedResponse(clusterID, leagueName, lambda:
+        _fetchEntity(clusterID, leagueName, entityType, ID))
+
+def _fetchEntity(clusterID, leagueName, entityType, ID):
     league = fetchLeague(clusterID, leagueName)
-    value =  {'team': league.fetchTeam, 'game': league.fetchGame,
-        'template': league.fetchTemplate}[rule(request, 2)](ID)
-    return packageDict(value)
+    return {'team': league.fetchTeam, 'game': league.fetchGame,
+        'template': league.fetchTemplate}[entityType](ID)
 
 @app.route(leaguePath('/addTeam'), methods=['GET', 'POST'])
 @app.route(leaguePath('/confirmTeam'), methods=['GET', 'POST'])
 @app.route(leaguePath('/unconfirmTeam'), methods=['GET', 'POST'])
+@invalidates
 def runTeamOrder(clusterID, leagueName):
     urlRule = rule(request)
     fetchFn = {'addTeam': lambda lg, order: lg.addTeam(order),
@@ -285,6 +626,7 @@ def runTeamOrder(clusterID, leagueName):
 @app.route(leaguePath('/addTemplate'), methods=['GET', 'POST'])
 @app.route(leaguePath('/activateTemplate'), methods=['GET', 'POST'])
 @app.route(leaguePath('/deactivateTemplate'), methods=['GET', 'POST'])
+@invalidates
 def handleSimpleOrder(clusterID, leagueName):
     fetchFn = {'setLimit': lambda lg, o: lg.setLimit(o),
         'renameTeam': lambda lg, o: lg.renameTeam(o),
@@ -299,6 +641,7 @@ def handleSimpleOrder(clusterID, leagueName):
 @app.route(leaguePath('/dropTemplates'), methods=['GET', 'POST'])
 @app.route(leaguePath('/undropTemplate'), methods=['GET', 'POST'])
 @app.route(leaguePath('/undropTemplates'), methods=['GET', 'POST'])
+@invalidates
 def dropOrUndrop(clusterID, leagueName):
     if 'undrop' in rule(request):
         fetchFn = lambda lg, order: lg.undropTemplates(order)
@@ -307,14 +650,16 @@ def dropOrUndrop(clusterID, leagueName):
         lists=['templates']), fetchFn)
 
 @app.route(leaguePath('/executeOrders'), methods=['GET', 'POST'])
+@invalidates
 def executeOrders(clusterID, leagueName):
     verifyAgent(request)
-    league = fetchLeague(clusterID, leagueName)
+    league = fetchWritableLeague(clusterID, leagueName)
     orderList = _getOrderList(request)
     league.executeOrders(request.args.get('agent'), orderList)
     return packageDict(league.parent.events)
 
 @app.route(leaguePath('/setCommand'), methods=['GET', 'POST'])
+@invalidates
 def setCommand(clusterID, leagueName):
     """sets a command to a particular value"""
     agent, cluster = _fetchAgentAndCluster(request, clusterID)
@@ -323,11 +668,24 @@ def setCommand(clusterID, leagueName):
     return packageMessage("Successfully set command", error=False)
 
 @app.route(leaguePath('/run'), methods=['GET', 'POST'])
+@invalidates
 def runLeague(clusterID, leagueName):
+    """runs a single league (in the background with ?async=1)"""
+    if _isAsync(request):
+        verifyAgent(request)
+        return submitJob(_runLeagueJob, clusterID,
+                         request.args.get('agent'), leagueName)
     agent, cluster = _fetchAgentAndCluster(request, clusterID)
     cluster.runLeague(agent, leagueName)
     return packageDict(cluster.events)
 
+@app.teardown_request
+def flushLogs(exc=None):
+    """writes out buffered logs for clusters loaded by the request"""
+    for cluster in g.pop('clusters', list()):
+        try: cluster.flushLog()
+        except Exception: continue
+
 ## error handling
 @app.errorhandler(400)
 def badRequest():
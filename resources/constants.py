@@ -1,4 +1,6 @@
 # imports
+from os import environ
+from tempfile import gettempdir
 from os.path import realpath, dirname, pardir, normpath, join as pathjoin
 
 # functions
@@ -14,3 +16,27 @@ GLOBAL_MANAGER = ""
 LATEST_RUN = "LATEST RUN"
 OWNER_ID = 0
 CSL_VERSION = '1.0'
+POOL_TTL = 1800 # seconds to reuse Google credentials and spreadsheet handles
+RUN_WORKERS = 8 # clusters run concurrently by /run
+RUN_DEADLINE = 600 # seconds before /run stops waiting on a cluster
+JOB_WORKERS = 2 # background cluster/league runs executed at once
+JOB_TTL = 86400 # seconds a finished background job stays queryable
+JOB_CACHE_SIZE = 256 # background jobs kept queryable at once
+TOKEN_CACHE_TTL = 900 # seconds an agent token verification is reused
+TOKEN_CACHE_SIZE = 1024 # agents whose verified tokens are remembered
+GLOBAL_SNAPSHOT_TTL = 60 # seconds before the Admins/Agents snapshot is reloaded
+RESPONSE_TTL = 120 # seconds a cached league GET response is served
+RESPONSE_CACHE_SIZE = 512 # league GET responses kept in memory
+CACHE_GENERATIONS_SIZE = 1024 # clusters whose write generations are kept
+CACHE_DIR = environ.get("CSLBOT_CACHE_DIR", # best-effort local caches;
+                       pathjoin(gettempdir(), "cslbot")) # may not persist
+MIRROR_TTL = 30 # seconds a synced forum thread mirror is reused as-is
+MIRROR_REVALIDATE = 3600 # seconds before mirrored pages are checked again
+MIRROR_RECHECK_PAGES = 2 # last full pages refetched when revalidating
+MIRROR_CACHE_SIZE = 32 # forum threads mirrored in memory
+PAGE_WORKERS = 4 # forum thread pages fetched at once
+VERDICT_CACHE_SIZE = 256 # league threads whose validation verdicts are kept
+MEMBER_CACHE_TTL = 21600 # seconds a player's Warlight membership is reused
+MEMBER_NEGATIVE_TTL = 600 # seconds a non-member answer is reused
+MEMBER_CACHE_SIZE = 2048 # players whose membership is remembered
+STATS_HISTORY = 20 # recent runs whose stats are kept per cluster
@@ -0,0 +1,228 @@
+###########################
+# dry_run.py
+# planning runs without side effects
+###########################
+
+# imports
+from threading import Lock, RLock
+from sheetDB import errors as SheetErrors
+from sheetDB.functions import convertToKeyed
+from sheetDB.table import Table
+
+# Plan class
+class Plan(object):
+    """
+    tallies the sheet writes and Warlight API calls a run would make
+    sheet counts are in cells (updates, constraints), rows (appends,
+    deletes) and columns (header), one request each in sheetDB
+    """
+
+    def __init__(self):
+        self._sheets, self._api = dict(), dict()
+        self._lock = Lock()
+
+    def recordWrite(self, table, op, count=1):
+        if not count: return
+        with self._lock:
+            ops = self._sheets.setdefault(table, dict())
+            ops[op] = ops.get(op, 0) + count
+
+    def recordCall(self, call):
+        with self._lock: self._api[call] = self._api.get(call, 0) + 1
+
+    @property
+    def report(self):
+        with self._lock:
+            sheets = {table: dict(ops) for table, ops in self._sheets.items()}
+            api = dict(self._api)
+        return {'sheets': sheets, 'api': api,
+                'sheetWrites': sum(sum(ops.values())
+                                   for ops in sheets.values()),
+                'apiCalls': sum(api.values())}
+
+# TableView class
+class TableView(object):
+    """
+    copy-on-write stand-in for a sheetDB Table: the table is read once,
+    on first use, and writes change that copy and are recorded in a
+    Plan instead of being sent to the sheet
+    :param table: Table object to mirror
+    :param plan: Plan recording the writes
+    """
+
+    POSITIVE = 'positive'
+
+    def __init__(self, table, plan):
+        self.table = table
+        self.plan = plan
+        self.title = table.sheet.title
+        self.reverseHeader = dict(table.reverseHeader)
+        self._entities = None
+        self._lock = RLock()
+
+    def __getattr__(self, name):
+        return getattr(self.table, name)
+
+    @property
+    def entities(self):
+        with self._lock:
+            if self._entities is None:
+                self._entities = self.table.getAllEntities()
+            return self._entities
+
+    def _constrained(self, label, value):
+        constraint = self.table.constraints.get(self.reverseHeader[label], "")
+        return self.table.getConstrained(value, constraint)
+
+    def _matchKey(self, label, match):
+        """returns the set of matching strings and whether to match them"""
+        if isinstance(match, dict):
+            values = ([match['value'],] if 'value' in match
+                      else match['values'])
+            positive = (match['type'].lower() == self.POSITIVE)
+        else: values, positive = [match,], True
+        col = self.reverseHeader[label]
+        keys = self.table.getConstrainedKey(col, [str(v) for v in values])
+        return {str(key) for key in keys}, positive
+
+    def _findIndices(self, matchDict):
+        for label in matchDict:
+            if label not in self.reverseHeader:
+                raise SheetErrors.DataError("Invalid label!")
+        keys = {label: self._matchKey(label, matchDict[label])
+                for label in matchDict}
+        return [i for i, entity in enumerate(self.entities) if
+                all((str(entity.get(label, "")) in keys[label][0]) ==
+                    keys[label][1] for label in keys)]
+
+    def findEntities(self, matchDict, keyLabel=None, allowDuplicates=False):
+        with self._lock:
+            results = [dict(self.entities[i]) for i in
+                       self._findIndices(matchDict)]
+        if keyLabel is not None:
+            results = convertToKeyed(results, keyLabel, allowDuplicates)
+        return results
+
+    def getAllEntities(self, keyLabel=None, allowDuplicates=False):
+        return self.findEntities(dict(), keyLabel, allowDuplicates)
+
+    def findValue(self, matchDict, attribute):
+        values = list()
+        for entity in self.findEntities(matchDict):
+            if attribute not in entity:
+                raise SheetErrors.DataError("Checking label not in header: " +
+                                            str(attribute))
+            values.append(entity[attribute])
+        return values
+
+    def expandHeader(self, *labels):
+        with self._lock:
+            for label in labels:
+                if label in self.reverseHeader:
+                    raise SheetErrors.DataError("Duplicate label!")
+                self.reverseHeader[label] = (max(self.reverseHeader.values()
+                                                 or [0,]) + 1)
+            self.plan.recordWrite(self.title, 'header', len(labels))
+
+    def updateConstraint(self, label, constraint, erase=False):
+        if label not in self.reverseHeader:
+            raise SheetErrors.DataError("Nonexistent label!")
+        self.plan.recordWrite(self.title, 'constraint')
+
+    def _setValues(self, entity, values):
+        for label in values:
+            if label not in self.reverseHeader: self.expandHeader(label)
+            entity[label] = self._constrained(label, values[label])
+
+    def addEntity(self, entity):
+        with self._lock:
+            added = {label: "" for label in self.reverseHeader}
+            self._setValues(added, entity)
+            self.entities.append(added)
+            self.plan.recordWrite(self.title, 'append')
+
+    @classmethod
+    def _collapseDict(cls, matchDict):
+        """turns a match dictionary into the entity it would create"""
+        results = dict()
+        for label, match in matchDict.items():
+            if not isinstance(match, dict): results[label] = match
+            elif ('value' in match and
+                  match['type'].lower() == cls.POSITIVE):
+                results[label] = match['value']
+        return results
+
+    def updateMatchingEntities(self, matchDict, updates, createNew=False):
+        with self._lock:
+            found = self._findIndices(matchDict)
+            if not len(found) and createNew:
+                collapsed = self._collapseDict(matchDict)
+                self.addEntity(collapsed)
+                found = self._findIndices(collapsed)
+            for i in found: self._setValues(self.entities[i], updates)
+            self.plan.recordWrite(self.title, 'update',
+                                  len(found) * len(updates))
+
+    def removeMatchingEntities(self, matchDict):
+        with self._lock:
+            found = set(self._findIndices(matchDict))
+            self._entities = [entity for i, entity in
+                              enumerate(self.entities) if i not in found]
+            self.plan.recordWrite(self.title, 'delete', len(found))
+
+# PlannedTable class
+class PlannedTable(Table):
+    """
+    empty stand-in for a table a run would create: no header, no rows;
+    only constraint handling is inherited, so it never reads the sheet
+    (wrap it in a TableView like any other table)
+    :param title: title of the worksheet that would be created
+    :param parent: sheetDB Database object it would be created in
+    """
+
+    class _Worksheet(object):
+        def __init__(self, title):
+            self.title, self.ID = title, None
+            self.rowCount, self.colCount = 1, 1
+
+    def __init__(self, title, parent):
+        self._sheet = self._Worksheet(title)
+        self._parent = parent
+        self.name = None
+        self.headerRow, self.refRow = 1, None
+        self.ignoredRows, self.ignoredCols = {1,}, set()
+        self.header, self.reverseHeader = dict(), dict()
+        self.constraints = dict()
+
+    def getAllEntities(self, keyLabel=None, allowDuplicates=False):
+        return dict() if keyLabel is not None else list()
+
+# HandlerView class
+class HandlerView(object):
+    """
+    wraps a Warlight API handler so every call is counted in a Plan;
+    game creation and deletion are only recorded, never sent
+    :param handler: APIHandler object to wrap
+    :param plan: Plan recording the calls
+    """
+
+    PLANNED_GAME = "PLANNED"
+
+    def __init__(self, handler, plan):
+        self.handler = handler
+        self.plan = plan
+
+    def __getattr__(self, name):
+        attr = getattr(self.handler, name)
+        if not callable(attr): return attr
+        def call(*args, **kwargs):
+            self.plan.recordCall(name)
+            return attr(*args, **kwargs)
+        return call
+
+    def createGame(self, *args, **kwargs):
+        self.plan.recordCall('createGame')
+        return self.PLANNED_GAME
+
+    def deleteGame(self, *args, **kwargs):
+        self.plan.recordCall('deleteGame')
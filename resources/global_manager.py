@@ -6,7 +6,13 @@
 # imports
 import random
 import string
+import hashlib
+import time
+from threading import RLock
 from passlib.hash import pbkdf2_sha256 as token_hash
+from resources.utility import TTLCache
+from resources.constants import TOKEN_CACHE_TTL, TOKEN_CACHE_SIZE, \
+    GLOBAL_SNAPSHOT_TTL
 
 # main GlobalManager class
 class GlobalManager(object):
@@ -19,11 +25,21 @@ class GlobalManager(object):
                    'TOKEN HASH': 'STRING',
                    'BANNED': 'BOOL'}
 
-    def __init__(self, database):
-        """takes a sheetDB Database object"""
+    # agent ID -> (token digest, TOKEN HASH) for recently verified tokens
+    verifiedTokens = TTLCache(TOKEN_CACHE_TTL, TOKEN_CACHE_SIZE)
+
+    def __init__(self, database, snapshotTTL=GLOBAL_SNAPSHOT_TTL):
+        """
+        takes a sheetDB Database object
+        :param snapshotTTL: seconds to serve lookups from the in-memory
+                            snapshot of the Admins and Agents tables
+        """
         self.database = database
         self.admins = self._fetchTable(self.ADMIN_SHEET, "Admins")
         self.agents = self._fetchTable(self.AGENT_SHEET, "Agents")
+        self.snapshotTTL = snapshotTTL
+        self._snapshot, self._snapshotTime = None, None
+        self._lock = RLock()
 
     @staticmethod
     def _makeHeaderAndConstraints(sheet):
@@ -36,6 +52,46 @@ class GlobalManager(object):
         return self.database.fetchTable(title, 1, 2, header=header,
             constraints=constraints)
 
+    @staticmethod
+    def _key(ID):
+        return str(ID).strip()
+
+    @staticmethod
+    def _isBanned(data):
+        return str(data.get('BANNED')).lower() == 'true'
+
+    def _splitAuthorized(self, data):
+        return [v for v in str(data.get('AUTHORIZED') or '').split(self.SEP_ID)
+                if len(v)]
+
+    def _loadSnapshot(self):
+        admins, authorized, agents = dict(), dict(), dict()
+        for data in self.admins.getAllEntities():
+            key = self._key(data['ID'])
+            admins[key] = data
+            if not self._isBanned(data):
+                authorized[key] = frozenset(self._splitAuthorized(data))
+        for data in self.agents.getAllEntities():
+            agents[self._key(data['ID'])] = data
+        return {'admins': admins, 'authorized': authorized, 'agents': agents}
+
+    @property
+    def snapshot(self):
+        """
+        ID-indexed copies of the Admins and Agents tables, with the set of
+        clusters each unbanned admin may manage; reloaded once stale
+        """
+        with self._lock:
+            if (self._snapshot is None or
+                time.time() - self._snapshotTime > self.snapshotTTL):
+                self._snapshot = self._loadSnapshot()
+                self._snapshotTime = time.time()
+            return self._snapshot
+
+    def refresh(self):
+        """drops the snapshot so the next lookup reloads both tables"""
+        with self._lock: self._snapshot = None
+
     @staticmethod
     def _randStr(length):
         return ''.join(random.SystemRandom().choice(string.letters +
@@ -45,18 +101,37 @@ class GlobalManager(object):
         TOKEN_LEN = 64
         token = self._randStr(TOKEN_LEN)
         tokenHash = token_hash.hash(token)
-        self.agents.updateMatchingEntities({'ID': agentID},
-            {'TOKEN HASH': tokenHash}, True)
+        with self._lock:
+            self.agents.updateMatchingEntities({'ID': agentID},
+                {'TOKEN HASH': tokenHash}, True)
+            self.refresh()
+        self.verifiedTokens.invalidate(str(agentID))
         return token
 
+    @staticmethod
+    def _tokenDigest(token):
+        return hashlib.sha256(str(token)).hexdigest()
+
+    def _verifyToken(self, agentID, token, tokenHash):
+        """
+        checks a token against its stored hash, skipping key derivation
+        if the same token was verified against the same hash recently
+        """
+        key, verified = str(agentID), (self._tokenDigest(token), tokenHash)
+        if self.verifiedTokens.get(key) == verified: return True
+        if not token_hash.verify(token, tokenHash): return False
+        self.verifiedTokens.set(key, verified)
+        return True
+
     def verifyAgent(self, agentID, token):
-        found = self.agents.findEntities({'ID': agentID})
-        if (len(found) and str(found[0]['BANNED']).lower() != 'true'):
-            return token_hash.verify(token, found[0]['TOKEN HASH'])
+        found = self.snapshot['agents'].get(self._key(agentID))
+        if found is not None and not self._isBanned(found):
+            return self._verifyToken(agentID, token, found['TOKEN HASH'])
+        self.verifiedTokens.invalidate(str(agentID))
         return False
 
     def _authorizeExistingAdmin(self, data, clusterID):
-        clusters = [v for v in data['AUTHORIZED'].split(self.SEP_ID) if len(v)]
+        clusters = self._splitAuthorized(data)
         clusters.append(str(clusterID))
         self.admins.updateMatchingEntities({'ID': data['ID']},
             {'AUTHORIZED': (self.SEP_ID).join(c for c in clusters)})
@@ -65,12 +140,17 @@ class GlobalManager(object):
         self.admins.addEntity({'ID': adminID, 'AUTHORIZED': str(clusterID)})
 
     def updateAdmin(self, adminID, clusterID):
-        found = self.admins.findEntities({'ID': adminID})
-        if len(found): self._authorizeExistingAdmin(found[0], clusterID)
-        else: self._createNewAdmin(adminID, clusterID)
+        """
+        authorizes an admin for a cluster, adding them if they're new;
+        whether their row exists is read from the live table, since a
+        stale snapshot could add a duplicate
+        """
+        with self._lock:
+            found = self.admins.findEntities({'ID': adminID})
+            if len(found): self._authorizeExistingAdmin(found[0], clusterID)
+            else: self._createNewAdmin(adminID, clusterID)
+            self.refresh()
 
     def verifyAdmin(self, adminID, clusterID):
-        found = self.admins.findEntities({'ID': adminID, 'BANNED': {'values':
-            [True, 'TRUE'], 'type': 'negative'}})
-        return (len(found) and
-                str(clusterID) in found[0]['AUTHORIZED'].split(self.SEP_ID))
+        authorized = self.snapshot['authorized'].get(self._key(adminID), ())
+        return str(clusterID) in authorized
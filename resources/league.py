@@ -19,6 +19,8 @@ from wl_api.wl_api import APIError
 from sheetDB import errors as SheetErrors
 from resources.constants import TIMEFORMAT, DEBUG_KEY, LATEST_RUN
 from resources.utility import isInteger, WLHandler
+from resources.run_stats import RunStats
+from resources.order_record import OrderRecord
 
 # global locks
 teamLock, tempLock = RLock(), RLock()
@@ -36,10 +38,17 @@ def tryOrLog(func, self, reraise=False, *args, **kwargs):
 
 def runPhase(func):
     """
-    function decorator to log failures if phase fails
+    function decorator to log failures if phase fails,
+    report how long the phase took and write out the phase's log
     """
     def func_wrapper(self, *args, **kwargs):
-        return tryOrLog(func, self, False, *args, **kwargs)
+        start = time.time()
+        try: return tryOrLog(func, self, False, *args, **kwargs)
+        finally:
+            self.parent.recordPhase(self.name, func.__name__,
+                                    time.time() - start)
+            try: self.parent.flushLog()
+            except Exception: pass # entries stay buffered for the next flush
     return func_wrapper
 
 def noisy(func):
@@ -86,7 +95,7 @@ class League(object):
     :param templates: the league's templates Table
     :param settings: league-relevant settings (as a dict)
     :param orders: thread orders relevant to the league
-    :param admin: ID of league admin
+    :param admin: ID of league admin (None to use the parent's)
     :param mods: set of IDs of league moderators
     :param parent: parent LeagueManager object
     :param name: name of this league
@@ -275,7 +284,7 @@ class League(object):
         self.thread = thread
         self.debug = self._fetchProperty(self.SET_DEBUG, False,
                                          self._getBoolProperty)
-        self.mods = self._getMods()
+        self._mods = None
         self.handler = WLHandler()
         self._checkFormat()
         self._makeRateSysDict()
@@ -346,6 +355,24 @@ class League(object):
             self.ORD_RENAME_TEAM: {'internal': self._renameTeam,
             'external': self.renameTeam}}
 
+    @property
+    def admin(self):
+        """ID of the league admin; defers to the parent's if not given"""
+        return self.parent.admin if self._admin is None else self._admin
+
+    @admin.setter
+    def admin(self, value):
+        self._admin = value
+
+    @property
+    def mods(self):
+        if self._mods is None: self._mods = self._getMods()
+        return self._mods
+
+    @mods.setter
+    def mods(self, value):
+        self._mods = value
+
     @noisy
     def _getMods(self):
         mods = self._fetchProperty(self.SET_MODS, set(), self.getIDGroup)
@@ -1264,12 +1291,17 @@ class League(object):
         return (str(player) in self.allowedPlayers or
                 self.KW_ALL in self.allowedPlayers)
 
+    def _makePlayerParser(self, playerID):
+        """makes a profile page parser, counting the scrape for run stats"""
+        self.parent.countOperation(RunStats.SCRAPES, self.name)
+        return PlayerParser(playerID)
+
     @noisy
     def _allowed(self, playerID):
         """returns True if a player is allowed to join the league"""
         player = int(playerID)
         if self._playerExplicitlyAllowed(player): return True
-        parser = PlayerParser(player)
+        parser = self._makePlayerParser(player)
         if not self._checkPrereqs(parser):
             return False
         return (str(player) not in self.bannedPlayers and
@@ -1404,10 +1436,9 @@ class League(object):
         if not self.joinsAllowed:
             raise ImproperInput("This league is not open to new teams")
 
-    @staticmethod
-    def _checkConsistentClan(members, required):
+    def _checkConsistentClan(self, members, required):
         if not required: return
-        clans = {PlayerParser(member).clanID for member in members}
+        clans = {self._makePlayerParser(member).clanID for member in members}
         if len(clans) > 1:
             failStr = "All members of a team must belong to the same clan"
             raise ImproperInput(failStr)
@@ -1533,9 +1564,12 @@ class League(object):
 
     @noisy
     def _setLimit(self, order):
+        order = self._compileOrder(order) # external orders arrive as dicts
+        if order.limit is None:
+            raise ImproperInput("set_limit needs a team and an integer limit")
         matchingTeam = self._fetchMatchingTeam(order)[0]
-        self._checkLimitChange(matchingTeam.get('ID'), order['orders'][2])
-        self._changeLimit(matchingTeam.get('ID'), order['orders'][2])
+        self._checkLimitChange(matchingTeam.get('ID'), order.limit)
+        self._changeLimit(matchingTeam.get('ID'), order.limit)
 
     @property
     def templateIDs(self):
@@ -1721,21 +1755,94 @@ class League(object):
         self._updateEntityValue(self.teams, matchingTeam['ID'],
                                 identifier='ID', Name=newName)
 
+    def _orderKind(self, order):
+        """returns the lowercased type of an order, checking it's runnable"""
+        kind = getattr(order, 'kind', None)
+        if kind is None:
+            if (not isinstance(order, dict) or
+                not isinstance(order.get('type'), basestring)):
+                raise ImproperInput("Order must be an object with a type")
+            kind = order['type'].lower()
+        if kind not in self.orderDict:
+            raise ImproperInput("Unrecognized order type: %s" % (kind))
+        return kind
+
     @noisy
     def _runOrderExecution(self, orders, accessType):
+        """
+        runs orders in sequence; returns a result dict for each order
+        (a malformed order only fails its own result)
+        """
+        results = list()
         for order in orders:
-            orderType = order['type'].lower()
+            result = {'type': (order.get('type') if hasattr(order, 'get')
+                               else None), 'error': False, 'message': None}
             try:
-                self.orderDict[orderType][accessType](order)
+                self.orderDict[self._orderKind(order)][accessType](order)
             except Exception as e:
+                result['error'], result['message'] = True, str(e)
                 if len(str(e)): # exception has some description string
                     self.parent.log(str(e), self.name, error=True)
                 else:
                     self._logFailedOrder(order)
+            results.append(result)
+        return results
+
+    def _compileOrder(self, order):
+        """
+        makes an OrderRecord, checking a set_limit order's arguments once
+        and storing its team and integer limit (left None if malformed)
+        """
+        if isinstance(order, OrderRecord): return order
+        record = OrderRecord(order)
+        args = record.get('orders', tuple())
+        if (getattr(record, 'kind', None) == self.ORD_SET_LIMIT and
+            len(args) >= 3):
+            record.team = args[1]
+            try: record.limit = int(args[2])
+            except ValueError: pass
+        return record
+
+    def _supersedableLimit(self, record):
+        """
+        returns the (author, team) a compiled set_limit order is keyed on
+        if a later order with the same key would make it moot, else None
+        """
+        limit = record.limit
+        if limit is None or limit < 0 or 'author' not in record: return None
+        if not (limit == 0 or self.constrainLimit or
+                self._limitInRange(limit)): return None
+        return str(record['author']), record.team
+
+    def _compileOrders(self, orders):
+        """
+        compiles thread orders into OrderRecords as they come in; without an
+        active capacity a set_limit order only depends on its own team, so
+        one followed by another from the same author for the same team
+        (with only other teams' set_limit orders in between) is dropped
+        """
+        collapse = (self.activeCapacity is None)
+        held, latest = list(), dict()
+        for order in orders:
+            record = self._compileOrder(order)
+            key = self._supersedableLimit(record) if collapse else None
+            if key is None:
+                for heldRecord in held:
+                    if heldRecord is not None: yield heldRecord
+                held, latest = list(), dict()
+                yield record
+                continue
+            author, team = key
+            if team in latest and latest[team][0] == author:
+                held[latest[team][1]] = None
+            latest[team] = (author, len(held))
+            held.append(record)
+        for heldRecord in held:
+            if heldRecord is not None: yield heldRecord
 
     @runPhase
     def _executeOrders(self):
-        self._runOrderExecution(self.orders, 'internal')
+        self._runOrderExecution(self._compileOrders(self.orders), 'internal')
         self._updateRanks()
 
     @property
@@ -2366,7 +2473,7 @@ class League(object):
 
     @property
     def adminName(self):
-        parser = PlayerParser(self.admin)
+        parser = self._makePlayerParser(self.admin)
         return str(parser.name)
 
     @staticmethod
@@ -2885,7 +2992,7 @@ class League(object):
                 self._addToSetWithinDict(playerDict, player, ID)
                 if self.forbidClanMatchups:
                     self._addToSetWithinDict(clanDict,
-                                             PlayerParser(player).clanID, ID)
+                        self._makePlayerParser(player).clanID, ID)
         return playerDict, clanDict
 
     @noisy
@@ -2899,7 +3006,7 @@ class League(object):
     @noisy
     def _updateClanConflicts(self, conflicts, player, clansDict):
         if not self.forbidClanMatchups: return
-        playerClan = PlayerParser(player).clanID
+        playerClan = self._makePlayerParser(player).clanID
         conflicts.update(clansDict.get(playerClan, set()))
 
     @property
@@ -3353,22 +3460,80 @@ class League(object):
         return self._fetchAndPackage(self._fetchTeamData, self._packageTeams,
                                      teamID)
 
-    def fetchAllTeams(self):
-        return self._packageTeams(*self.allTeams)
+    @staticmethod
+    def _sliceEntities(entities, offset=0, limit=None):
+        if limit is None: return entities[offset:]
+        return entities[offset:(offset + limit)]
+
+    @staticmethod
+    def _projectEntity(entity, fields):
+        return {field: entity[field] for field in fields if field in entity}
+
+    def _listEntities(self, entities, packageFn, query=None):
+        """
+        applies a listing query's offset, limit and fields to raw rows,
+        packaging only the rows that are returned
+        :param query: dict with any of 'offset', 'limit' (ints) and
+                      'fields' (list of packaged keys to keep)
+        """
+        if query is None: query = dict()
+        entities = self._sliceEntities(list(entities), query.get('offset', 0),
+                                       query.get('limit'))
+        results = self._packageEntities(entities, packageFn)
+        if query.get('fields'):
+            results = [self._projectEntity(r, query['fields'])
+                       for r in results]
+        return results
+
+    def _filterGames(self, games, query):
+        team, after = query.get('team'), query.get('finishedAfter')
+        if team is not None:
+            games = [game for game in games
+                     if str(team) in self._getGameTeams(game)]
+        if after is not None:
+            games = [game for game in games if len(game['Finished']) and
+                     self._unpackDateTime(game['Finished']) > after]
+        return games
+
+    def fetchAllTeams(self, query=None):
+        """
+        :param query: listing query (see _listEntities); 'active' keeps
+                      only teams with a positive limit
+        """
+        if query is None: query = dict()
+        teams = self.activeTeams if query.get('active') else self.allTeams
+        return self._listEntities(teams, self._packageTeam, query)
 
     def fetchGame(self, gameID):
         return self._fetchAndPackage(self._fetchGameData, self._packageGames,
                                      gameID)
 
-    def fetchAllGames(self):
-        return self._packageGames(*self._getExtantEntities(self.games))
+    def fetchAllGames(self, query=None):
+        """
+        :param query: listing query (see _listEntities); 'ongoing' keeps
+                      unfinished games, 'team' games involving a team ID and
+                      'finishedAfter' (datetime) games finished after it
+        """
+        if query is None: query = dict()
+        restrictions = ({'Finished': {'value': '', 'type': 'positive'}}
+                        if query.get('ongoing') else None)
+        games = self._getExtantEntities(self.games, restrictions)
+        return self._listEntities(self._filterGames(games, query),
+                                  self._packageGame, query)
 
     def fetchTemplate(self, templateID):
         return self._fetchAndPackage(self._fetchTemplateData,
                                      self._packageTemplates, templateID)
 
-    def fetchAllTemplates(self):
-        return self._packageTemplates(*self._getExtantEntities(self.templates))
+    def fetchAllTemplates(self, query=None):
+        """
+        :param query: listing query (see _listEntities); 'active' keeps
+                      only active templates
+        """
+        if query is None: query = dict()
+        templates = (self.activeTemplates if query.get('active') else
+                     self._getExtantEntities(self.templates))
+        return self._listEntities(templates, self._packageTemplate, query)
 
     @staticmethod
     def _depackageOrder(order, *args):
@@ -3499,5 +3664,5 @@ class League(object):
 
     def executeOrders(self, agent, orders):
         for order in orders:
-            order['agent'] = agent
-        self._runOrderExecution(orders, 'external')
+            if isinstance(order, dict): order['agent'] = agent
+        return self._runOrderExecution(orders, 'external')
@@ -4,12 +4,20 @@
 ########################
 
 # imports
+import hashlib
 import datetime
-from resources.utility import isInteger
+from threading import Thread, RLock
+from resources.utility import isInteger, TTLCache
 from resources.order_parser import OrderParser
+from resources.thread_mirror import ThreadMirror
 from resources.league import League
-from resources.constants import TIMEFORMAT, LATEST_RUN
-from wl_parsers import ForumThreadParser, PlayerParser
+from resources.scheduler import Scheduler, Task, Feed
+from resources.dry_run import Plan, TableView, HandlerView, PlannedTable
+from resources.run_stats import RunStats, CountingTable, CountingHandler, \
+    statsStore
+from resources.constants import TIMEFORMAT, LATEST_RUN, VERDICT_CACHE_SIZE, \
+    MEMBER_CACHE_TTL, MEMBER_NEGATIVE_TTL, MEMBER_CACHE_SIZE
+from wl_parsers import PlayerParser
 
 # errors
 class ThreadError(Exception):
@@ -33,6 +41,7 @@ class LeagueManager(object):
     LG_ALL = "ALL"
     COMMANDS_HEADER = [TITLE_LG, TITLE_CMD, TITLE_ARG]
     CMD_MAKE = 'LEAGUES'
+    SET_PARALLEL = "PARALLEL LEAGUES" # leagues run at once by run()
     SEP_CMD = ";"
     ABUSE_THRESHOLD = 5
     PREFIX = "[CSL]"
@@ -45,34 +54,132 @@ class LeagueManager(object):
     TITLE_DESC = "Description"
     LOG_HEADER = [TITLE_TIME, TITLE_STATUS, TITLE_DESC]
     LOG_CONSTRAINTS = ["", "BOOL", ""]
+    LOG_BUFFER_SIZE = 50 # entries held before they're written to the sheet
+    LOG_BUFFER_MAX = 1000 # entries kept while the sheet can't be written
+    LOG_ARCHIVE = "Log Archive (%s)"
+    ARCHIVE_TIMEFORMAT = "%Y-%m-%d %H-%M-%S"
+    SET_LOG_ROWS = "LOG MAX ROWS"
+    SET_LOG_AGE = "LOG MAX AGE" # in days
+    LOG_MAX_ROWS = 5000
+    LOG_MAX_AGE = 30
 
     ## sheets
     SHEET_GAMES = "Game Data"
     SHEET_TEMPLATES = "Template Data"
     SHEET_TEAMS = "Team Data"
 
+    # thread validation verdicts shared by every manager in the process
+    threadVerdicts = TTLCache(maxSize=VERDICT_CACHE_SIZE)
+    # Warlight membership by player ID, shared the same way
+    memberships = TTLCache(MEMBER_CACHE_TTL, MEMBER_CACHE_SIZE)
+
     def __init__(self, database, manager):
         """takes a sheetDB Database object and a GlobalManager object"""
         self.events = {'error': False, 'events': list()}
+        self.phases = list()
         self.database = database
         self.manager = manager
         self.commands = self.database.fetchTable(self.COMMANDS_TITLE,
                                          header=self.COMMANDS_HEADER)
-        self.logSheet = self.database.fetchTable(self.LOG_TITLE,
-                                constraints=self.LOG_CONSTRAINTS)
+        self._logSheet, self._admin = None, self._UNRESOLVED
+        self._settingsIndex, self._commandLock = None, RLock()
+        self._logBuffer, self._logLock = list(), RLock()
+        self._logDropped, self._logFlushFailed = 0, False
+        self._logRotationDue = False # set by run() and runLeague()
+        self.plan = None # set while run(dryRun=True) is planning
+        self.stats = None # set while run() or runLeague() is running
         self.leagues = self._fetchLeagueNames()
-        self.admin = self._validateAdmin(self._getAdmin())
+
+    _UNRESOLVED = object()
+
+    @property
+    def logSheet(self):
+        """the cluster's Log table, fetched on first use"""
+        if self._logSheet is None:
+            self._logSheet = self.database.fetchTable(self.LOG_TITLE,
+                                 header=self.LOG_HEADER,
+                                 constraints=self.LOG_CONSTRAINTS)
+        return self._logSheet
+
+    @logSheet.setter
+    def logSheet(self, value):
+        self._logSheet = value
+
+    @property
+    def admin(self):
+        """
+        the validated admin's ID (None if invalid); resolving it may scan
+        the league thread and the admin's profile, so it's done on first use
+        """
+        if self._admin is self._UNRESOLVED:
+            self._admin = self._validateAdmin(self._getAdmin())
+        return self._admin
+
+    @admin.setter
+    def admin(self, value):
+        self._admin = value
+
+    def checkAdmin(self):
+        """
+        raises a LeagueError if the cluster's admin failed validation;
+        reads can skip this, but anything that writes must call it
+        """
+        if self.admin is None:
+            raise LeagueError("League admin is not authorized")
+
+    @property
+    def settingsIndex(self):
+        """
+        the Settings table, compiled on first use into its rows keyed by
+        command ('rows') and a {league: {COMMAND: args}} map ('leagues')
+        """
+        with self._commandLock:
+            if self._settingsIndex is None:
+                self._settingsIndex = self._compileSettings()
+            return self._settingsIndex
+
+    def _compileSettings(self):
+        rows = self.commands.getAllEntities(keyLabel=self.TITLE_CMD,
+                                            allowDuplicates=True)
+        leagues = dict()
+        for command in rows:
+            for row in rows[command]:
+                leagueCommands = leagues.setdefault(row[self.TITLE_LG], dict())
+                leagueCommands[command.upper()] = row[self.TITLE_ARG]
+        return {'rows': rows, 'leagues': leagues}
+
+    def _invalidateSettings(self):
+        with self._commandLock: self._settingsIndex = None
+
+    def _findCommand(self, command, league=None):
+        """fetches Settings rows for a command, optionally for one league"""
+        rows = self.settingsIndex['rows'].get(command, list())
+        if league is None: return rows
+        return [row for row in rows if row[self.TITLE_LG] == league]
 
     def _fetchLeagueNames(self):
-        matches = self.commands.findEntities({self.TITLE_CMD: {'type':
-            'positive', 'value': self.CMD_MAKE}})
+        matches = self._findCommand(self.CMD_MAKE)
         if len(matches): return matches[0][self.TITLE_ARG].split(self.SEP_CMD)
         else: return list()
 
+    def _isMember(self, playerID):
+        """
+        checks whether a player is a Warlight member, reusing recent
+        answers; non-members are rechecked after MEMBER_NEGATIVE_TTL
+        """
+        key = str(playerID)
+        isMember = self.memberships.get(key)
+        if isMember is None:
+            self.countOperation(RunStats.SCRAPES)
+            isMember = bool(PlayerParser(playerID).isMember)
+            self.memberships.set(key, isMember,
+                                 (None if isMember else MEMBER_NEGATIVE_TTL))
+        return isMember
+
     def _validateAdmin(self, adminID):
         adminID = int(adminID) if adminID is not None else adminID
         if not (self.manager.verifyAdmin(adminID, self.database.sheet.ID) and
-                PlayerParser(adminID).isMember):
+                self._isMember(adminID)):
             self.log("League admin is not authorized", error=True)
             return None
         return adminID
@@ -88,17 +195,55 @@ class LeagueManager(object):
         for post in posts: authors.add(post['author'])
         return authors
 
-    def _validateThread(self, parser):
-        posts = parser.getPosts()
+    def _threadError(self, posts):
+        """returns why a thread's posts fail validation (None if they pass)"""
         authorCount = len(self._getUniqueAuthors(posts))
         if authorCount < self.ABUSE_THRESHOLD:
-            errStr = ("Thread must have posts by at least %d unique authors" %
-                      (self.ABUSE_THRESHOLD))
-            raise ThreadError(errStr)
+            return ("Thread must have posts by at least %d unique authors" %
+                    (self.ABUSE_THRESHOLD))
         firstPost = posts[0]
         if (self.validationStr not in firstPost['message'] or
             self.PREFIX != firstPost['title'][:len(self.PREFIX)]):
-            raise ThreadError("Thread missing validation order. Quitting.")
+            return "Thread missing validation order. Quitting."
+
+    @staticmethod
+    def _firstPostDigest(posts):
+        if not len(posts): return None
+        firstPost = posts[0]
+        text = repr((firstPost.get('title'), firstPost.get('message')))
+        return hashlib.sha1(text).hexdigest()
+
+    def _cachedVerdict(self, key, firstPage):
+        """
+        returns a passing verdict that still holds for the thread's
+        current first post, without reading the rest of the thread
+        """
+        verdict = self.threadVerdicts.get(key)
+        if verdict is None or verdict['error'] is not None: return None
+        if (len(firstPage) and
+            self._firstPostDigest(firstPage) == verdict['digest']):
+            return verdict
+
+    def _validateThread(self, parser):
+        """
+        checks a thread for enough authors and the validation order;
+        verdicts are cached per thread and only recomputed once the
+        post count or the first post changes (the first page is always
+        fetched fresh, since the mirror keeps full pages as they were)
+        """
+        key = (str(parser.ID), self.validationStr)
+        firstPage = parser.fetchFirstPage()
+        verdict = self._cachedVerdict(key, firstPage)
+        if verdict is None:
+            posts = parser.getPosts()
+            if len(firstPage): posts = firstPage + posts[len(firstPage):]
+            count, digest = len(posts), self._firstPostDigest(posts)
+            verdict = self.threadVerdicts.get(key)
+            if (verdict is None or verdict['count'] != count or
+                verdict['digest'] != digest):
+                verdict = self.threadVerdicts.set(key, {'count': count,
+                    'digest': digest, 'error': self._threadError(posts)})
+        if verdict['error'] is not None: raise ThreadError(verdict['error'])
 
     def _logThreadFailure(self, thread):
         self.log("Unable to scan thread %s. Quitting." % (str(thread)),
@@ -115,10 +260,10 @@ class LeagueManager(object):
         return int(thread)
 
     def _makeForumThreadParser(self, thread):
-        return ForumThreadParser(self._fetchThreadID(thread))
+        return ThreadMirror(self._fetchThreadID(thread))
 
     def _fetchLeagueThread(self):
-        thread = self.commands.findEntities({self.TITLE_CMD: 'THREAD'})
+        thread = self._findCommand('THREAD')
         if len(thread) > 0:
             try:
                 threadName = thread[0][self.TITLE_ARG]
@@ -136,88 +281,246 @@ class LeagueManager(object):
 
     def _getAdmin(self):
         """fetches the league admin's ID"""
-        found = self.commands.findEntities({self.TITLE_CMD: 'ADMIN'})
+        found = self._findCommand('ADMIN')
         parser = self._fetchLeagueThread()
         if (len(found) == 0 and parser is not None):
             try: return parser.getPosts()[0]['author']['ID']
             except Exception: self._logThreadFailure(parser.ID)
         else: return self._handleSpecifiedAdmin(found)
 
-    def log(self, description, league="", error=False):
-        """logs an entry onto the sheet"""
+    def _makeLogEntity(self, description, league="", error=False):
         time = datetime.datetime.strftime(datetime.datetime.now(), TIMEFORMAT)
-        entity = {self.TITLE_TIME: time, self.TITLE_LEAGUE: league,
-                  self.TITLE_STATUS: error, self.TITLE_DESC: description}
-        self.logSheet.addEntity(entity)
+        return {self.TITLE_TIME: time, self.TITLE_LEAGUE: league,
+                self.TITLE_STATUS: error, self.TITLE_DESC: description}
+
+    def log(self, description, league="", error=False):
+        """
+        logs an entry; it's reported in events right away and buffered
+        for the sheet until the next flushLog (or until the buffer fills)
+        once a flush has failed, only phase and run flushes retry it
+        """
+        entity = self._makeLogEntity(description, league, error)
         self.events['events'].append(entity)
         if error: self.events['error'] = True
+        with self._logLock:
+            self._logBuffer.append(entity)
+            self._trimLogBuffer()
+            full = (len(self._logBuffer) >= self.LOG_BUFFER_SIZE and
+                    not self._logFlushFailed)
+        if not full: return
+        try: self.flushLog()
+        except Exception: pass # entries stay buffered for the next flush
+
+    def _trimLogBuffer(self):
+        """drops (and counts) the oldest entries past LOG_BUFFER_MAX"""
+        excess = len(self._logBuffer) - self.LOG_BUFFER_MAX
+        if excess <= 0: return
+        del self._logBuffer[:excess]
+        self._logDropped += excess
+
+    def _makeLogRows(self, entities):
+        table = self.logSheet
+        for entity in entities:
+            for label in entity:
+                if label not in table.reverseHeader: table.expandHeader(label)
+        rows = list()
+        for entity in entities:
+            row = ["",] * table.sheet.colCount
+            for label in entity:
+                row[table.reverseHeader[label] - 1] = entity[label]
+            rows.append(row)
+        return rows
+
+    def _logLimit(self, command, default):
+        value = self._fetchLeagueCommands(self.LG_ALL).get(command, '')
+        return int(value) if isInteger(value) else default
+
+    def _logEntryTimes(self, table):
+        """
+        reads the Time column once; returns the times of the Log's entries
+        (filled rows past the header, ref row and other ignored rows)
+        """
+        times = table.sheet.getCol(table.reverseHeader[self.TITLE_TIME])
+        firstRow = max([table.headerRow, table.refRow or 0]) + 1
+        return [value for row, value in enumerate(times, 1)
+                if row >= firstRow and row not in table.ignoredRows and
+                value != ""]
+
+    @staticmethod
+    def _logExpired(times, maxAge):
+        """checks the age of the oldest entry (the first one listed)"""
+        if not len(times): return False
+        try: start = datetime.datetime.strptime(times[0], TIMEFORMAT)
+        except (TypeError, ValueError): return False
+        return ((datetime.datetime.now() - start).days >= maxAge)
+
+    def _logNeedsRotation(self):
+        times = self._logEntryTimes(self.logSheet)
+        maxRows = self._logLimit(self.SET_LOG_ROWS, self.LOG_MAX_ROWS)
+        if len(times) > maxRows: return True
+        maxAge = self._logLimit(self.SET_LOG_AGE, self.LOG_MAX_AGE)
+        return self._logExpired(times, maxAge)
+
+    def rotateLog(self):
+        """renames the Log sheet to a dated archive; a new one is made on use"""
+        stamp = datetime.datetime.strftime(datetime.datetime.now(),
+                                           self.ARCHIVE_TIMEFORMAT)
+        self.logSheet.sheet.sheet.update_title(self.LOG_ARCHIVE % (stamp))
+        self._logSheet = None
+
+    def _checkLogRotation(self):
+        """
+        rotates the Log sheet if it's too long or too old; only a run's
+        first flush checks, so other requests never read old rows
+        """
+        if not self._logRotationDue: return
+        self._logRotationDue = False
+        try:
+            if self._logNeedsRotation(): self.rotateLog()
+        except Exception as e:
+            self._logBuffer.append(self._makeLogEntity("Unable to rotate " +
+                                   "log: " + str(e), error=True))
+
+    def flushLog(self):
+        """writes buffered log entries to the Log sheet in one append"""
+        with self._logLock:
+            if not len(self._logBuffer): return
+            if self.plan is not None:
+                self.plan.recordWrite(self.LOG_TITLE, 'append',
+                                      len(self._logBuffer))
+                self._logBuffer = list()
+                return
+            self._checkLogRotation()
+            entities, self._logBuffer = self._logBuffer, list()
+            dropped, written = self._logDropped, entities
+            if dropped: written = [self._makeLogEntity("%d log entries " %
+                (dropped) + "were dropped while the Log couldn't be " +
+                "written", error=True)] + entities
+            try:
+                rows = self._makeLogRows(written)
+                self.logSheet.sheet.sheet.append_rows(rows)
+                self.countOperation(RunStats.SHEET_WRITES)
+            except Exception:
+                self._logBuffer = entities + self._logBuffer
+                self._trimLogBuffer()
+                self._logFlushFailed = True
+                raise
+            self._logDropped -= dropped
+            self._logFlushFailed = False
+
+    def recordPhase(self, league, phase, seconds):
+        """records how long a league spent in one phase of its run"""
+        phase = {self.TITLE_LEAGUE: league, 'Phase': phase,
+                 'Time': round(seconds, 3)}
+        self.phases.append(phase)
+        if self.stats is not None: self.stats.recordPhase(phase)
+
+    def countOperation(self, counter, league=None):
+        """counts a sheet/API operation or scrape made during a run"""
+        if self.stats is not None: self.stats.count(counter, league)
+
+    def _startStats(self):
+        self.stats = RunStats()
+        self.commands = CountingTable(self.commands, self.stats)
+
+    def _saveStats(self):
+        """stores the finished run's counters for the /stats endpoint"""
+        stats, self.stats = self.stats, None
+        self.commands = self.commands.table
+        statsStore.save(self.database.sheet.ID, stats.report)
 
     def _getDefaultResults(self, league):
         if league is not self.LG_ALL:
             return self._fetchLeagueCommands(self.LG_ALL)
         return dict()
 
-    @classmethod
-    def _getCommandArgs(cls, commands, command, i):
-        return commands[command][i][cls.TITLE_ARG]
-
-    def _addArgToResults(self, results, commands, command, i):
-        args = self._getCommandArgs(commands, command, i)
-        results[command.upper()] = args
-
     def _fetchLeagueCommands(self, league):
         """
         given a league (string), fetches a dictionary
         containing all commands for that league
         league-specific commands override commands given to all leagues
         """
-        commands = self.commands.getAllEntities(keyLabel=self.TITLE_CMD,
-                                                allowDuplicates=True)
         results = self._getDefaultResults(league)
-        for command in commands:
-            for i in xrange(len(commands[command])):
-                if (commands[command][i][self.TITLE_LG] == league):
-                    self._addArgToResults(results, commands, command, i)
+        results.update(self.settingsIndex['leagues'].get(league, dict()))
         return results
 
-    def _fetchThreadOrderData(self, thread, offset):
-        thread = self._fetchThreadID(thread)
-        threadParser = OrderParser(thread)
-        self._validateThread(threadParser)
-        try: return threadParser.getOrders(offset)
-        except Exception:
-            raise ThreadError("Unable to parse thread: %s; with offset: %s"
-                              % (thread, offset))
-
-    def _fetchThreadOrders(self, thread, offset):
+    def _fetchThreadParser(self, thread):
         """
-        given a thread ID/URL (string), fetches a list of
-        orders since the last offset (int)
+        given a thread ID/URL (string), returns a validated OrderParser
+        for it (None, logged, if the thread can't be used)
         """
-        try: return self._fetchThreadOrderData(thread, offset)
-        except ThreadError as e:
-            self.log(str(e), error=False)
-            return set()
+        try:
+            threadParser = OrderParser(self._fetchThreadID(thread))
+            self._validateThread(threadParser)
+            return threadParser
+        except ThreadError as e: self.log(str(e), error=False)
+
+    @classmethod
+    def _orderTargets(cls, order, leagues):
+        """returns which of the leagues a thread order is for"""
+        if not len(order.get('orders', list())): return list()
+        target = order['orders'][0]
+        if target == cls.LG_ALL: return leagues
+        return [target,] if target in leagues else list()
 
     @classmethod
-    def _narrowOrders(cls, orders, league):
+    def _bucketOrders(cls, orders, leagues):
+        """
+        groups thread orders by league in a single pass; orders for ALL
+        go to every league (leagues compile their own OrderRecords, so
+        they never share one)
+        returns a dictionary mapping each league to its orders
+        """
+        buckets = {league: list() for league in leagues}
+        for order in (orders or list()):
+            for league in cls._orderTargets(order, buckets):
+                buckets[league].append(order)
+        return buckets
+
+    def _feedOrders(self, threadParser, offset, feeds, counter):
+        """
+        reads the thread's orders since offset (int) in a single pass,
+        parsing each post once and appending each order to the Feed of
+        every league it's for; counter['orders'] tracks the orders read
         """
-        narrows a thread orders list to only orders that relate to a league
+        try:
+            if threadParser is None: return
+            try:
+                for post in threadParser.iterPosts(minOffset=offset):
+                    orders = threadParser.parseCachedPost(post)
+                    counter['orders'] += len(orders)
+                    for order in orders:
+                        for league in self._orderTargets(order, feeds):
+                            feeds[league].append(order)
+            except Exception:
+                self.log("Unable to parse thread: %s; with offset: %s"
+                         % (threadParser.ID, offset), error=False)
+            finally: threadParser.saveParsed()
+        finally:
+            for feed in feeds.values(): feed.close()
+
+    def _planLeagueSheet(self, title):
+        """
+        fetches a league sheet for a plan; fetchTable would create a
+        missing sheet, so that's recorded and an empty table stands in
         """
-        return [order for order in orders if
-                len(order.get('orders', list())) and
-                (order['orders'][0] == league or
-                 order['orders'][0] == cls.LG_ALL)]
+        if self.database.tableExists(title, True):
+            return self.database.fetchTable(title)
+        self.plan.recordWrite(title, 'create')
+        return PlannedTable(title, self.database)
 
     def _getLeagueSheets(self, league):
         suffix = " (%s)" % (league)
-        gamesTitle = self.SHEET_GAMES + suffix
-        teamsTitle = self.SHEET_TEAMS + suffix
-        templatesTitle = self.SHEET_TEMPLATES + suffix
-        gamesSheet = self.database.fetchTable(gamesTitle)
-        teamsSheet = self.database.fetchTable(teamsTitle)
-        templatesSheet = self.database.fetchTable(templatesTitle)
-        return gamesSheet, teamsSheet, templatesSheet
+        titles = [self.SHEET_GAMES + suffix, self.SHEET_TEAMS + suffix,
+                  self.SHEET_TEMPLATES + suffix]
+        if self.plan is not None:
+            return tuple(TableView(self._planLeagueSheet(title), self.plan)
+                         for title in titles)
+        sheets = tuple(self.database.fetchTable(title) for title in titles)
+        if self.stats is not None:
+            return tuple(CountingTable(sheet, self.stats, league)
+                         for sheet in sheets)
+        return sheets
 
     @classmethod
     def _retrieveOffset(cls, found):
@@ -242,8 +545,7 @@ class LeagueManager(object):
             raise LeagueError("Nonexistent league")
 
     def _agentAuthorized(self, agent, league):
-        authorized = self.commands.findEntities({self.TITLE_CMD:
-            'AUTHORIZED INTERFACES', self.TITLE_LG: league})
+        authorized = self._findCommand('AUTHORIZED INTERFACES', league)
         if not len(authorized): return False
         authorized = authorized[0][self.TITLE_ARG].split(self.SEP_CMD)
         return (str(agent) in authorized or str(self.LG_ALL) in authorized)
@@ -253,28 +555,38 @@ class LeagueManager(object):
         fetches a League object for a league within this cluster
         :param league: (str) name of the league to fetch
         :param thread: (str) URL of League thread
+        :param orders: (list) thread orders for this league alone
+                       (see _bucketOrders)
         """
         self._checkLeagueExists(league)
-        if orders is None: orders = set()
+        if orders is None: orders = list()
         if threadName is None: threadName = self._fetchThread()
         interface = self._getInterfaceName(threadName, league)
         games, teams, templates = self._getLeagueSheets(league)
         commands = self._fetchLeagueCommands(league)
-        orders = self._narrowOrders(orders, league)
         lgRunner = League(games, teams, templates, commands, orders,
-                          self.admin, self, league, interface)
+                          None, self, league, interface)
+        if self.plan is not None:
+            lgRunner.handler = HandlerView(lgRunner.handler, self.plan)
+        elif self.stats is not None:
+            lgRunner.handler = CountingHandler(lgRunner.handler, self.stats,
+                                               league)
         return lgRunner
 
-    def fetchAllLeagues(self, threadName=None, orders=None):
-        results = list()
+    def iterLeagues(self, threadName=None, orders=None):
+        """yields League objects for this cluster, building each on demand"""
+        buckets = self._bucketOrders(orders, self.leagues)
         for league in self.leagues:
-            results.append(self.fetchLeague(league, threadName, orders))
-        return results
+            yield self.fetchLeague(league, threadName, buckets[league])
+
+    def fetchAllLeagues(self, threadName=None, orders=None):
+        return list(self.iterLeagues(threadName, orders))
 
     def fetchLeagueOrLeagues(self, league, threadName=None, orders=None):
         if league == self.LG_ALL:
             return self.fetchAllLeagues(threadName, orders)
-        return [self.fetchLeague(league, threadName, orders),]
+        buckets = self._bucketOrders(orders, [league,])
+        return [self.fetchLeague(league, threadName, buckets[league]),]
 
     def fetchCommands(self):
         result = dict()
@@ -283,8 +595,10 @@ class LeagueManager(object):
         return result
 
     def _setCommand(self, league, command, value):
-        self.commands.updateMatchingEntities({self.TITLE_CMD: command,
-            self.TITLE_LG: league}, {self.TITLE_ARG: value}, True)
+        with self._commandLock:
+            self.commands.updateMatchingEntities({self.TITLE_CMD: command,
+                self.TITLE_LG: league}, {self.TITLE_ARG: value}, True)
+            self._invalidateSettings()
 
     def _checkAgent(self, agent, league):
         if not self._agentAuthorized(agent, league):
@@ -292,10 +606,11 @@ class LeagueManager(object):
 
     def setCommand(self, agent, league, command, value):
         self._checkAgent(agent, league)
+        self.checkAdmin()
         self._setCommand(league, command, value)
 
     def _fetchThread(self):
-        threadData = self.commands.findEntities({self.TITLE_CMD: 'THREAD'})
+        threadData = self._findCommand('THREAD')
         thread = threadData[0][self.TITLE_ARG] if len(threadData) else ""
         return thread
 
@@ -311,20 +626,92 @@ class LeagueManager(object):
             failStr = "Failed to run league %s: %s" % (str(league), errStr)
             self.log(failStr, league=league, error=True)
 
-    def runLeague(self, agent, league):
-        self._checkAgent(agent, league)
-        self._runLeague(league)
+    @property
+    def parallelLeagues(self):
+        """how many leagues run() may run at once (ALL-league setting)"""
+        value = self._fetchLeagueCommands(self.LG_ALL).get(self.SET_PARALLEL,
+                                                           '')
+        return max(1, int(value)) if isInteger(value) else 1
 
-    def run(self):
-        """runs leagues and updates"""
+    def _runLeagues(self, thread, buckets):
+        """
+        runs every league with its bucket of orders,
+        on a bounded pool if PARALLEL LEAGUES is set; a league that can't
+        be built fails the run (before OFFSET moves) either way
+        """
+        workers = min(self.parallelLeagues, len(self.leagues))
+        if workers <= 1:
+            for league in self.leagues:
+                self._runLeague(league, thread, buckets.get(league))
+            return
+        tasks = Scheduler(workers).run([Task(league, self._runLeague, league,
+                                             thread, buckets.get(league))
+                                        for league in self.leagues])
+        failed = [task for task in tasks if task.error is not None]
+        for task in failed:
+            self.log("Failed to run league %s: %s" % (str(task.label),
+                     str(task.error)), league=task.label, error=True)
+        if len(failed): raise failed[0].error
+
+    def runLeague(self, agent, league):
+        self._startStats()
+        self._logRotationDue = True
+        try:
+            self._checkAgent(agent, league)
+            self.checkAdmin()
+            self._runLeague(league)
+        finally:
+            try: self.flushLog()
+            finally: self._saveStats()
+
+    def run(self, dryRun=False):
+        """
+        runs leagues and updates, then writes out the log
+        with dryRun, runs against copies of the sheets without touching
+        them or Warlight, and returns a report of the writes and API
+        calls the run would make
+        """
+        if dryRun: return self._planRun()
+        self._startStats()
+        self._logRotationDue = True
+        try: self._run()
+        finally:
+            try: self.flushLog()
+            finally: self._saveStats()
+
+    def _planRun(self):
+        commands, self.plan = self.commands, Plan()
+        self.commands = TableView(commands, self.plan)
+        self._invalidateSettings()
+        try:
+            try: self._run()
+            finally: self.flushLog()
+            return self.plan.report
+        finally:
+            self.commands, self.plan = commands, None
+            self._invalidateSettings()
+
+    def _run(self):
         if self.admin is None: return
         thread = self._fetchThread()
-        offsetData = self.commands.findEntities({self.TITLE_CMD: 'OFFSET'})
+        offsetData = self._findCommand('OFFSET')
         offset = self._retrieveOffset(offsetData)
-        orders = (self._fetchThreadOrders(thread, offset) if len(thread)
-                  else set())
-        for league in self.leagues: self._runLeague(league, thread, orders)
-        newOffset = offset + len(orders)
+        threadParser = (self._fetchThreadParser(thread) if len(thread)
+                        else None)
+        feeds = {league: Feed() for league in self.leagues}
+        counter = {'orders': 0}
+        feed = Task('orders', self._feedOrders, threadParser, offset, feeds,
+                    counter)
+        feeder = Thread(target=feed.run)
+        feeder.daemon = True
+        feeder.start()
+        try: self._runLeagues(thread, feeds)
+        finally: feed.wait()
+        if feed.error is not None:
+            self.log("Failed to read thread orders: " + str(feed.error),
+                     error=True)
+        newOffset = offset + counter['orders']
         self.commands.updateMatchingEntities({self.TITLE_CMD:
             {'value': 'OFFSET', 'type': 'positive'}},
             {self.TITLE_ARG: str(newOffset)}, True)
+        self._invalidateSettings()
@@ -2,15 +2,28 @@
 ## order parser for forum threads
 
 # imports
-from wl_parsers import ForumThreadParser
+import os
+import json
+import hashlib
+from resources.thread_mirror import ThreadMirror
+from resources.utility import TTLCache
+from resources.constants import CACHE_DIR, MIRROR_REVALIDATE, \
+    MIRROR_CACHE_SIZE
 
 # main class
-class OrderParser(ForumThreadParser):
+class OrderParser(ThreadMirror):
     """
     class to parse orders;
     takes a threadID (int or string)
     """
 
+    CMD_MARKER = '<pre class="prettyprint">'
+    CMD_END = '</pre>'
+    LINE_BREAK = '<br>'
+    # thread ID -> {post ID: (message digest, orders)}, bounded like mirrors
+    _parsed = TTLCache(MIRROR_REVALIDATE, MIRROR_CACHE_SIZE)
+    _unsaved = set() # thread IDs with parsed posts not yet on disk
+
     ## getOrderInfo
     @staticmethod
     def getOrderInfo(orderText):
@@ -58,6 +71,26 @@ class OrderParser(ForumThreadParser):
     def isIgnoreOrder(order):
         return ('type' in order and order['type'].lower() == '!bot_ignore')
 
+    ## iterOrderLines
+    @classmethod
+    def iterOrderLines(cls, postText):
+        """
+        yields the lines of each command block in a post, in order,
+        scanning the text once
+        """
+        start = postText.find(cls.CMD_MARKER)
+        while start != -1:
+            start += len(cls.CMD_MARKER)
+            end = postText.find(cls.CMD_END, start)
+            if end == -1: return
+            lineEnd = postText.find(cls.LINE_BREAK, start, end)
+            while lineEnd != -1:
+                yield postText[start:lineEnd]
+                start = lineEnd + len(cls.LINE_BREAK)
+                lineEnd = postText.find(cls.LINE_BREAK, start, end)
+            yield postText[start:end]
+            start = postText.find(cls.CMD_MARKER, end + len(cls.CMD_END))
+
     ## parsePost
     def parsePost(self, post):
         """
@@ -66,23 +99,90 @@ class OrderParser(ForumThreadParser):
         each dictionary contains an 'author', 'type', and
         (if provided) 'orders' (tuple of order args)
         """
-        orders, postText = list(), post['message']
-        postAuthor = post['author']['ID']
-        cmdMarker, cmdEnd = '<pre class="prettyprint">', '</pre>'
-        while (cmdEnd in postText):
-            orderText = self._getValueFromBetween(postText, cmdMarker, cmdEnd)
-            if "<br>" in orderText:
-                replaceText = orderText.replace("<br>", (cmdEnd + cmdMarker))
-                postText = postText.replace(orderText, replaceText)
-                orderText = orderText[:orderText.find("<br>")]
+        orders, postAuthor = list(), post['author']['ID']
+        for orderText in self.iterOrderLines(post['message']):
             orderData = self.parseOrderData(orderText)
             if self.isIgnoreOrder(orderData): break
-            else:
-                orderData['author'] = postAuthor
-                orders.append(orderData)
-                postText = postText[(postText.find(cmdEnd) + len(cmdEnd)):]
+            orderData['author'] = postAuthor
+            orders.append(orderData)
+        return orders
+
+    ## parsed post cache
+    @property
+    def _parsedPath(self):
+        return os.path.join(CACHE_DIR, "orders_%s.json" % (self._key))
+
+    @staticmethod
+    def _postDigest(post):
+        return hashlib.sha1(repr(post['message'])).hexdigest()
+
+    @staticmethod
+    def _copyOrders(orders):
+        return [dict(order) for order in orders]
+
+    @staticmethod
+    def _loadOrders(orders):
+        """restores the order argument tuples JSON turns into lists"""
+        for order in orders:
+            if 'orders' in order: order['orders'] = tuple(order['orders'])
         return orders
 
+    def _readParsed(self):
+        """reads parsed posts from disk; a bad file is an empty cache"""
+        try:
+            with open(self._parsedPath, 'r') as parsedFile:
+                parsed = json.load(parsedFile)
+            return {postID: (digest, self._loadOrders(orders))
+                    for postID, (digest, orders) in parsed.items()}
+        except (IOError, OSError, ValueError, TypeError): return dict()
+
+    def _writeParsed(self, parsed):
+        """writes parsed posts to disk; failures only cost a reparse"""
+        try:
+            data = json.dumps(parsed)
+            if not os.path.isdir(CACHE_DIR): os.makedirs(CACHE_DIR)
+            with open(self._parsedPath, 'w') as parsedFile:
+                parsedFile.write(data)
+        except (IOError, OSError, TypeError, ValueError): pass
+
+    @property
+    def parsedPosts(self):
+        parsed = self._parsed.get(self._key)
+        if parsed is None:
+            parsed = self._parsed.set(self._key, self._readParsed())
+        return parsed
+
+    def parseCachedPost(self, post):
+        """
+        parses a post (as parsePost), reusing the orders parsed earlier
+        from a post with the same ID and message
+        """
+        postID, digest = str(post['ID']), self._postDigest(post)
+        with self._threadLock(): cached = self.parsedPosts.get(postID)
+        if cached is not None and cached[0] == digest:
+            return self._copyOrders(cached[1])
+        orders = self.parsePost(post)
+        with self._threadLock():
+            self.parsedPosts[postID] = (digest, self._copyOrders(orders))
+            self._unsaved.add(self._key)
+        return orders
+
+    def saveParsed(self):
+        """writes newly parsed posts out so later runs can reuse them"""
+        with self._threadLock():
+            if self._key not in self._unsaved: return
+            self._unsaved.discard(self._key)
+            self._writeParsed(self.parsedPosts)
+
+    def clearMirror(self):
+        """drops the local copy of the thread and its parsed posts"""
+        with self._threadLock():
+            super(OrderParser, self).clearMirror()
+            self._parsed.invalidate(self._key)
+            self._unsaved.discard(self._key)
+            try: os.remove(self._parsedPath)
+            except (IOError, OSError): pass
+
     ## getorders
     def getOrders(self, minOffset):
         """
@@ -91,5 +191,15 @@ class OrderParser(ForumThreadParser):
         posts = self.getPosts(minOffset=minOffset)
         orders = list()
         for post in posts:
-            orders += self.parsePost(post)
+            orders += self.parseCachedPost(post)
+        self.saveParsed()
         return orders
+
+    def iterOrders(self, minOffset):
+        """
+        parses a thread (starts after minOffset) page by page,
+        yielding each order as soon as its post comes in
+        """
+        for post in self.iterPosts(minOffset=minOffset):
+            for order in self.parseCachedPost(post): yield order
+        self.saveParsed()
@@ -0,0 +1,54 @@
+###########################
+# order_record.py
+# compact records for parsed orders
+###########################
+
+# OrderRecord class
+class OrderRecord(object):
+    """
+    slotted stand-in for a parsed order dictionary; reads (and compares)
+    like the dictionary it was made from
+    compiled arguments (team, limit) start out as None; League fills in
+    the ones its handlers consume when it compiles the record
+    :param order: order dictionary (as OrderParser.parsePost makes)
+    """
+
+    KEYS = ('type', 'orders', 'author')
+    __slots__ = KEYS + ('kind', 'team', 'limit')
+    __hash__ = None
+
+    def __init__(self, order):
+        self.team, self.limit = None, None
+        for key in self.KEYS:
+            if key in order: setattr(self, key, order[key])
+        if 'orders' in order: self.orders = tuple(order['orders'])
+        if 'type' in order: self.kind = order['type'].lower()
+
+    def __getitem__(self, key):
+        if key not in self.KEYS: raise KeyError(key)
+        try: return getattr(self, key)
+        except AttributeError: raise KeyError(key)
+
+    def __setitem__(self, key, value):
+        if key not in self.KEYS: raise KeyError(key)
+        setattr(self, key, value)
+        if key == 'type': self.kind = value.lower()
+
+    def __contains__(self, key):
+        return key in self.KEYS and hasattr(self, key)
+
+    def get(self, key, default=None):
+        return self[key] if key in self else default
+
+    def asDict(self):
+        return {key: getattr(self, key) for key in self.KEYS if key in self}
+
+    def __eq__(self, other):
+        if isinstance(other, OrderRecord): other = other.asDict()
+        return self.asDict() == other
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __repr__(self):
+        return repr(self.asDict())
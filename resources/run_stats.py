@@ -0,0 +1,158 @@
+###########################
+# run_stats.py
+# operation counters for cluster runs
+###########################
+
+# imports
+import os
+import json
+import time
+import datetime
+from threading import Lock
+from resources.constants import TIMEFORMAT, CACHE_DIR, STATS_HISTORY
+
+# RunStats class
+class RunStats(object):
+    """
+    counts the sheet reads/writes, Warlight API calls and player page
+    scrapes made during a single run, per league and for the cluster
+    """
+
+    SHEET_READS = "sheetReads"
+    SHEET_WRITES = "sheetWrites"
+    SCRAPES = "playerScrapes"
+
+    def __init__(self):
+        self.startTime = time.time()
+        self._cluster, self._leagues = dict(), dict()
+        self.phases = list()
+        self._lock = Lock()
+
+    def count(self, counter, league=None, amount=1):
+        """adds to a counter for a league (or the cluster if None)"""
+        with self._lock:
+            counts = (self._cluster if league is None else
+                      self._leagues.setdefault(league, dict()))
+            counts[counter] = counts.get(counter, 0) + amount
+
+    def recordPhase(self, phase):
+        with self._lock: self.phases.append(phase)
+
+    @staticmethod
+    def _addCounts(totals, counts):
+        for counter in counts:
+            totals[counter] = totals.get(counter, 0) + counts[counter]
+
+    @property
+    def report(self):
+        with self._lock:
+            totals = dict(self._cluster)
+            for counts in self._leagues.values():
+                self._addCounts(totals, counts)
+            started = datetime.datetime.fromtimestamp(self.startTime)
+            return {'started': datetime.datetime.strftime(started,
+                                                          TIMEFORMAT),
+                    'time': round(time.time() - self.startTime, 3),
+                    'totals': totals, 'cluster': dict(self._cluster),
+                    'leagues': {league: dict(counts) for league, counts
+                                in self._leagues.items()},
+                    'phases': list(self.phases)}
+
+# CountingTable class
+class CountingTable(object):
+    """
+    wraps a sheetDB Table, counting its reads and writes in a RunStats
+    :param table: Table object to wrap
+    :param stats: RunStats to count in
+    :param league: league the table belongs to (None for the cluster)
+    """
+
+    READS = {'findEntities', 'getAllEntities', 'findValue', 'findValues',
+             'fetchEntity', 'fetchEntities'}
+    WRITES = {'addEntity', 'updateEntity', 'updateMatchingEntities',
+              'removeEntity', 'removeMatchingEntities', 'expandHeader',
+              'updateConstraint'}
+
+    def __init__(self, table, stats, league=None):
+        self.table = table
+        self.stats = stats
+        self.league = league
+
+    def __getattr__(self, name):
+        attr = getattr(self.table, name)
+        if name in self.READS: counter = RunStats.SHEET_READS
+        elif name in self.WRITES: counter = RunStats.SHEET_WRITES
+        else: return attr
+        def call(*args, **kwargs):
+            self.stats.count(counter, self.league)
+            return attr(*args, **kwargs)
+        return call
+
+# CountingHandler class
+class CountingHandler(object):
+    """
+    wraps a Warlight API handler, counting each call in a RunStats
+    :param handler: APIHandler object to wrap
+    :param stats: RunStats to count in
+    :param league: league making the calls
+    """
+
+    def __init__(self, handler, stats, league=None):
+        self.handler = handler
+        self.stats = stats
+        self.league = league
+
+    def __getattr__(self, name):
+        attr = getattr(self.handler, name)
+        if not callable(attr): return attr
+        def call(*args, **kwargs):
+            self.stats.count(name, self.league)
+            return attr(*args, **kwargs)
+        return call
+
+# StatsStore class
+class StatsStore(object):
+    """
+    keeps the stats of each cluster's most recent runs,
+    in memory and as JSON files on disk
+    :param directory: where to keep the files
+    :param history: number of runs kept per cluster
+    """
+
+    def __init__(self, directory, history=STATS_HISTORY):
+        self.directory = directory
+        self.history = history
+        self._runs = dict()
+        self._lock = Lock()
+
+    def _path(self, clusterID):
+        safeID = "".join(c for c in str(clusterID) if c.isalnum() or c in "-_")
+        return os.path.join(self.directory, "stats_%s.json" % (safeID))
+
+    def _read(self, clusterID):
+        try:
+            with open(self._path(clusterID), 'r') as statsFile:
+                return json.load(statsFile)
+        except (IOError, OSError, ValueError): return list()
+
+    def _write(self, clusterID, runs):
+        try:
+            data = json.dumps(runs)
+            if not os.path.isdir(self.directory): os.makedirs(self.directory)
+            with open(self._path(clusterID), 'w') as statsFile:
+                statsFile.write(data)
+        except (IOError, OSError, TypeError, ValueError): pass
+
+    def fetch(self, clusterID):
+        """returns a cluster's recorded runs, oldest first"""
+        key = str(clusterID)
+        with self._lock:
+            if key not in self._runs: self._runs[key] = self._read(key)
+            return list(self._runs[key])
+
+    def save(self, clusterID, report):
+        runs = (self.fetch(clusterID) + [report,])[-self.history:]
+        with self._lock: self._runs[str(clusterID)] = runs
+        self._write(clusterID, runs)
+
+statsStore = StatsStore(CACHE_DIR)
@@ -0,0 +1,191 @@
+###########################
+# scheduler.py
+# bounded thread scheduling
+###########################
+
+# imports
+import time
+from Queue import Queue, Empty
+from threading import Thread, Event, Lock, Condition
+
+# Task class
+class Task(object):
+    """
+    a single unit of work run by a Scheduler
+    :param label: name used to identify the task in reports
+    :param fn: function to call
+    :param args: positional arguments to call fn with
+    """
+
+    def __init__(self, label, fn, *args):
+        self.label = label
+        self.fn = fn
+        self.args = args
+        self.result, self.error = None, None
+        self.startTime, self.endTime = None, None
+        self.abandoned = False
+        self.context = dict() # scratch space fn may fill in while running
+        self.started, self.finished = Event(), Event()
+        self._lock = Lock()
+
+    def run(self):
+        """
+        runs the task unless it was abandoned before starting;
+        returns False if it was abandoned
+        """
+        with self._lock:
+            if self.abandoned: return False
+            self.startTime = time.time()
+            self.started.set()
+        try: self.result = self.fn(*self.args)
+        except Exception as e: self.error = e
+        with self._lock:
+            self.endTime = time.time()
+            self.finished.set()
+            return not self.abandoned
+
+    def wait(self, deadline=None):
+        """
+        waits at most deadline seconds for the task to start, then for it
+        to finish at most deadline seconds after it started;
+        returns True if it finished in time
+        """
+        if not self.started.wait(deadline): return False
+        if deadline is None: self.finished.wait()
+        else: self.finished.wait(max(0, self.startTime + deadline -
+                                     time.time()))
+        return self.finished.is_set()
+
+    def abandon(self):
+        """
+        gives up on an unfinished task (which then won't start if it
+        hasn't yet); returns True if it was unfinished
+        """
+        with self._lock:
+            if not self.finished.is_set(): self.abandoned = True
+            return self.abandoned
+
+    @property
+    def elapsed(self):
+        if self.startTime is None: return None
+        endTime = time.time() if self.endTime is None else self.endTime
+        return round(endTime - self.startTime, 3)
+
+    @property
+    def report(self):
+        return {'label': self.label, 'time': self.elapsed,
+                'timedOut': self.abandoned,
+                'error': (None if self.error is None else str(self.error))}
+
+# Scheduler class
+class Scheduler(object):
+    """
+    runs tasks on a bounded pool of worker threads
+    :param workers: maximum number of tasks in flight, abandoned or not
+    :param deadline: seconds to wait for each task once it starts
+                     (None waits indefinitely)
+    """
+
+    def __init__(self, workers, deadline=None):
+        self.workers = max(1, int(workers))
+        self.deadline = deadline
+
+    @staticmethod
+    def _work(queue):
+        while True:
+            try: task = queue.get_nowait()
+            except Empty: return
+            task.run()
+
+    @classmethod
+    def _startWorker(cls, queue):
+        worker = Thread(target=cls._work, args=(queue,))
+        worker.daemon = True
+        worker.start()
+
+    def run(self, tasks):
+        """
+        runs tasks and waits on each in order; a task that doesn't finish
+        within the deadline is abandoned, but keeps its worker until it
+        returns, so abandoned tasks count against the bound
+        tasks still queued once the deadline has passed since the run
+        began are abandoned unstarted, so a run takes at most twice the
+        deadline however many tasks are stuck
+        returns the tasks (use their report property for summaries)
+        """
+        queue = Queue()
+        for task in tasks: queue.put(task)
+        for _ in xrange(min(self.workers, len(tasks))):
+            self._startWorker(queue)
+        startBy = (None if self.deadline is None else
+                   time.time() + self.deadline)
+        for task in tasks:
+            if (startBy is not None and not
+                task.started.wait(max(0, startBy - time.time()))):
+                task.abandon()
+            elif not task.wait(self.deadline): task.abandon()
+        return tasks
+
+# Executor class
+class Executor(object):
+    """
+    runs submitted tasks in the background on a bounded pool of workers
+    :param workers: maximum number of tasks run at once
+    """
+
+    def __init__(self, workers):
+        self.workers = max(1, int(workers))
+        self._queue = Queue()
+        self._threads = list()
+        self._lock = Lock()
+
+    def _work(self):
+        while True: self._queue.get().run()
+
+    def submit(self, task):
+        """queues a task, starting another worker if below the bound"""
+        with self._lock:
+            if len(self._threads) < self.workers:
+                worker = Thread(target=self._work)
+                worker.daemon = True
+                worker.start()
+                self._threads.append(worker)
+        self._queue.put(task)
+        return task
+
+# Feed class
+class Feed(object):
+    """
+    append-only list filled by one thread while any number of others read
+    it, each from the start; readers wait for more items until the feed
+    is closed
+    """
+
+    def __init__(self):
+        self._items = list()
+        self._closed = False
+        self._cond = Condition()
+
+    def __len__(self):
+        with self._cond: return len(self._items)
+
+    def append(self, item):
+        with self._cond:
+            self._items.append(item)
+            self._cond.notify_all()
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+    def __iter__(self):
+        index = 0
+        while True:
+            with self._cond:
+                while not (index < len(self._items) or self._closed):
+                    self._cond.wait()
+                if index >= len(self._items): return
+                item = self._items[index]
+            index += 1
+            yield item
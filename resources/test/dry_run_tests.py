@@ -0,0 +1,118 @@
+# dry_run_tests.py
+## automated tests for run planning
+
+# imports
+from nose.tools import assert_equals, assert_raises, assert_false
+from mock import MagicMock
+from sheetDB import errors as SheetErrors
+from resources.dry_run import Plan, TableView, HandlerView
+
+# helpers
+def makeTable(entities):
+    table = MagicMock()
+    table.sheet.title = "Team Data (1v1)"
+    table.reverseHeader = {'ID': 1, 'Name': 2, 'Limit': 3}
+    table.constraints = {1: "INT", 2: "", 3: "INT"}
+    table.getAllEntities.return_value = entities
+    table.getConstrainedKey.side_effect = lambda col, key: set(key)
+    table.getConstrained.side_effect = lambda value, constraint: (
+        int(value) if constraint == "INT" and value != "" else value)
+    return table
+
+# tests
+def test_plan():
+    plan = Plan()
+    assert_equals(plan.report, {'sheets': dict(), 'api': dict(),
+                                'sheetWrites': 0, 'apiCalls': 0})
+    plan.recordWrite("A", 'update', 3)
+    plan.recordWrite("A", 'update')
+    plan.recordWrite("B", 'delete', 0)
+    plan.recordWrite("B", 'append')
+    plan.recordCall('createGame')
+    plan.recordCall('createGame')
+    plan.recordCall('queryGame')
+    assert_equals(plan.report, {'sheets': {'A': {'update': 4},
+                                           'B': {'append': 1}},
+                                'api': {'createGame': 2, 'queryGame': 1},
+                                'sheetWrites': 5, 'apiCalls': 3})
+
+class TestTableView(object):
+
+    def setUp(self):
+        self.entities = [{'ID': 1, 'Name': 'a', 'Limit': 3},
+                         {'ID': 2, 'Name': 'b', 'Limit': 0},
+                         {'ID': 3, 'Name': 'c', 'Limit': 3}]
+        self.table = makeTable(self.entities)
+        self.plan = Plan()
+        self.view = TableView(self.table, self.plan)
+
+    def test_findEntities(self):
+        assert_false(self.table.getAllEntities.called)
+        assert_equals(self.view.findEntities({'Limit': {'value': 0,
+            'type': 'negative'}}), [self.entities[0], self.entities[2]])
+        assert_equals(self.view.findEntities({'ID': {'values': [1, 2],
+            'type': 'positive'}, 'Name': 'b'}), [self.entities[1]])
+        assert_equals(self.view.findEntities({'Limit': '3'}, keyLabel='ID'),
+                      {1: self.entities[0], 3: self.entities[2]})
+        assert_equals(self.view.getAllEntities(), self.entities)
+        assert_equals(self.view.findValue({'Limit': 3}, 'Name'), ['a', 'c'])
+        assert_raises(SheetErrors.DataError, self.view.findEntities,
+                      {'Rating': 3})
+        assert_raises(SheetErrors.DataError, self.view.findValue, dict(),
+                      'Rating')
+        self.table.getAllEntities.assert_called_once_with()
+
+    def test_updateMatchingEntities(self):
+        self.view.updateMatchingEntities({'ID': {'value': 2,
+            'type': 'positive'}}, {'Limit': '5', 'Name': 'B'})
+        assert_equals(self.view.findEntities({'ID': 2}),
+                      [{'ID': 2, 'Name': 'B', 'Limit': 5}])
+        self.view.updateMatchingEntities({'ID': 9}, {'Name': 'z'})
+        self.view.updateMatchingEntities({'ID': {'value': 9,
+            'type': 'positive'}}, {'Name': 'z'}, True)
+        assert_equals(self.view.findEntities({'ID': 9}),
+                      [{'ID': 9, 'Name': 'z', 'Limit': ""}])
+        assert_equals(self.plan.report['sheets'], {'Team Data (1v1)':
+                      {'update': 3, 'append': 1}})
+        assert_false(self.table.updateMatchingEntities.called)
+        assert_false(self.table.addEntity.called)
+
+    def test_addEntity(self):
+        self.view.addEntity({'ID': '4', 'Rating': '1500'})
+        assert_equals(self.view.findEntities({'ID': 4}),
+                      [{'ID': 4, 'Name': "", 'Limit': "", 'Rating': '1500'}])
+        assert_equals(self.view.reverseHeader['Rating'], 4)
+        assert_false('Rating' in self.table.reverseHeader)
+        assert_equals(self.plan.report['sheets'], {'Team Data (1v1)':
+                      {'append': 1, 'header': 1}})
+        assert_raises(SheetErrors.DataError, self.view.expandHeader, 'ID')
+
+    def test_removeMatchingEntities(self):
+        self.view.removeMatchingEntities({'Limit': 3})
+        assert_equals(self.view.getAllEntities(), [self.entities[1]])
+        assert_equals(len(self.entities), 3)
+        assert_equals(self.plan.report['sheetWrites'], 2)
+        assert_false(self.table.removeMatchingEntities.called)
+
+    def test_updateConstraint(self):
+        self.view.updateConstraint('ID', 'INT', erase=True)
+        assert_raises(SheetErrors.DataError, self.view.updateConstraint,
+                      'Rating', '')
+        assert_equals(self.plan.report['sheets'], {'Team Data (1v1)':
+                      {'constraint': 1}})
+        assert_false(self.table.updateConstraint.called)
+        assert_equals(self.view.parent, self.table.parent)
+
+def test_handlerView():
+    handler, plan = MagicMock(), Plan()
+    handler.token = 'token'
+    view = HandlerView(handler, plan)
+    assert_equals(view.createGame(1, 'name', []), HandlerView.PLANNED_GAME)
+    assert_equals(view.deleteGame(12), None)
+    assert_equals(view.queryGame(12), handler.queryGame.return_value)
+    handler.queryGame.assert_called_once_with(12)
+    assert_equals(view.token, 'token')
+    assert_false(handler.createGame.called)
+    assert_false(handler.deleteGame.called)
+    assert_equals(plan.report['api'], {'createGame': 1, 'deleteGame': 1,
+                                       'queryGame': 1})
@@ -14,14 +14,40 @@ class TestGlobalManager(TestCase):
 
     def setUp(self):
         self.database = MagicMock()
+        self.database.fetchTable.side_effect = lambda *args, **kwargs: \
+            MagicMock()
         self.manager = GlobalManager(self.database)
+        GlobalManager.verifiedTokens.clear()
 
     def test_init(self):
         assert_equals(self.manager.database, self.database)
-        assert_equals(self.manager.admins,
-                      self.database.fetchTable.return_value)
-        assert_equals(self.manager.agents,
-                      self.database.fetchTable.return_value)
+        assert_equals(self.database.fetchTable.call_count, 2)
+        assert_equals(self.database.fetchTable.call_args_list[0][0][0],
+                      "Admins")
+        assert_equals(self.database.fetchTable.call_args_list[1][0][0],
+                      "Agents")
+        assert_true(self.manager.admins is not self.manager.agents)
+        assert_equals(self.manager._snapshot, None)
+
+    def test_snapshot(self):
+        self.manager.admins.getAllEntities.return_value = [{'ID': 12,
+            'AUTHORIZED': '1;2;', 'BANNED': ''}, {'ID': 13,
+            'AUTHORIZED': '3', 'BANNED': 'TRUE'}]
+        self.manager.agents.getAllEntities.return_value = [{'ID': 14,
+            'TOKEN HASH': 'hash', 'BANNED': ''},]
+        snapshot = self.manager.snapshot
+        assert_equals(snapshot['authorized'], {'12': frozenset(['1', '2'])})
+        assert_equals(set(snapshot['admins']), {'12', '13'})
+        assert_equals(snapshot['agents']['14']['TOKEN HASH'], 'hash')
+        assert_equals(self.manager.snapshot, snapshot)
+        assert_equals(self.manager.admins.getAllEntities.call_count, 1)
+        self.manager.refresh()
+        self.manager.snapshot
+        assert_equals(self.manager.admins.getAllEntities.call_count, 2)
+        with patch('resources.global_manager.time.time') as timeFn:
+            timeFn.return_value = self.manager._snapshotTime + 3600
+            self.manager.snapshot
+        assert_equals(self.manager.agents.getAllEntities.call_count, 3)
 
     def test_randStr(self):
         assert_equals(len(self.manager._randStr(490)), 490)
@@ -34,40 +60,77 @@ class TestGlobalManager(TestCase):
         assert_equals(self.manager.updateAgentToken(43904309), "token")
         self.manager.agents.updateMatchingEntities.assert_called_with({'ID':
             43904309}, {'TOKEN HASH': 'hash'}, True)
+        assert_equals(self.manager._snapshot, None)
+        self.manager.verifiedTokens.set('43904309', ('digest', 'old hash'))
+        self.manager.updateAgentToken(43904309)
+        assert_false('43904309' in self.manager.verifiedTokens)
 
     def test_verifyAgent(self):
-        self.manager.agents.findEntities.return_value = list()
+        self.manager.agents.getAllEntities.return_value = list()
         assert_false(self.manager.verifyAgent(1234, "token"))
-        self.manager.agents.findEntities.return_value = [{'BANNED': True},]
+        self.manager.refresh()
+        self.manager.agents.getAllEntities.return_value = [{'ID': 1234,
+            'BANNED': True},]
         assert_false(self.manager.verifyAgent(1234, "token"))
         expHash = token_hash.hash('token')
-        self.manager.agents.findEntities.return_value = [{'BANNED': "",
+        self.manager.refresh()
+        self.manager.agents.getAllEntities.return_value = [{'BANNED': "",
             'ID': 1234, 'TOKEN HASH': expHash},]
         assert_true(self.manager.verifyAgent(1234, "token"))
+        assert_true('1234' in self.manager.verifiedTokens)
+        self.manager.refresh()
+        self.manager.agents.getAllEntities.return_value = [{'BANNED': "TRUE",
+            'ID': 1234, 'TOKEN HASH': expHash},]
+        assert_false(self.manager.verifyAgent(1234, "token"))
+        assert_false('1234' in self.manager.verifiedTokens)
+
+    @patch('resources.global_manager.token_hash.verify')
+    def test_verifyToken(self, verify):
+        verify.return_value = False
+        assert_false(self.manager._verifyToken(12, "token", "hash"))
+        verify.return_value = True
+        assert_true(self.manager._verifyToken(12, "token", "hash"))
+        assert_true(self.manager._verifyToken(12, "token", "hash"))
+        assert_equals(verify.call_count, 2)
+        assert_true(self.manager._verifyToken(12, "token", "new hash"))
+        assert_true(self.manager._verifyToken(12, "other", "new hash"))
+        assert_equals(verify.call_count, 4)
 
     def test_updateAdmin(self):
-        self.manager.admins.findEntities.return_value = list()
+        admins = self.manager.admins
+        admins.getAllEntities.return_value = [{'ID': 1234, 'AUTHORIZED': ''},]
+        self.manager.snapshot
+        admins.findEntities.return_value = list()
         self.manager.updateAdmin(1234, 5678)
-        self.manager.admins.addEntity.assert_called_with({'ID': 1234,
+        admins.findEntities.assert_called_with({'ID': 1234})
+        admins.addEntity.assert_called_with({'ID': 1234,
             'AUTHORIZED': '5678'})
-        self.manager.admins.findEntities.return_value = [{'ID': 1234,
-            'AUTHORIZED': ''},]
+        assert_equals(self.manager._snapshot, None)
+        self.manager.snapshot
+        admins.findEntities.return_value = [{'ID': 1234, 'AUTHORIZED': ''},]
         self.manager.updateAdmin(1234, 91011)
-        self.manager.admins.updateMatchingEntities.assert_called_with({'ID':
+        admins.updateMatchingEntities.assert_called_with({'ID':
             1234}, {'AUTHORIZED': '91011'})
-        self.manager.admins.findEntities.return_value = [{'ID': 1234,
+        admins.findEntities.return_value = [{'ID': 1234,
             'AUTHORIZED': '1;2;3;4'},]
-        self.manager.updateAdmin(1234, 91011)
-        self.manager.admins.updateMatchingEntities.assert_called_with({'ID':
+        self.manager.updateAdmin("1234", 91011)
+        admins.updateMatchingEntities.assert_called_with({'ID':
             1234}, {'AUTHORIZED': '1;2;3;4;91011'})
+        assert_equals(admins.addEntity.call_count, 1)
 
     def test_verifyAdmin(self):
-        self.manager.admins.findEntities.return_value = list()
+        self.manager.admins.getAllEntities.return_value = list()
         assert_false(self.manager.verifyAdmin(1234, 5678))
-        self.manager.admins.findEntities.return_value = [{'AUTHORIZED':
-            '12;23;48'},]
+        self.manager.refresh()
+        self.manager.admins.getAllEntities.return_value = [{'ID': 1234,
+            'AUTHORIZED': '12;23;48', 'BANNED': ''},]
         assert_false(self.manager.verifyAdmin(1234, 5678))
         assert_true(self.manager.verifyAdmin(1234, 12))
+        assert_true(self.manager.verifyAdmin("1234", "48"))
+        self.manager.refresh()
+        self.manager.admins.getAllEntities.return_value = [{'ID': 1234,
+            'AUTHORIZED': '12;23;48', 'BANNED': True},]
+        assert_false(self.manager.verifyAdmin(1234, 12))
 
 # run tests
 if __name__ == '__main__':
@@ -5,8 +5,16 @@
 from unittest import TestCase, main as run_tests
 from nose.tools import assert_equals, assert_raises, assert_false, assert_true
 from mock import patch, MagicMock
+import time
+from threading import Lock, Thread, Event
+from datetime import datetime, timedelta
 from resources.league_manager import LeagueManager, ThreadError, isInteger,\
     LeagueError
+from resources.constants import TIMEFORMAT, MEMBER_NEGATIVE_TTL
+from resources.dry_run import Plan, TableView, PlannedTable
+from resources.run_stats import RunStats, CountingTable
+from resources.scheduler import Feed
+from sheetDB.table import Table
 
 # tests
 ## LeagueManager class tests
@@ -19,10 +27,24 @@ class TestLeagueManager(TestCase):
         self.globalManager = MagicMock()
         self.database = MagicMock()
         self.commands = MagicMock()
-        self.commands.findEntities.return_value = [{LeagueManager.TITLE_ARG:
-            '1v1;2v2;3v3'},]
+        self.commands.getAllEntities.return_value = {'LEAGUES': [{'League':
+            '', 'Args': '1v1;2v2;3v3'},]}
         self.database.fetchTable.return_value = self.commands
+        LeagueManager.threadVerdicts.clear()
+        LeagueManager.memberships.clear()
+        self.statsPatch = patch('resources.league_manager.statsStore')
+        self.statsStore = self.statsPatch.start()
         self.manager = LeagueManager(self.database, self.globalManager)
+        self.manager.admin # resolve the admin while patched
+
+    def tearDown(self):
+        self.statsPatch.stop()
+
+    def _setCommands(self, commands):
+        """replaces the Settings table's contents"""
+        self.commands.getAllEntities.reset_mock()
+        self.commands.getAllEntities.return_value = commands
+        self.manager._invalidateSettings()
 
     def test_init(self):
         assert_equals(self.manager.database, self.database)
@@ -32,12 +54,49 @@ class TestLeagueManager(TestCase):
         assert_equals(self.manager.leagues, ['1v1', '2v2', '3v3'])
         assert_equals(self.manager.admin, self.admin)
         assert_equals(self.manager.events, {'error': False, 'events': list()})
+        assert_equals(self.manager.phases, list())
+
+    @patch('resources.league_manager.LeagueManager._getAdmin')
+    @patch('resources.league_manager.LeagueManager._validateAdmin')
+    def test_lazyInit(self, validateAdmin, getAdmin):
+        database = MagicMock()
+        manager = LeagueManager(database, self.globalManager)
+        assert_equals(database.fetchTable.call_count, 1)
+        getAdmin.assert_not_called()
+        assert_equals(manager.admin, validateAdmin.return_value)
+        assert_equals(manager.admin, validateAdmin.return_value)
+        validateAdmin.assert_called_once_with(getAdmin.return_value)
+        assert_equals(manager.logSheet, database.fetchTable.return_value)
+        manager.logSheet
+        assert_equals(database.fetchTable.call_count, 2)
+        database.fetchTable.assert_called_with(LeagueManager.LOG_TITLE,
+            header=LeagueManager.LOG_HEADER,
+            constraints=LeagueManager.LOG_CONSTRAINTS)
+
+    def test_settingsIndex(self):
+        self._setCommands({'Thread': [{'League': '', 'Args': '12'}],
+            'OFFSET': [{'League': '', 'Args': '1'}, {'League': 'A',
+            'Args': '2'}]})
+        assert_equals(self.manager.settingsIndex['leagues'], {'': {'THREAD':
+            '12', 'OFFSET': '1'}, 'A': {'OFFSET': '2'}})
+        assert_equals(self.manager._findCommand('OFFSET', 'A'),
+            [{'League': 'A', 'Args': '2'},])
+        assert_equals(len(self.manager._findCommand('OFFSET')), 2)
+        assert_equals(self.manager._findCommand('THREAD'), list())
+        self.manager._fetchLeagueCommands('A')
+        self.manager._fetchThread()
+        self.manager._agentAuthorized('agent', 'A')
+        self.commands.getAllEntities.assert_called_once_with(
+            keyLabel='Command', allowDuplicates=True)
+        self.manager._setCommand('A', 'OFFSET', '3')
+        self.manager.settingsIndex
+        assert_equals(self.commands.getAllEntities.call_count, 2)
 
     def test_fetchLeagueNames(self):
-        self.commands.findEntities.return_value = [{LeagueManager.TITLE_ARG:
-            'a;b;c;d'}, {LeagueManager.TITLE_ARG: 'de;fg'}]
+        self._setCommands({'LEAGUES': [{'League': '', 'Args': 'a;b;c;d'},
+            {'League': '', 'Args': 'de;fg'}]})
         assert_equals(self.manager._fetchLeagueNames(), ['a', 'b', 'c', 'd'])
-        self.commands.findEntities.return_value = list()
+        self._setCommands(dict())
         assert_equals(self.manager._fetchLeagueNames(), list())
 
     @patch('resources.league_manager.LeagueManager.log')
@@ -57,6 +116,23 @@ class TestLeagueManager(TestCase):
         log.assert_called_with("League admin is not authorized",
             error=True)
 
+    @patch('resources.utility.time.time')
+    @patch('resources.league_manager.PlayerParser')
+    def test_isMember(self, parser, timeFn):
+        timeFn.return_value = 1000
+        parser.return_value.isMember = True
+        assert_true(self.manager._isMember(12))
+        parser.return_value.isMember = False
+        assert_true(self.manager._isMember("12"))
+        parser.assert_called_once_with(12)
+        assert_false(self.manager._isMember(13))
+        assert_false(self.manager._isMember(13))
+        assert_equals(parser.call_count, 2)
+        timeFn.return_value = 1000 + MEMBER_NEGATIVE_TTL
+        parser.return_value.isMember = True
+        assert_true(self.manager._isMember(13))
+        assert_equals(parser.call_count, 3)
+
     def test_validationStr(self):
         self.database.sheet.ID = "ID"
         assert_equals(self.manager.validationStr, "!validate_league ID")
@@ -70,6 +146,7 @@ class TestLeagueManager(TestCase):
 
     def test_validateThread(self):
         parser = MagicMock()
+        parser.fetchFirstPage.return_value = list()
         self.manager.ABUSE_THRESHOLD = 5
         self.database.sheet.ID = "ID"
         parser.getPosts.return_value = [{'author': '192', 'message': '',
@@ -84,13 +161,42 @@ class TestLeagueManager(TestCase):
         parser.getPosts.return_value[0]['title'] = '[CSL]Some title'
         assert_equals(self.manager._validateThread(parser), None)
 
+    def test_validateThread_cached(self):
+        parser = MagicMock()
+        parser.ID = 4309
+        self.database.sheet.ID = "ID"
+        posts = [{'author': str(i)} for i in xrange(5)]
+        posts[0].update({'message': '!validate_league ID', 'title': '[CSL]'})
+        parser.fetchFirstPage.return_value = posts[:4]
+        parser.getPosts.return_value = posts[:4]
+        assert_raises(ThreadError, self.manager._validateThread, parser)
+        assert_raises(ThreadError, self.manager._validateThread, parser)
+        assert_equals(parser.getPosts.call_count, 2)
+        parser.fetchFirstPage.return_value = posts
+        parser.getPosts.return_value = posts
+        self.manager._validateThread(parser)
+        verdict = self.manager.threadVerdicts.get(('4309',
+                                                   '!validate_league ID'))
+        assert_equals(verdict['count'], 5)
+        assert_equals(verdict['error'], None)
+        parser.getPosts.reset_mock()
+        self.manager._validateThread(parser)
+        assert_false(parser.getPosts.called)
+        edited = dict(posts[0], message='edited')
+        parser.fetchFirstPage.return_value = [edited,] + posts[1:]
+        assert_raises(ThreadError, self.manager._validateThread, parser)
+        parser.getPosts.assert_called_once_with()
+        parser.fetchFirstPage.return_value = posts
+        self.manager._validateThread(parser)
+        assert_equals(parser.fetchFirstPage.call_count, 6)
+
     @patch('resources.league_manager.LeagueManager.log')
     def test_logThreadFailure(self, log):
         self.manager._logThreadFailure("thread")
         log.assert_called_with("Unable to scan thread thread. Quitting.",
                                error=True)
 
-    @patch('resources.league_manager.ForumThreadParser')
+    @patch('resources.league_manager.ThreadMirror')
     def test_makeForumThreadParser(self, parser):
         assert_false(isInteger(''))
         assert_equals(self.manager._makeForumThreadParser("10390494"),
@@ -105,13 +211,13 @@ class TestLeagueManager(TestCase):
         parser.assert_called_with(400283)
 
     @patch('resources.league_manager.LeagueManager.log')
-    @patch('resources.league_manager.ForumThreadParser')
+    @patch('resources.league_manager.ThreadMirror')
     def test_fetchLeagueThread(self, parser, log):
         self.database.sheet.ID = "ID"
-        self.commands.findEntities.return_value = list()
+        self._setCommands(dict())
         assert_equals(self.manager._fetchLeagueThread(), None)
-        self.commands.findEntities.return_value = [{'Command': 'THREAD',
-            'Args': '4309340840'},]
+        self._setCommands({'THREAD': [{'Command': 'THREAD', 'League': '',
+            'Args': '4309340840'},]})
         parser.return_value.getPosts.return_value = [{'message':
             '!validate_league ID', 'title': '[CSL] Some Thread', 'author': 0},
             {'author': 1}, {'author': 2}, {'author': 3}, {'author': 2}]
@@ -122,13 +228,13 @@ class TestLeagueManager(TestCase):
         assert_equals(self.manager._fetchLeagueThread(),
                       parser.return_value)
         parser.assert_called_with(4309340840)
-        self.commands.findEntities.return_value = [{'Command': 'THREAD',
-            'Args': 'grepolis.net/Fora/4309340840'},]
+        self._setCommands({'THREAD': [{'Command': 'THREAD', 'League': '',
+            'Args': 'grepolis.net/Fora/4309340840'},]})
         failStr = "Invalid forum URL"
         self.manager._fetchLeagueThread()
         log.assert_called_with(failStr, error=True)
-        self.commands.findEntities.return_value = [{'Command': 'THREAD',
-            'Args': 'warlight.net/Forum/430934084-some-funny-data'},]
+        self._setCommands({'THREAD': [{'Command': 'THREAD', 'League': '',
+            'Args': 'warlight.net/Forum/430934084-some-funny-data'},]})
         assert_equals(self.manager._fetchLeagueThread(),
                       parser.return_value)
         parser.assert_called_with(430934084)
@@ -143,11 +249,11 @@ class TestLeagueManager(TestCase):
     @patch('resources.league_manager.LeagueManager.log')
     @patch('resources.league_manager.LeagueManager._fetchLeagueThread')
     def test_getAdmin(self, fetch, log):
-        self.commands.findEntities.return_value = [{'Args': '2940A'},]
+        self._setCommands({'ADMIN': [{'League': '', 'Args': '2940A'},]})
         fetch.return_value = None
         self.manager._getAdmin()
         log.assert_called_once_with("Unable to find admin", error=True)
-        self.commands.findEntities.return_value = list()
+        self._setCommands(dict())
         self.manager._getAdmin()
         log.assert_called_with("Unable to find admin", error=True)
         assert_equals(log.call_count, 2)
@@ -160,14 +266,204 @@ class TestLeagueManager(TestCase):
         parser.getPosts.return_value = [{'author': {'ID': '3'}},]
         assert_equals(self.manager._getAdmin(), '3')
 
+    def _makeLogSheet(self):
+        logSheet = MagicMock()
+        logSheet.reverseHeader = {'Time': 1, 'Error': 2, 'Description': 3}
+        logSheet.sheet.colCount = 3
+        def expandHeader(label):
+            logSheet.reverseHeader[label] = len(logSheet.reverseHeader) + 1
+            logSheet.sheet.colCount += 1
+        logSheet.expandHeader.side_effect = expandHeader
+        logSheet.headerRow, logSheet.sheet.rowCount = 1, 1
+        self.manager.logSheet = logSheet
+        return logSheet
+
     def test_log(self):
+        logSheet = self._makeLogSheet()
         self.manager.log("description", error=False)
         assert_false(self.manager.events['error'])
         assert_equals(len(self.manager.events['events']), 1)
         self.manager.log("description", error=True)
-        assert_equals(self.manager.logSheet.addEntity.call_count, 2)
+        logSheet.addEntity.assert_not_called()
+        logSheet.sheet.sheet.append_rows.assert_not_called()
         assert_true(self.manager.events['error'])
         assert_equals(len(self.manager.events['events']), 2)
+        assert_equals(len(self.manager._logBuffer), 2)
+        for _ in xrange(self.manager.LOG_BUFFER_SIZE - 2):
+            self.manager.log("description")
+        assert_equals(logSheet.sheet.sheet.append_rows.call_count, 1)
+        assert_equals(len(self.manager._logBuffer), 0)
+
+    @patch('resources.league_manager.datetime.datetime')
+    def test_flushLog(self, dt):
+        logSheet = self._makeLogSheet()
+        self.manager.flushLog()
+        logSheet.sheet.sheet.append_rows.assert_not_called()
+        dt.strftime.return_value = "time"
+        self.manager.log("one", league="1v1")
+        self.manager.log("two", error=True)
+        self.manager.flushLog()
+        logSheet.expandHeader.assert_called_once_with('League')
+        logSheet.sheet.sheet.append_rows.assert_called_once_with([
+            ["time", False, "one", "1v1"], ["time", True, "two", ""]])
+        logSheet.sheet.sheet.append_rows.side_effect = IOError
+        self.manager.log("three")
+        assert_raises(IOError, self.manager.flushLog)
+        assert_equals(len(self.manager._logBuffer), 1)
+        self.manager.plan = Plan()
+        self.manager.flushLog()
+        assert_equals(self.manager._logBuffer, list())
+        assert_equals(logSheet.sheet.sheet.append_rows.call_count, 2)
+        assert_equals(self.manager.plan.report['sheets'], {'Log':
+                      {'append': 1}})
+
+    @patch('resources.league_manager.datetime.datetime')
+    def test_log_failingSheet(self, dt):
+        logSheet = self._makeLogSheet()
+        dt.strftime.return_value = "time"
+        logSheet.sheet.sheet.append_rows.side_effect = IOError
+        self.manager.LOG_BUFFER_MAX = 120
+        for _ in xrange(200): self.manager.log("description")
+        assert_equals(logSheet.sheet.sheet.append_rows.call_count, 1)
+        assert_equals(len(self.manager.events['events']), 200)
+        assert_equals(len(self.manager._logBuffer), 120)
+        assert_equals(self.manager._logDropped, 80)
+        assert_raises(IOError, self.manager.flushLog)
+        assert_equals(logSheet.sheet.sheet.append_rows.call_count, 2)
+        logSheet.sheet.sheet.append_rows.side_effect = None
+        self.manager.flushLog()
+        rows = logSheet.sheet.sheet.append_rows.call_args[0][0]
+        assert_equals(len(rows), 121)
+        assert_equals(rows[0], ["time", True, "80 log entries were " +
+                                "dropped while the Log couldn't be written", ""])
+        assert_equals(self.manager._logDropped, 0)
+        for _ in xrange(self.manager.LOG_BUFFER_SIZE):
+            self.manager.log("description")
+        assert_equals(logSheet.sheet.sheet.append_rows.call_count, 4)
+
+    def _makeLogTable(self, times):
+        """a sheetDB Table over a Log sheet with a ref (constraints) row"""
+        worksheet, database = MagicMock(), MagicMock()
+        worksheet.ID, worksheet.colCount, worksheet.rowCount = "log", 3, 1000
+        worksheet.getRow.return_value = ['Time', 'Error', 'Description']
+        worksheet.getRawRow.return_value = ['', 'BOOL', '']
+        worksheet.getCol.return_value = ['Time', ''] + times
+        constants = {'log_HEADER': [1,], 'log_REFROW': [2,],
+                     'log_IGNOREDROWS': list(), 'log_IGNOREDCOLS': list()}
+        database.fetchConstant.side_effect = lambda label: constants[label]
+        self.manager.logSheet = Table(worksheet, database)
+        return worksheet
+
+    def test_logNeedsRotation(self):
+        recent = datetime.strftime(datetime.now(), TIMEFORMAT)
+        old = datetime.strftime(datetime.now() - timedelta(days=8),
+                                TIMEFORMAT)
+        worksheet = self._makeLogTable(list())
+        assert_equals(self.manager.logSheet.refRow, 2)
+        assert_false(self.manager._logNeedsRotation())
+        worksheet.getCol.assert_called_once_with(1)
+        self._makeLogTable([recent,] * 5001)
+        assert_true(self.manager._logNeedsRotation())
+        self._setCommands({'LOG MAX ROWS': [{'League': 'ALL',
+            'Args': '10000'},], 'LOG MAX AGE': [{'League': 'ALL',
+            'Args': '7'},]})
+        assert_false(self.manager._logNeedsRotation())
+        self._makeLogTable(["not a time", old])
+        assert_false(self.manager._logNeedsRotation())
+        self._makeLogTable([old, recent, "", ""])
+        assert_true(self.manager._logNeedsRotation())
+        self._setCommands({'LOG MAX AGE': [{'League': 'ALL', 'Args': '9'},]})
+        assert_false(self.manager._logNeedsRotation())
+
+    @patch('resources.league_manager.LeagueManager._logNeedsRotation')
+    def test_rotateLog(self, needsRotation):
+        logSheet = self._makeLogSheet()
+        needsRotation.return_value = True
+        self.manager.log("entry")
+        self.manager.flushLog()
+        needsRotation.assert_not_called()
+        self.manager._logRotationDue = True
+        self.manager.log("entry")
+        self.manager.flushLog()
+        title = logSheet.sheet.sheet.update_title.call_args[0][0]
+        assert_true(title.startswith("Log Archive ("))
+        assert_equals(self.manager.logSheet,
+                      self.database.fetchTable.return_value)
+        self.manager.log("entry")
+        self.manager.flushLog()
+        needsRotation.assert_called_once_with()
+        needsRotation.side_effect = IOError("offline")
+        self.manager._logRotationDue = True
+        self.manager.log("entry")
+        self._makeLogSheet()
+        self.manager.flushLog()
+        rows = self.manager.logSheet.sheet.sheet.append_rows.call_args[0][0]
+        assert_equals(len(rows), 2)
+        assert_true("Unable to rotate log: offline" in rows[1])
+
+    def test_parallelLeagues(self):
+        assert_equals(self.manager.parallelLeagues, 1)
+        self._setCommands({'PARALLEL LEAGUES': [{'League': 'ALL',
+            'Args': '4'},]})
+        assert_equals(self.manager.parallelLeagues, 4)
+        self._setCommands({'PARALLEL LEAGUES': [{'League': 'ALL',
+            'Args': 'many'},]})
+        assert_equals(self.manager.parallelLeagues, 1)
+
+    @patch('resources.league_manager.LeagueManager._runLeague')
+    def test_runLeagues(self, runLeague):
+        self.manager.leagues = ['A', 'B', 'C']
+        buckets = {'A': ['a'], 'B': ['b'], 'C': ['c']}
+        self.manager._runLeagues('thread', buckets)
+        assert_equals([c[0] for c in runLeague.call_args_list],
+                      [('A', 'thread', ['a']), ('B', 'thread', ['b']),
+                       ('C', 'thread', ['c'])])
+        self._setCommands({'PARALLEL LEAGUES': [{'League': 'ALL',
+            'Args': '2'},]})
+        running, peak, lock = [0], [0], Lock()
+        def runOne(league, thread, orders):
+            with lock:
+                running[0] += 1
+                peak[0] = max(peak[0], running[0])
+            time.sleep(0.02)
+            with lock: running[0] -= 1
+        runLeague.side_effect = runOne
+        self.manager._runLeagues('thread', buckets)
+        assert_equals(runLeague.call_count, 6)
+        assert_equals(peak[0], 2)
+        runLeague.assert_called_with('C', 'thread', ['c'])
+
+    @patch('resources.league_manager.LeagueManager.log')
+    @patch('resources.league_manager.LeagueManager.fetchLeague')
+    def test_runLeagues_buildFailure(self, fetchLeague, log):
+        self.manager.leagues = ['A', 'B', 'C']
+        fetchLeague.side_effect = lambda league, *args: \
+            self._raise(ValueError("broken sheet")) if league == 'B' \
+            else MagicMock()
+        buckets = {'A': ['a'], 'B': ['b'], 'C': ['c']}
+        assert_raises(ValueError, self.manager._runLeagues, 'thread', buckets)
+        self._setCommands({'PARALLEL LEAGUES': [{'League': 'ALL',
+            'Args': '3'},]})
+        assert_raises(ValueError, self.manager._runLeagues, 'thread', buckets)
+        log.assert_called_once_with("Failed to run league B: broken sheet",
+                                    league='B', error=True)
+
+    @staticmethod
+    def _raise(error):
+        raise error
+
+    @patch('resources.league_manager.LeagueManager.flushLog')
+    @patch('resources.league_manager.LeagueManager._run')
+    def test_runFlushesLog(self, run, flush):
+        run.side_effect = IOError
+        assert_raises(IOError, self.manager.run)
+        flush.assert_called_once_with()
+        assert_true(self.manager._logRotationDue)
+
+    def test_recordPhase(self):
+        self.manager.recordPhase('1v1', '_updateGames', 1.23456)
+        assert_equals(self.manager.phases, [{'League': '1v1',
+            'Phase': '_updateGames', 'Time': 1.235}])
 
     @patch('resources.league_manager.LeagueManager._fetchLeagueCommands')
     def test_getDefaultResults(self, fetch):
@@ -176,11 +472,11 @@ class TestLeagueManager(TestCase):
         assert_equals(self.manager._getDefaultResults("ALL"), dict())
 
     def test_fetchLeagueCommands(self):
-        self.commands.getAllEntities.return_value = {'Cmd': [{'Args': 'Are',
+        self._setCommands({'Cmd': [{'Args': 'Are',
             'League': ''}], 'Human': [{'Args': 'Or', 'League': 'Are'}],
             'We': [{'Args': 'Dancer', 'League': 'ALL'}], 'And': [{'Args':
             '', 'League': ''}, {'Args': 'Are;We;Human', 'League': 'ALL'}],
-            'WE': [{'Args': 'Human', 'League': 'Are'}]}
+            'WE': [{'Args': 'Human', 'League': 'Are'}]})
         assert_equals(self.manager._fetchLeagueCommands(''),
             {'CMD': 'Are', 'WE': 'Dancer', 'AND': ''})
         assert_equals(self.manager._fetchLeagueCommands('Are'),
@@ -189,31 +485,93 @@ class TestLeagueManager(TestCase):
     @patch('resources.league_manager.LeagueManager.log')
     @patch('resources.league_manager.LeagueManager._validateThread')
     @patch('resources.league_manager.OrderParser')
-    def test_fetchThreadOrders(self, parser, validate, log):
-        threadParser = MagicMock()
-        threadParser.getOrders.return_value = 'orders'
-        parser.return_value = threadParser
-        assert_equals(self.manager._fetchThreadOrders('12049', 'offset'),
-                      'orders')
-        threadParser.getOrders.assert_called_once_with('offset')
+    def test_fetchThreadParser(self, parser, validate, log):
+        assert_equals(self.manager._fetchThreadParser('12049'),
+                      parser.return_value)
         parser.assert_called_once_with(12049)
-        threadParser.getOrders.side_effect = ThreadError
-        assert_equals(self.manager._fetchThreadOrders('12094', '2'), set())
+        validate.assert_called_once_with(parser.return_value)
         validate.side_effect = ThreadError
-        assert_equals(self.manager._fetchThreadOrders('1294', '2'), set())
+        assert_equals(self.manager._fetchThreadParser('1294'), None)
+        assert_equals(self.manager._fetchThreadParser('no/thread'), None)
         assert_equals(log.call_count, 2)
 
-    def test_narrowOrders(self):
+    def _makeThreadParser(self, count):
+        """a parser whose posts 0..count-1 hold one order for league B"""
+        threadParser = MagicMock()
+        threadParser.iterPosts.side_effect = lambda minOffset: \
+            iter(xrange(minOffset, count))
+        threadParser.parseCachedPost.side_effect = lambda post: \
+            [{'type': 'set_limit', 'orders': ['B', str(post)]},
+             {'type': 'add_team', 'orders': ['ALL', str(post)]}]
+        return threadParser
+
+    @patch('resources.league_manager.LeagueManager.log')
+    def test_feedOrders(self, log):
+        threadParser = self._makeThreadParser(5)
+        feeds, counter = {'B': Feed(), 'C': Feed()}, {'orders': 0}
+        self.manager._feedOrders(threadParser, 3, feeds, counter)
+        assert_equals([order['orders'] for order in feeds['B']],
+                      [['B', '3'], ['ALL', '3'], ['B', '4'], ['ALL', '4']])
+        assert_equals([order['orders'] for order in feeds['C']],
+                      [['ALL', '3'], ['ALL', '4']])
+        assert_true(list(feeds['C'])[0] is list(feeds['B'])[1])
+        assert_equals(counter['orders'], 4)
+        assert_equals(threadParser.parseCachedPost.call_count, 2)
+        threadParser.saveParsed.assert_called_once_with()
+        def broken(minOffset):
+            yield 0
+            raise IOError
+        threadParser.iterPosts.side_effect = broken
+        feeds = {'B': Feed()}
+        self.manager._feedOrders(threadParser, 0, feeds, counter)
+        assert_equals(len(list(feeds['B'])), 2)
+        assert_equals(log.call_count, 1)
+        feeds = {'B': Feed()}
+        self.manager._feedOrders(None, 0, feeds, counter)
+        assert_equals(list(feeds['B']), list())
+
+    def test_bucketOrders(self):
         orders = [{'type': 'add_team', 'orders': ['3v3','4']},
                   {'type': 'remove_team', 'orders': ['ALL', '9']},
                   {'type': 'confirm_team', 'orders': ['1v1', '4']},
+                  {'type': 'drop_team', 'orders': ['5v5', '4']},
                   {'type': 'set_limit'}]
-        assert_equals(self.manager._narrowOrders(orders, '3v3'), orders[:2])
+        buckets = self.manager._bucketOrders(orders, ['3v3', '1v1', '2v2'])
+        assert_equals(buckets, {'3v3': orders[:2], '1v1': orders[1:3],
+                                '2v2': orders[1:2]})
+        assert_equals(self.manager._bucketOrders(set(), ['A']), {'A': list()})
+        assert_equals(self.manager._bucketOrders(None, ['A']), {'A': list()})
 
     def test_getLeagueSheets(self):
         assert_equals(self.manager._getLeagueSheets('league'),
                       tuple([self.database.fetchTable.return_value,] * 3))
         self.database.fetchTable.assert_called_with("Template Data (league)")
+        self.manager.plan = Plan()
+        self.database.tableExists.return_value = True
+        sheets = self.manager._getLeagueSheets('league')
+        assert_true(all(isinstance(sheet, TableView) for sheet in sheets))
+        assert_equals(sheets[0].table, self.database.fetchTable.return_value)
+        self.database.tableExists.assert_called_with("Template Data (league)",
+                                                     True)
+        fetches = self.database.fetchTable.call_count
+        self.database.tableExists.return_value = False
+        sheets = self.manager._getLeagueSheets('new')
+        assert_equals(self.database.fetchTable.call_count, fetches)
+        assert_true(all(isinstance(sheet.table, PlannedTable)
+                        for sheet in sheets))
+        assert_equals(sheets[1].getAllEntities(), list())
+        sheets[1].expandHeader('ID')
+        sheets[1].addEntity({'ID': 4})
+        assert_equals(sheets[1].findEntities({'ID': 4}), [{'ID': 4},])
+        assert_equals(self.manager.plan.report['sheets']['Team Data (new)'],
+                      {'create': 1, 'header': 1, 'append': 1})
+        self.manager.plan = None
+        self.manager.stats = RunStats()
+        sheets = self.manager._getLeagueSheets('league')
+        assert_true(all(isinstance(sheet, CountingTable) for sheet in sheets))
+        sheets[1].findEntities(dict())
+        assert_equals(self.manager.stats.report['leagues'], {'league':
+                      {'sheetReads': 1}})
 
     def test_retrieveOffset(self):
         assert_equals(self.manager._retrieveOffset(list()), 0)
@@ -221,12 +579,12 @@ class TestLeagueManager(TestCase):
             'Args': '1204'},]), 1204)
 
     def test_handleInterfaces(self):
-        self.commands.getAllEntities.return_value = list()
+        self._setCommands(dict())
         assert_equals(self.manager._handleInterfaces("4v4", None),
                       "(no league interface specified)")
         assert_equals(self.manager._handleInterfaces("4v4", "C"), 'C')
-        self.commands.getAllEntities.return_value = {"INTERFACE":
-            [{'League': 'ALL', 'Args': 'A'}, {'League': '4v4', 'Args': 'B'}]}
+        self._setCommands({"INTERFACE":
+            [{'League': 'ALL', 'Args': 'A'}, {'League': '4v4', 'Args': 'B'}]})
         assert_equals(self.manager._handleInterfaces("4v4", None), 'B')
         assert_equals(self.manager._handleInterfaces("4v4", "C"), 'B')
 
@@ -249,12 +607,15 @@ class TestLeagueManager(TestCase):
         assert_raises(LeagueError, self.manager._checkLeagueExists, "B")
 
     def test_agentAuthorized(self):
-        self.commands.findEntities.return_value = list()
+        self._setCommands(dict())
         assert_false(self.manager._agentAuthorized("Agent Orange", "A"))
-        self.commands.findEntities.return_value = [{'Args': 'K;L;M'},]
+        self._setCommands({'AUTHORIZED INTERFACES': [{'League': 'B',
+            'Args': 'A'}, {'League': 'A', 'Args': 'K;L;M'}]})
         assert_true(self.manager._agentAuthorized("K", "A"))
         assert_false(self.manager._agentAuthorized("A", "A"))
-        self.commands.findEntities.return_value = [{'Args': 'K;L;M;ALL'},]
+        assert_true(self.manager._agentAuthorized("A", "B"))
+        self._setCommands({'AUTHORIZED INTERFACES': [{'League': 'A',
+            'Args': 'K;L;M;ALL'},]})
         assert_true(self.manager._agentAuthorized("A", "A"))
 
     @patch('resources.league_manager.League')
@@ -267,19 +628,30 @@ class TestLeagueManager(TestCase):
         sheets.return_value = ('games', 'teams', 'templates')
         assert_equals(self.manager.fetchLeague('league'), lg.return_value)
         lg.assert_called_once_with('games', 'teams', 'templates',
-            commands.return_value, list(), self.manager.admin, self.manager,
+            commands.return_value, list(), None, self.manager,
             'league', interface.return_value)
         assert_equals(self.manager.fetchLeagueOrLeagues('league', 'name',
             [{'orders': ['league',]}, {'orders': ['not league',]}]),
             [lg.return_value,])
         lg.assert_called_with('games', 'teams', 'templates',
             commands.return_value, [{'orders': ['league',]},],
-            self.manager.admin, self.manager, 'league', interface.return_value)
+            None, self.manager, 'league', interface.return_value)
         self.manager.leagues = ['A', 'B', 'C',]
         assert_equals(self.manager.fetchLeagueOrLeagues('ALL', 'name',
             [{'orders': ['league',]}, {'orders': ['not league',]}]),
             [lg.return_value,] * 3)
 
+    @patch('resources.league_manager.LeagueManager.fetchLeague')
+    def test_iterLeagues(self, fetch):
+        self.manager.leagues = ['A', 'B']
+        orders = [{'orders': ['A', '1']}, {'orders': ['ALL', '2']}]
+        leagues = self.manager.iterLeagues('thread', orders)
+        assert_false(fetch.called)
+        assert_equals(next(leagues), fetch.return_value)
+        fetch.assert_called_once_with('A', 'thread', orders)
+        assert_equals(list(leagues), [fetch.return_value,])
+        fetch.assert_called_with('B', 'thread', orders[1:])
+
     @patch('resources.league_manager.LeagueManager._fetchLeagueCommands')
     def test_fetchCommands(self, fetch):
         fetch.side_effect = ['D', 'E', 'F', 'G']
@@ -295,11 +667,46 @@ class TestLeagueManager(TestCase):
         self.manager.setCommand('a', 'l', 'c', 'v')
         self.commands.updateMatchingEntities.assert_called_with({'Command':
             'c', 'League': 'l'}, {'Args': 'v'}, True)
+        self.manager.admin = None
+        assert_raises(LeagueError, self.manager.setCommand, 'a', 'l', 'c', 'v')
+        assert_equals(self.commands.updateMatchingEntities.call_count, 1)
+
+    def test_checkAdmin(self):
+        self.manager.admin = 1234
+        self.manager.checkAdmin()
+        self.manager.admin = None
+        assert_raises(LeagueError, self.manager.checkAdmin)
+
+    def test_invalidateSettings(self):
+        lock = self.manager._commandLock
+        self.manager.settingsIndex
+        self.manager._setCommand('1v1', 'LATEST RUN', 'now')
+        self.manager._invalidateSettings()
+        assert_true(self.manager._commandLock is lock)
+        assert_equals(self.manager._settingsIndex, None)
+        held, release = Event(), Event()
+        def holdLock():
+            with lock:
+                held.set()
+                release.wait(1)
+        holder = Thread(target=holdLock)
+        holder.start()
+        held.wait(1)
+        writer = Thread(target=self.manager._setCommand,
+                        args=('2v2', 'LATEST RUN', 'later'))
+        writer.start()
+        writer.join(0.05)
+        assert_true(writer.is_alive())
+        release.set()
+        writer.join(1)
+        holder.join(1)
+        self.commands.updateMatchingEntities.assert_called_with({'Command':
+            'LATEST RUN', 'League': '2v2'}, {'Args': 'later'}, True)
 
     def test_fetchThread(self):
-        self.commands.findEntities.return_value = list()
+        self._setCommands(dict())
         assert_equals(self.manager._fetchThread(), "")
-        self.commands.findEntities.return_value = [{'Args': 'A'},]
+        self._setCommands({'THREAD': [{'League': '', 'Args': 'A'},]})
         assert_equals(self.manager._fetchThread(), "A")
 
     @patch('resources.league_manager.LeagueManager._runLeague')
@@ -308,18 +715,21 @@ class TestLeagueManager(TestCase):
         self.manager.runLeague('agent', 'league')
         check.assert_called_once_with('agent', 'league')
         run.assert_called_once_with('league')
+        self.manager.admin = None
+        assert_raises(LeagueError, self.manager.runLeague, 'agent', 'league')
+        assert_equals(run.call_count, 1)
 
     @patch('resources.league_manager.datetime.datetime')
     @patch('resources.league_manager.LeagueManager._setCommand')
     @patch('resources.league_manager.LeagueManager.log')
     @patch('resources.league_manager.LeagueManager.fetchLeague')
-    @patch('resources.league_manager.LeagueManager._fetchThreadOrders')
+    @patch('resources.league_manager.LeagueManager._fetchThreadParser')
     @patch('resources.league_manager.LeagueManager._retrieveOffset')
     @patch('resources.league_manager.LeagueManager._fetchThread')
-    def test_run(self, thread, offset, orders, league, log, setCom, dt):
+    def test_run(self, thread, offset, parser, league, log, setCom, dt):
         offset.return_value = 4903
         thread.return_value = "A"
-        orders.return_value = range(30)
+        parser.return_value = self._makeThreadParser(4918)
         self.manager.admin = None
         self.manager.run()
         thread.assert_not_called()
@@ -328,6 +738,10 @@ class TestLeagueManager(TestCase):
         self.manager.run()
         assert_equals(league.return_value.run.call_count,
                       len(self.manager.leagues))
+        parser.assert_called_once_with("A")
+        fed = {args[0]: len(list(args[2]))
+               for args, _ in league.call_args_list}
+        assert_equals(fed, {'A': 15, 'B': 30, 'C': 15})
         self.commands.updateMatchingEntities.assert_called_with({'Command':
             {'value': 'OFFSET', 'type': 'positive'}}, {'Args': '4933'}, True)
         setCom.assert_called_with('C', 'LATEST RUN',
@@ -335,12 +749,64 @@ class TestLeagueManager(TestCase):
         thread.return_value = ""
         league.return_value.run.side_effect = Exception("SEGFAULT")
         self.manager.run()
+        assert_equals(parser.call_count, 1)
         self.commands.updateMatchingEntities.assert_called_with({'Command':
             {'value': 'OFFSET', 'type': 'positive'}}, {'Args': '4903'}, True)
         log.assert_called_with("Failed to run league C: SEGFAULT",
                                error=True, league='C')
         assert_equals(self.manager.log.call_count, 3)
 
+    @patch('resources.league_manager.LeagueManager._run')
+    def test_run_dryRun(self, run):
+        commands = self.manager.commands
+        commands.getAllEntities.return_value = [{'League': 'ALL',
+            'Command': 'OFFSET', 'Args': '3'}]
+        commands.reverseHeader = {'League': 1, 'Command': 2, 'Args': 3}
+        commands.constraints = dict()
+        commands.sheet.title = 'Settings'
+        commands.getConstrainedKey.side_effect = lambda col, key: set(key)
+        commands.getConstrained.side_effect = lambda value, constraint: value
+        def planned():
+            self.manager.log("planned")
+            self.manager._setCommand('ALL', 'OFFSET', '4')
+            assert_equals(self.manager._findCommand('OFFSET')[0]['Args'], '4')
+        run.side_effect = planned
+        report = self.manager.run(dryRun=True)
+        assert_equals(report['sheets'], {'Settings': {'update': 1},
+                                         'Log': {'append': 1}})
+        assert_false(commands.updateMatchingEntities.called)
+        assert_equals(self.manager.commands, commands)
+        assert_equals(self.manager.plan, None)
+        assert_equals(self.manager.events['events'][-1]['Description'],
+                      "planned")
+        run.side_effect = IOError
+        assert_raises(IOError, self.manager.run, True)
+        assert_equals(self.manager.commands, commands)
+
+    @patch('resources.league_manager.LeagueManager._run')
+    def test_run_stats(self, run):
+        commands = self.manager.commands
+        self.database.sheet.ID = "ID"
+        def counted():
+            self.manager.commands.getAllEntities()
+            self.manager.countOperation('queryGame', '1v1')
+            self.manager.recordPhase('1v1', '_createGames', 0.5)
+        run.side_effect = counted
+        self.manager.run()
+        assert_equals(self.manager.commands, commands)
+        assert_equals(self.manager.stats, None)
+        clusterID, report = self.statsStore.save.call_args[0]
+        assert_equals(clusterID, "ID")
+        assert_equals(report['cluster'], {'sheetReads': 1})
+        assert_equals(report['leagues'], {'1v1': {'queryGame': 1}})
+        assert_equals(report['phases'], [{'League': '1v1',
+            'Phase': '_createGames', 'Time': 0.5}])
+        self.manager.countOperation('queryGame')
+        run.side_effect = IOError
+        assert_raises(IOError, self.manager.run)
+        assert_equals(self.statsStore.save.call_count, 2)
+        assert_equals(self.manager.commands, commands)
+
 # run tests
 if __name__ == '__main__':
     run_tests()
@@ -11,6 +11,7 @@ assert_raises, assert_false, assert_almost_equal
 from mock import patch, MagicMock
 from resources.league import League, runPhase, noisy, ImproperLeague,\
 ImproperInput, NonexistentItem, checkAgent
+from resources.order_record import OrderRecord
 from datetime import datetime, timedelta, date
 from decimal import Decimal
 
@@ -35,6 +36,14 @@ def test_runPhase():
     failStr = ("Call to testPhase failed due to "
                "Exception('This is an exception!',)")
     t.parent.log.assert_called_once_with(failStr, "test", True)
+    assert_equals(t.parent.recordPhase.call_count, 2)
+    assert_equals(t.parent.recordPhase.call_args[0][:2], ("test", "testPhase"))
+    assert_equals(t.parent.flushLog.call_count, 2)
+    t.parent.flushLog.side_effect = IOError("quota exceeded")
+    assert_equals(t.testPhase(7), 7)
+    assert_equals(t.testPhase(None), None)
+    assert_equals(t.parent.log.call_count, 2)
+    assert_equals(t.parent.recordPhase.call_count, 4)
 
 def test_noisy():
 
@@ -92,6 +101,7 @@ class TestLeague(TestCase):
         self.league = League(self.games, self.teams, self.templates,
                              self.settings, self.orders, 30221, self.parent,
                              'NAME', 'THREADURL')
+        self.league.mods # resolve the mods while patched
 
     def test_init(self):
         assert_equals(self.league.games, self.games)
@@ -108,6 +118,17 @@ class TestLeague(TestCase):
         assert_equals(self.league.debug, False)
         assert_equals(self.league.tempTeams, None)
 
+    @patch('resources.league.League._getMods')
+    def test_lazyAdminAndMods(self, getMods):
+        self.league.admin, self.league.mods = None, None
+        assert_equals(self.league.admin, self.parent.admin)
+        getMods.assert_not_called()
+        assert_equals(self.league.mods, getMods.return_value)
+        assert_equals(self.league.mods, getMods.return_value)
+        getMods.assert_called_once_with()
+        self.league.admin = 4903
+        assert_equals(self.league.admin, 4903)
+
     @patch('resources.league.League._fetchProperty')
     def test_getMods(self, fetch):
         fetch.return_value = set()
@@ -1431,6 +1452,14 @@ class TestLeague(TestCase):
         self._setProp(self.league.SET_ALLOW_JOINS, "FALSE")
         assert_raises(ImproperInput, self.league._checkJoins)
 
+    @patch('resources.league.PlayerParser')
+    def test_makePlayerParser(self, parser):
+        assert_equals(self.league._makePlayerParser(12),
+                      parser.return_value)
+        parser.assert_called_once_with(12)
+        self.league.parent.countOperation.assert_called_with('playerScrapes',
+                                                             self.league.name)
+
     @patch('resources.league.PlayerParser')
     def test_checkConsistentClan(self, parser):
         parser.return_value.clanID = None
@@ -1607,8 +1636,17 @@ class TestLeague(TestCase):
                  'orders': ['1v1', 'The Harambes', '3']}
         fetch.return_value = ({'Players': '12,14,15', 'ID': 4}, None)
         assert_equals(self.league._setLimit(order), None)
-        check.assert_called_once_with(4, '3')
-        change.assert_called_once_with(4, '3')
+        check.assert_called_once_with(4, 3)
+        change.assert_called_once_with(4, 3)
+        record = self.league._compileOrder(dict(order, orders=['1v1', 'A',
+                                                               '5']))
+        self.league._setLimit(record)
+        assert_equals(fetch.call_args[0][0], record)
+        change.assert_called_with(4, 5)
+        for args in (['1v1', 'The Harambes', 'x'], ['1v1', 'The Harambes']):
+            assert_raises(ImproperInput, self.league._setLimit,
+                          dict(order, orders=args))
+        assert_equals(change.call_count, 2)
 
     def test_templateIDs(self):
         self.templates.findEntities.return_value = "retval"
@@ -1857,6 +1895,79 @@ class TestLeague(TestCase):
         quitLeague.side_effect = IOError
         self.league._executeOrders()
         logFailedOrder.assert_called_once_with({'type': 'quit_league'})
+        results = self.league._runOrderExecution([{'type': 'quit_league'},
+            {'type': 'add_team'}], 'internal')
+        assert_equals(results, [{'type': 'quit_league', 'error': True,
+            'message': ''}, {'type': 'add_team', 'error': False,
+            'message': None}])
+        addTeam.reset_mock()
+        results = self.league._runOrderExecution([{'author': 3},
+            'add_team', {'type': 'subtract_team'}, {'type': 'add_team'}],
+            'internal')
+        assert_equals(results, [{'type': None, 'error': True,
+            'message': "Order must be an object with a type"},
+            {'type': None, 'error': True,
+             'message': "Order must be an object with a type"},
+            {'type': 'subtract_team', 'error': True,
+             'message': "Unrecognized order type: subtract_team"},
+            {'type': 'add_team', 'error': False, 'message': None}])
+        addTeam.assert_called_once_with({'type': 'add_team'})
+        self.league.debug = True
+        self.league._runOrderExecution([{'type': 'add_team'},], 'internal')
+        self.league.debug = False
+        assert_true(any('_runOrderExecution' in str(call[0][0]) for call
+                        in self.parent.log.call_args_list))
+
+    def test_compileOrder(self):
+        record = self.league._compileOrder({'type': 'SET_LIMIT',
+            'author': 1, 'orders': ['1v1', 'A', '-2']})
+        assert_true(isinstance(record, OrderRecord))
+        assert_equals((record.team, record.limit), ('A', -2))
+        assert_true(self.league._compileOrder(record) is record)
+        record = self.league._compileOrder({'type': 'set_limit',
+                                            'orders': ['1v1', 'A', 'x']})
+        assert_equals((record.team, record.limit), ('A', None))
+        record = self.league._compileOrder({'type': 'add_team',
+                                            'orders': ['1v1', 'A', '2']})
+        assert_equals((record.team, record.limit), (None, None))
+        record = self.league._compileOrder({'orders': ['1v1', 'A', '2']})
+        assert_equals(record.limit, None)
+
+    def test_compileOrders(self):
+        self._setProp(self.league.SET_MIN_LIMIT, "0")
+        self._setProp(self.league.SET_MAX_LIMIT, "5")
+        self._setProp(self.league.SET_CONSTRAIN_LIMIT, "FALSE")
+        limit = lambda author, team, value: {'type': 'set_limit',
+            'author': author, 'orders': ('1v1', team, value)}
+        orders = [limit(1, 'A', '2'), limit(2, 'B', '1'), limit(1, 'A', '3'),
+                  limit(1, 'A', '0'), {'type': 'add_team', 'author': 1,
+                  'orders': ('1v1', 'C', '2', '1')}, limit(1, 'A', '4'),
+                  limit(3, 'A', '1'), limit(1, 'A', '1'), limit(1, 'A', '9'),
+                  limit(1, 'A', 'x'), limit(1, 'B', '2')]
+        compiled = list(self.league._compileOrders(orders))
+        assert_true(all(isinstance(order, OrderRecord)
+                        for order in compiled))
+        assert_equals(compiled, [orders[1], orders[3], orders[4], orders[5],
+                                 orders[6], orders[7], orders[8], orders[9],
+                                 orders[10]])
+        self._setProp(self.league.SET_CONSTRAIN_LIMIT, "TRUE")
+        assert_equals(list(self.league._compileOrders(orders[7:9])),
+                      orders[8:9])
+        self._setProp(self.league.SET_ACTIVE_CAPACITY, "10")
+        assert_equals(list(self.league._compileOrders(orders)), orders)
+        assert_equals(list(self.league._compileOrders(list())), list())
+
+    @patch('resources.league.League._updateRanks')
+    @patch('resources.league.League._setLimit')
+    def test_executeOrders_collapsed(self, setLimit, updateRanks):
+        self.league._makeOrderDict()
+        self._setProp(self.league.SET_DEBUG, "FALSE")
+        self._setProp(self.league.SET_MAX_LIMIT, "5")
+        self.league.orders = iter([{'type': 'set_limit', 'author': 1,
+            'orders': ('1v1', 'A', str(value))} for value in xrange(4)])
+        self.league._executeOrders()
+        setLimit.assert_called_once_with({'type': 'set_limit', 'author': 1,
+                                          'orders': ('1v1', 'A', '3')})
 
     def test_unfinishedGames(self):
         assert_equals(self.league.unfinishedGames,
@@ -3363,6 +3474,41 @@ class TestLeague(TestCase):
         assert_equals(self.league.fetchTemplate(1290), template1_out)
         assert_equals(self.league.fetchAllTemplates(), [template1_out,])
 
+    @patch('resources.league.League._packageGame')
+    @patch('resources.league.League._packageTeam')
+    def test_listings(self, packTeam, packGame):
+        packTeam.side_effect = lambda team: {'ID': int(team['ID']),
+                                             'Limit': int(team['Limit'])}
+        self.teams.findEntities.return_value = [{'ID': str(i),
+            'Limit': str(i % 2)} for i in xrange(5)]
+        assert_equals(self.league.fetchAllTeams({'offset': 1, 'limit': 2}),
+            [{'ID': 1, 'Limit': 1}, {'ID': 2, 'Limit': 0}])
+        assert_equals(packTeam.call_count, 2)
+        assert_equals(self.league.fetchAllTeams({'active': True,
+            'fields': ['ID', 'Name']}), [{'ID': 1}, {'ID': 3}])
+        assert_equals(len(self.league.fetchAllTeams({'offset': 9})), 0)
+        packGame.side_effect = lambda game: int(game['ID'])
+        self.games.findEntities.return_value = [
+            {'ID': '1', 'Sides': '1,2/3', 'Finished': ''},
+            {'ID': '2', 'Sides': '4/3', 'Finished': '2015-05-30 01:02:03'},
+            {'ID': '3', 'Sides': '13/4', 'Finished': '2015-06-30 01:02:03'}]
+        assert_equals(self.league.fetchAllGames({'team': 3}), [1, 2])
+        assert_equals(self.league.fetchAllGames({'team': 4, 'limit': 1}),
+                      [2,])
+        assert_equals(self.league.fetchAllGames({'finishedAfter':
+            datetime(2015, 6, 1)}), [3,])
+        self.league.fetchAllGames({'ongoing': True})
+        self.games.findEntities.assert_called_with({'ID': {'value': '',
+            'type': 'negative'}, 'Finished': {'value': '',
+            'type': 'positive'}})
+        self.templates.findEntities.return_value = [{'ID': 1, 'Name': 'A',
+            'WarlightID': 2, 'Active': 'TRUE', 'Usage': '0'},]
+        assert_equals(self.league.fetchAllTemplates({'active': True,
+            'fields': ['Name']}), [{'Name': 'A'},])
+        self.templates.findEntities.assert_called_with({'ID': {'value': '',
+            'type': 'negative'}, 'Active': {'value': 'TRUE',
+            'type': 'positive'}})
+
     def test_depackageOrder(self):
         order = {'author': '3920', 'type': 'some_type', 'label': 'value',
                  'listval': ['a', 'bunch', 'of', 'values'], 'dict': dict()}
@@ -3388,10 +3534,14 @@ class TestLeague(TestCase):
             'teamName': 'Some name', 'limit': '9',
             'players': ['490843', '490384']},]
         assert_raises(ImproperInput, self.league.addTeam, orders[0])
-        self.league.executeOrders('940', orders)
+        assert_equals(self.league.executeOrders('940', orders),
+            [{'type': 'add_team', 'error': True,
+              'message': "Agent not authorized for this league"},])
         self.parent.log.assert_called_with(
             "Agent not authorized for this league", self.league.name,
             error=True)
+        assert_equals(self.league.executeOrders('940', [None,])[0]['message'],
+                      "Order must be an object with a type")
         self._setProp(self.league.SET_AGENTS, "940")
         assert_true(self.league._agentAllowed(940))
         self.league.addTeam(orders[0])
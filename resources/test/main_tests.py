@@ -4,16 +4,21 @@
 # imports
 import main
 import json
+from datetime import datetime
 from werkzeug import ImmutableMultiDict
 from unittest import TestCase, main as run_tests
 from mock import MagicMock, patch
-from nose.tools import assert_equals, assert_raises, assert_false
+from nose.tools import assert_equals, assert_raises, assert_false,\
+    assert_true
 from main import AuthError, buildAuthURL, fetchLeagues,\
     fetchLeague, fetchCluster, packageDict, packageMessage, buildRoute,\
     leaguePath, clusterPath, verifyAgent, replicate, validateAuth,\
     fetchLeagueData, runLeagueOrder, runSimpleOrder, rule,\
-    creds, globalManager, badRequest, fixAppengine, version
+    creds, globalManager, badRequest, fixAppengine, version, database,\
+    runClusters, _aggregateRun, jobStatus, _runClusterJob, _runLeagueJob,\
+    runClusterOrders, listingQuery, _numericArg, fetchWritableLeague
 from resources.constants import OWNER_ID
+from resources.league_manager import LeagueError
 
 # tests
 ## helper functions
@@ -32,14 +37,35 @@ def test_fixAppengine(osMod, importFn):
 
 @patch('main.Credentials')
 def test_creds(gCreds):
+    main.credsPool.clear()
     assert_equals(creds(), gCreds.return_value)
+    assert_equals(creds(), gCreds.return_value)
+    gCreds.assert_called_once_with(main.GOOGLE_CREDS)
+    main.credsPool.clear()
 
-@patch('main.GlobalManager')
 @patch('main.creds')
-def test_globalManager(credsFn, managerFn):
+def test_database(credsFn):
+    main.databasePool.clear()
+    assert_equals(database('ID'),
+                  credsFn.return_value.getDatabase.return_value)
+    assert_equals(database('ID'),
+                  credsFn.return_value.getDatabase.return_value)
+    credsFn.return_value.getDatabase.assert_called_once_with('ID',
+        checkFormat=False)
+    assert_equals(credsFn.call_count, 2)
+    database('otherID')
+    assert_equals(credsFn.return_value.getDatabase.call_count, 2)
+    main.databasePool.clear()
+
+@patch('main.GlobalManager')
+@patch('main.database')
+def test_globalManager(databaseFn, managerFn):
+    main.managerPool.clear()
     assert_equals(globalManager(), managerFn.return_value)
-    managerFn.assert_called_once_with(
-        credsFn.return_value.getDatabase.return_value)
+    assert_equals(globalManager(), managerFn.return_value)
+    managerFn.assert_called_once_with(databaseFn.return_value)
+    databaseFn.assert_called_once_with(main.GLOBAL_MANAGER)
+    main.managerPool.clear()
 
 def test_buildAuthURL():
     expStr = "https://www.warlight.net/CLOT/Auth?p=" + str(OWNER_ID)
@@ -62,14 +88,23 @@ def test_fetchLeague(cluster):
         cluster.return_value.fetchLeague.return_value)
     cluster.return_value.fetchLeague.assert_called_once_with('leagueName')
 
+@patch('main.fetchCluster')
+def test_fetchWritableLeague(cluster):
+    assert_equals(fetchWritableLeague('clusterID', 'leagueName'),
+        cluster.return_value.fetchLeague.return_value)
+    cluster.return_value.checkAdmin.assert_called_once_with()
+    cluster.return_value.checkAdmin.side_effect = LeagueError
+    assert_raises(LeagueError, fetchWritableLeague, 'clusterID', 'league')
+    assert_equals(cluster.return_value.fetchLeague.call_count, 1)
+
 @patch('main.globalManager')
 @patch('main.LeagueManager')
-@patch('main.creds')
-def test_fetchCluster(credsFn, manager, globalMgr):
+@patch('main.database')
+def test_fetchCluster(databaseFn, manager, globalMgr):
     assert_equals(fetchCluster('ID'), manager.return_value)
-    manager.assert_called_once_with(credsFn.return_value.\
-        getDatabase.return_value, globalMgr.return_value)
-    credsFn.assert_called_once_with()
+    manager.assert_called_once_with(databaseFn.return_value,
+                                    globalMgr.return_value)
+    databaseFn.assert_called_once_with('ID')
 
 @patch('main.Response')
 def test_packageDict(response):
@@ -138,7 +173,7 @@ def test_fetchLeagueData(leagues, league, package):
     package.assert_called_once_with({'name': 'mock'})
 
 @patch('main.packageDict')
-@patch('main.fetchLeague')
+@patch('main.fetchWritableLeague')
 @patch('main.verifyAgent')
 def test_runLeagueOrder(verify, fetch, package):
     league = MagicMock()
@@ -161,6 +196,141 @@ def test_runLeagueOrder(verify, fetch, package):
     package.assert_called_with(league.parent.events)
     assert_equals(package.call_count, 2)
 
+def test_numericArg():
+    req = MagicMock()
+    req.args = {'workers': '3', 'huge': '1e9', 'bad': 'many', 'nan': 'nan',
+                'low': '-4'}
+    assert_equals(_numericArg(req, 'workers', 8, 1, 8), 3)
+    assert_equals(_numericArg(req, 'missing', 8, 1, 8), 8)
+    assert_equals(_numericArg(req, 'bad', 8, 1, 8), 8)
+    assert_equals(_numericArg(req, 'low', 8, 1, 8), 1)
+    assert_equals(_numericArg(req, 'huge', 600, 1, 600, float), 600)
+    assert_equals(_numericArg(req, 'nan', 600, 1, 600, float), 600)
+
+@patch('main.Scheduler')
+@patch('main.globalManager')
+@patch('main.creds')
+def test_runClusters(credsFn, glMan, scheduler):
+    cluster = MagicMock()
+    cluster.sheet.ID = 'ID'
+    credsFn.return_value.getAllDatabases.return_value = [cluster]
+    scheduler.return_value.run.return_value = list()
+    assert_equals(runClusters(3, 20.0), {'error': False, 'events': list(),
+                                         'clusters': list()})
+    scheduler.assert_called_once_with(3, 20.0)
+    tasks = scheduler.return_value.run.call_args[0][0]
+    assert_equals(tasks[0].label, 'ID')
+    assert_equals(tasks[0].args, (cluster, glMan.return_value, False))
+    runClusters(3, 20.0, True)
+    tasks = scheduler.return_value.run.call_args[0][0]
+    assert_equals(tasks[0].args, (cluster, glMan.return_value, True))
+
+def test_listingQuery():
+    req = MagicMock()
+    req.args = {'offset': '10', 'limit': '-5', 'team': '12', 'ongoing': '1',
+                'active': 'false', 'fields': 'ID,Name,',
+                'finishedAfter': '2017-02-03'}
+    assert_equals(listingQuery(req), {'offset': 10, 'limit': 0, 'team': 12,
+        'ongoing': True, 'active': False, 'fields': ['ID', 'Name'],
+        'finishedAfter': datetime(2017, 2, 3)})
+    req.args = {'finishedAfter': '2017-02-03T04:05:06.000000Z'}
+    assert_equals(listingQuery(req)['finishedAfter'],
+                  datetime(2017, 2, 3, 4, 5, 6))
+    req.args = {'finishedAfter': '2017-02-03 04:05:06'}
+    assert_equals(listingQuery(req)['finishedAfter'],
+                  datetime(2017, 2, 3, 4, 5, 6))
+    req.args = {'finishedAfter': 'yesterday'}
+    assert_raises(ValueError, listingQuery, req)
+    req.args = dict()
+    assert_equals(listingQuery(req), dict())
+
+def test_runClusterOrders():
+    cluster = MagicMock()
+    leagues = {'A': MagicMock(), 'B': MagicMock()}
+    def fetchLeague(name):
+        if name not in leagues: raise ValueError("Nonexistent league")
+        return leagues[name]
+    cluster.fetchLeague.side_effect = fetchLeague
+    leagues['A'].executeOrders.return_value = [{'error': False},
+                                               {'error': True}]
+    leagues['B'].executeOrders.return_value = [{'error': False},]
+    orders = [{'league': 'A', 'type': 'add_team'},
+              {'league': 'B', 'type': 'remove_team'},
+              {'league': 'C', 'type': 'quit_league'},
+              {'league': 'A', 'type': 'set_limit'}]
+    results = runClusterOrders(cluster, 'agent', orders)
+    assert_equals(results, [{'error': False, 'league': 'A'},
+        {'error': False, 'league': 'B'}, {'error': True, 'league': 'C',
+        'type': 'quit_league', 'message': "Nonexistent league"},
+        {'error': True, 'league': 'A'}])
+    assert_equals(cluster.fetchLeague.call_count, 3)
+    leagues['A'].executeOrders.assert_called_once_with('agent',
+        [orders[0], orders[3]])
+    assert_equals(runClusterOrders(cluster, 'agent', list()), list())
+    leagues['B'].executeOrders.return_value = [{'error': False},]
+    assert_equals(runClusterOrders(cluster, 'agent', ['add_team',
+        {'league': 'B', 'type': 'add_team'}]), [{'type': None,
+        'league': None, 'error': True, 'message': "Order must be an object"},
+        {'error': False, 'league': 'B'}])
+
+def test_aggregateRun():
+    done, late = MagicMock(), MagicMock()
+    done.report = {'label': 'A', 'time': 1, 'timedOut': False, 'error': None}
+    done.result = {'error': True, 'events': ['a']}
+    late.report = {'label': 'B', 'time': 9, 'timedOut': True, 'error': None}
+    late.finished.is_set.return_value = False
+    report = _aggregateRun([done, late])
+    assert_equals(report['events'], ['a'])
+    assert_true(report['error'])
+    assert_equals(report['clusters'], [{'cluster': 'A', 'time': 1,
+        'timedOut': False, 'error': True}, {'cluster': 'B', 'time': 9,
+        'timedOut': True, 'error': None}])
+    done.report = {'label': 'A', 'time': 1, 'timedOut': False, 'error': None}
+    done.result['plan'] = {'sheetWrites': 3}
+    report = _aggregateRun([done])
+    assert_equals(report['clusters'][0]['plan'], {'sheetWrites': 3})
+
+@patch('main.fetchCluster')
+def test_runJobs(fetch):
+    job = MagicMock()
+    job.context = dict()
+    fetch.return_value.phases = [{'Phase': 'p'}]
+    assert_equals(_runClusterJob(job, 'ID'), fetch.return_value.events)
+    fetch.assert_called_once_with('ID')
+    fetch.return_value.run.assert_called_once_with()
+    assert_equals(job.context, {'phases': [{'Phase': 'p'}],
+                                'events': fetch.return_value.events})
+    job.context = dict()
+    fetch.return_value.run.side_effect = IOError
+    assert_raises(IOError, _runClusterJob, job, 'ID')
+    assert_false('cluster' in job.context)
+    assert_equals(_runLeagueJob(job, 'ID', 'agent', 'lg'),
+                  fetch.return_value.events)
+    fetch.return_value.runLeague.assert_called_once_with('agent', 'lg')
+
+def test_jobStatus():
+    job = main.Task('ID', lambda: None)
+    assert_equals(jobStatus(job), {'job': 'ID', 'status': 'queued',
+        'time': None, 'timedOut': False, 'error': None})
+    cluster = MagicMock()
+    cluster.phases, cluster.events = [{'Phase': 'p'}], {'events': []}
+    job.context['cluster'] = cluster
+    job.started.set()
+    status = jobStatus(job)
+    assert_equals(status['status'], 'running')
+    assert_equals(status['phases'], cluster.phases)
+    assert_equals(status['events'], cluster.events)
+    job.run()
+    assert_equals(jobStatus(job)['status'], 'finished')
+    main._releaseCluster(job)
+    assert_equals(job.context, {'phases': [{'Phase': 'p'}],
+                                'events': {'events': []}})
+    status = jobStatus(job)
+    assert_equals(status['phases'], cluster.phases)
+    assert_equals(status['events'], cluster.events)
+    job.error = IOError("offline")
+    assert_equals(jobStatus(job)['status'], 'failed')
+
 def test_rule():
     request = MagicMock()
     request.url_rule = 'some/really/complex/url/rule'
@@ -173,6 +343,8 @@ class TestMainApp(TestCase):
     def setUp(self):
         main.app.testing = True
         self.app = main.app.test_client()
+        main.databasePool.clear()
+        main.responseCache.clear()
 
     @patch('main.json.load')
     def test_address(self, load):
@@ -244,12 +416,36 @@ class TestMainApp(TestCase):
         cluster3.sheet.ID = 7
         creds.getAllDatabases.return_value = [cluster1, cluster2, cluster3]
         credsFn.return_value = creds
-        lgMan.return_value.events = {'events': [1, 2, 3]}
+        lgMan.return_value.events = {'events': [1, 2, 3], 'error': False}
         glMan.return_value.database.sheet.ID = 4
-        r = self.app.get('/run')
-        assert_equals(r.status_code, 200)
-        assert_equals(r.data, json.dumps({'events': [1, 2, 3, 1, 2, 3],
-            'error': False}))
+        r = self.app.get('/run?workers=2&deadline=30')
+        assert_equals(r.status_code, 200)
+        data = json.loads(r.data)
+        assert_equals(data['events'], [1, 2, 3, 1, 2, 3])
+        assert_false(data['error'])
+        assert_equals([c['cluster'] for c in data['clusters']], [3, 7])
+        assert_equals(lgMan.call_count, 2)
+        assert_equals(main.databasePool.get(7), cluster3)
+        lgMan.return_value.run.return_value = {'apiCalls': 2}
+        data = json.loads(self.app.get('/run?plan=1').data)
+        assert_equals(data['clusters'][0]['plan'], {'apiCalls': 2})
+        lgMan.return_value.run.assert_called_with(dryRun=True)
+        lgMan.return_value.run.side_effect = IOError("offline")
+        data = json.loads(self.app.get('/run').data)
+        assert_true(data['error'])
+        assert_equals(data['events'], list())
+        assert_equals(data['clusters'][0]['error'], "offline")
+
+    @patch('main.statsStore')
+    def test_clusterStats(self, store):
+        store.fetch.return_value = list()
+        data = json.loads(self.app.get('/clusterID/stats').data)
+        assert_equals(data, {'latest': None, 'runs': list()})
+        store.fetch.return_value = [{'time': 1}, {'time': 2}]
+        data = json.loads(self.app.get('/clusterID/stats').data)
+        assert_equals(data['latest'], {'time': 2})
+        assert_equals(len(data['runs']), 2)
+        store.fetch.assert_called_with('clusterID')
 
     @patch('main.fetchCluster')
     def test_clusterCommands(self, fetchFn):
@@ -278,6 +474,40 @@ class TestMainApp(TestCase):
             'events': ['a', 'bcd']}))
         fetch.assert_called_once_with('yetAnotherClusterID')
         assert_equals(verify.call_count, 1)
+        fetch.return_value.run.assert_called_once_with()
+        fetch.return_value.run.return_value = {'sheetWrites': 4}
+        r = self.app.post('/yetAnotherClusterID/run', query_string={'agent':
+            'agent', 'token': 'token', 'plan': '1'})
+        assert_equals(json.loads(r.data)['plan'], {'sheetWrites': 4})
+        fetch.return_value.run.assert_called_with(dryRun=True)
+
+    @patch('main.executor')
+    @patch('main.fetchCluster')
+    @patch('main.verifyAgent')
+    def test_runAsync(self, verify, fetch, executor):
+        fetch.return_value.events = {'error': False, 'events': ['e']}
+        fetch.return_value.phases = [{'Phase': '_createGames'}]
+        r = self.app.post('/clusterID/run', query_string={'agent': 'agent',
+            'token': 'token', 'async': '1'})
+        data = json.loads(r.data)
+        assert_false(data['error'])
+        job = main.jobs.get(data['job'])
+        executor.submit.assert_called_once_with(job)
+        assert_equals(job.args[1:], ('clusterID',))
+        fetch.assert_not_called()
+        r = self.app.get('/clusterID/lg/run?agent=4903&async=true')
+        job = main.jobs.get(json.loads(r.data)['job'])
+        assert_equals(job.args[1:], ('clusterID', '4903', 'lg'))
+        assert_equals(verify.call_count, 2)
+        fetch.assert_not_called()
+        job.run()
+        r = self.app.get('/jobs/' + job.label)
+        data = json.loads(r.data)
+        assert_equals(data['status'], 'finished')
+        assert_equals(data['events'], fetch.return_value.events)
+        r = self.app.get('/jobs/nonexistent')
+        assert_equals(json.loads(r.data), {'error': True,
+            'message': 'Nonexistent job'})
 
     @patch('main.fetchLeague')
     def test_showLeague(self, fetchFn):
@@ -292,6 +522,79 @@ class TestMainApp(TestCase):
             'games': ['g', 'a', 'm', 'e', 's'], 'templates':
             ['t', 'e', 'mp', 's']}))
 
+    @patch('main.verifyAgent')
+    @patch('main.fetchCluster')
+    @patch('main.fetchLeague')
+    def test_cachedResponses(self, fetchFn, clusterFn, verify):
+        fetchFn.return_value.fetchTeam.return_value = {'team': 'one'}
+        r = self.app.get('/clusterID/leagueID/team/43')
+        assert_equals(r.status_code, 200)
+        tag = r.headers['ETag']
+        self.app.get('/clusterID/leagueID/team/43')
+        assert_equals(fetchFn.call_count, 1)
+        r = self.app.get('/clusterID/leagueID/team/43',
+                         headers={'If-None-Match': tag})
+        assert_equals(r.status_code, 304)
+        assert_equals(r.data, "")
+        r = self.app.get('/clusterID/leagueID/team/43',
+                         headers={'If-None-Match': '"stale"'})
+        assert_equals(r.status_code, 200)
+        self.app.get('/clusterID/leagueID/team/44')
+        assert_equals(fetchFn.call_count, 2)
+        self.app.get('/clusterID/leagueID/setCommand?agent=1&token=2')
+        self.app.get('/clusterID/leagueID/team/43')
+        assert_equals(fetchFn.call_count, 3)
+        main.responseCache.set(('otherID', 'lg', '/', (0, 0)), ('{}', 'tag'))
+        main.invalidateCluster('clusterID')
+        assert_equals(len(main.responseCache), 1)
+        main.invalidateCluster()
+        assert_equals(len(main.responseCache), 0)
+
+    @patch('main._runVerification')
+    @patch('main.fetchLeague')
+    def test_cachedResponses_unauthorizedWrite(self, fetchFn, verify):
+        fetchFn.return_value.fetchTeam.return_value = {'team': 'one'}
+        self.app.get('/clusterID/leagueID/team/43')
+        verify.side_effect = AuthError("Unregistered or banned agent")
+        generations = len(main.cacheGenerations)
+        for clusterID in ('clusterID', 'madeUp1', 'madeUp2'):
+            r = self.app.get('/%s/leagueID/setCommand?agent=1&token=2' %
+                             (clusterID))
+            assert_true(json.loads(r.data)['error'])
+        assert_equals(len(main.cacheGenerations), generations)
+        assert_equals(len(main.responseCache), 1)
+        assert_equals(main.cacheGenerations.maxSize,
+                      main.CACHE_GENERATIONS_SIZE)
+
+    @patch('main.fetchLeague')
+    def test_cachedResponses_overlappingWrite(self, fetchFn):
+        def fetchTeam(team):
+            main.invalidateCluster('clusterID') # a write lands meanwhile
+            return {'team': 'stale'}
+        fetchFn.return_value.fetchTeam.side_effect = fetchTeam
+        r = self.app.get('/clusterID/leagueID/team/43')
+        assert_equals(json.loads(r.data), {'team': 'stale'})
+        assert_equals(len(main.responseCache), 0)
+        fetchFn.return_value.fetchTeam.side_effect = None
+        fetchFn.return_value.fetchTeam.return_value = {'team': 'fresh'}
+        r = self.app.get('/clusterID/leagueID/team/43')
+        assert_equals(json.loads(r.data), {'team': 'fresh'})
+        assert_equals(len(main.responseCache), 1)
+
+    @patch('main.globalManager')
+    @patch('main.database')
+    @patch('main.LeagueManager')
+    def test_flushLogs(self, manager, databaseFn, globalFn):
+        manager.return_value.fetchCommands.return_value = dict()
+        r = self.app.get('/clusterID/commands')
+        assert_equals(r.status_code, 200)
+        manager.return_value.flushLog.assert_called_once_with()
+        manager.return_value.fetchCommands.side_effect = IOError
+        manager.return_value.flushLog.side_effect = IOError
+        r = self.app.get('/clusterID/commands')
+        assert_true(json.loads(r.data)['error'])
+        assert_equals(manager.return_value.flushLog.call_count, 2)
+
     @patch('main.fetchCluster')
     def test_leagueCommands(self, fetchFn):
         fetchFn.return_value.fetchCommands.return_value = {"lg": {"cmd": "v"}}
@@ -302,8 +605,9 @@ class TestMainApp(TestCase):
         assert_equals(r.status_code, 200)
         assert_equals(r.data, json.dumps({}))
 
+    @patch('main.fetchCluster')
     @patch('main.fetchLeagues')
-    def test_fetchGroup(self, fetchFn):
+    def test_fetchGroup(self, fetchFn, clusterFn):
         league1, league2, league3 = MagicMock(), MagicMock(), MagicMock()
         league1.name, league2.name, league3.name = "one", "two", "three"
         league1.fetchAllTeams.return_value = "all one teams"
@@ -315,19 +619,42 @@ class TestMainApp(TestCase):
         league3.fetchAllTeams.return_value = "all three teams"
         league3.fetchAllGames.return_value = "all three games"
         league3.fetchAllTemplates.return_value = "all three templates"
-        fetchFn.return_value = [league1, league2, league3]
+        clusterFn.return_value.iterLeagues.side_effect = lambda: \
+            iter([league1, league2, league3])
+        cluster, flushed = clusterFn.return_value, list()
+        cluster.flushLog.side_effect = lambda: flushed.append(
+            league3.fetchAllGames.call_count)
         r = self.app.get('/clusterID/ALL/games')
         assert_equals(r.status_code, 200)
-        assert_equals(r.data, json.dumps({'one': 'all one games',
-            'two': 'all two games', 'three': 'all three games'}))
+        assert_equals(r.data, '{"one": "all one games", ' +
+            '"two": "all two games", "three": "all three games"}')
+        assert_equals(flushed, [1,])
+        cluster.flushLog.side_effect = IOError
         r = self.app.get('/clusterID/ALL/allTemplates')
         assert_equals(r.status_code, 200)
-        assert_equals(r.data, json.dumps({'one': 'all one templates',
-            'two': 'all two templates', 'three': 'all three templates'}))
+        assert_equals(json.loads(r.data), {'one': 'all one templates',
+            'two': 'all two templates', 'three': 'all three templates'})
+        clusterFn.assert_called_with('clusterID')
+        assert_false(fetchFn.called)
+        league2.fetchAllGames.side_effect = IOError("quota exceeded")
+        r = self.app.get('/clusterID/ALL/games')
+        assert_equals(r.status_code, 200)
+        assert_equals(json.loads(r.data), {'one': 'all one games',
+            'error': True, 'message': 'quota exceeded'})
+        league1.fetchAllGames.side_effect = IOError("offline")
+        assert_equals(json.loads(self.app.get('/clusterID/ALL/games').data),
+                      {'error': True, 'message': 'offline'})
+        clusterFn.return_value.iterLeagues.side_effect = lambda: iter([])
+        r = self.app.get('/clusterID/ALL/teams')
+        assert_equals(r.data, '{}')
         fetchFn.return_value = [league1]
         r = self.app.get('/clusterID/one/teams')
         assert_equals(r.status_code, 200)
         assert_equals(r.data, json.dumps({'one': 'all one teams'}))
+        league1.fetchAllTeams.assert_called_with(dict())
+        self.app.get('/clusterID/one/games?ongoing=1&limit=5&fields=ID')
+        league1.fetchAllGames.assert_called_with({'ongoing': True,
+            'limit': 5, 'fields': ['ID',]})
 
     @patch('main.fetchLeague')
     def test_fetchEntity(self, fetchFn):
@@ -347,7 +674,7 @@ class TestMainApp(TestCase):
         assert_equals(r.data, json.dumps({'game': 'one'}))
 
     @patch('main.verifyAgent')
-    @patch('main.fetchLeague')
+    @patch('main.fetchWritableLeague')
     def test_orders(self, fetchFn, verifyAgent):
         league = MagicMock()
         league.parent.events = {'error': False, 'events': 'data'}
@@ -403,7 +730,7 @@ class TestMainApp(TestCase):
         league.dropTemplates.assert_called_once_with({'templates': [u'1', u'3',
             u'5'], 'data': u'value'})
 
-    @patch('main.fetchLeague')
+    @patch('main.fetchWritableLeague')
     @patch('main.verifyAgent')
     def test_executeOrders(self, verify, fetch):
         fetch.return_value.parent.events = dict()
@@ -415,6 +742,28 @@ class TestMainApp(TestCase):
         fetch.return_value.executeOrders.assert_called_once_with('token',
             [{u'this': u'is'}, {u'a': list()}, {u'of': u'orders'}])
 
+    @patch('main.runClusterOrders')
+    @patch('main.fetchCluster')
+    @patch('main.verifyAgent')
+    def test_executeClusterOrders(self, verify, fetch, runOrders):
+        fetch.return_value.events = {'error': False, 'events': list()}
+        runOrders.return_value = [{'error': False}, {'error': True}]
+        r = self.app.get('/clusterID/executeOrders',
+            query_string={'agent': '12', 'order0': '{"league": "A"}',
+            'order1': '{"league": "B"}'})
+        assert_equals(r.status_code, 200)
+        assert_equals(json.loads(r.data), {'error': True,
+            'results': runOrders.return_value,
+            'events': fetch.return_value.events})
+        fetch.assert_called_once_with('clusterID')
+        fetch.return_value.checkAdmin.side_effect = LeagueError("no admin")
+        r = self.app.get('/clusterID/executeOrders',
+            query_string={'agent': '12', 'order0': '{"league": "A"}'})
+        assert_true(json.loads(r.data)['error'])
+        assert_equals(runOrders.call_count, 1)
+        runOrders.assert_called_once_with(fetch.return_value, '12',
+            [{u'league': u'A'}, {u'league': u'B'}])
+
     @patch('main.fetchCluster')
     @patch('main.verifyAgent')
     def test_setCommand(self, verify, fetch):
@@ -2,6 +2,9 @@
 ## automated tests for the OrderParser class
 
 # imports
+import os
+import shutil
+import tempfile
 from nose.tools import *
 from mock import patch
 from resources.order_parser import *
@@ -73,9 +76,20 @@ def test_parsePost():
     post_2 = {'message': '', 'author': {'ID': 1}}
     assert_equals(len(parsePost(post_2)), 0)
 
-@patch('resources.order_parser.OrderParser.parsePost')
+def test_iterOrderLines():
+    iterOrderLines = OrderParser.iterOrderLines
+    assert_equals(list(iterOrderLines('no orders here </pre>')), list())
+    assert_equals(list(iterOrderLines('<pre class="prettyprint">a b</pre>'
+                                      'text<pre class="prettyprint">c<br>'
+                                      '<br>d</pre><pre class="prettyprint">'
+                                      'unclosed')), ['a b', 'c', '', 'd'])
+    assert_equals(list(iterOrderLines('<pre class="prettyprint"></pre>')),
+                  [''])
+
+@patch('resources.order_parser.OrderParser.saveParsed')
+@patch('resources.order_parser.OrderParser.parseCachedPost')
 @patch('resources.order_parser.OrderParser.getPosts')
-def test_getOrders(getPosts, parsePost):
+def test_getOrders(getPosts, parsePost, save):
     getPosts.return_value = [1,2,3,4,5]
     parsePost.return_value = [6,]
     orders = parser.getOrders("minOffset")
@@ -84,3 +98,81 @@ def test_getOrders(getPosts, parsePost):
     parsePost.assert_called_with(5)
     assert_equals(parsePost.call_count, 5)
     getPosts.assert_called_once_with(minOffset="minOffset")
+    save.assert_called_once_with()
+
+@patch('resources.order_parser.OrderParser.saveParsed')
+@patch('resources.order_parser.OrderParser.parseCachedPost')
+@patch('resources.order_parser.OrderParser.iterPosts')
+def test_iterOrders(iterPosts, parsePost, save):
+    iterPosts.return_value = iter([1, 2, 3])
+    parsePost.side_effect = lambda post: [post * 10,] * post
+    orders = parser.iterOrders("minOffset")
+    assert_false(iterPosts.called)
+    assert_equals(next(orders), 10)
+    assert_equals(parsePost.call_count, 1)
+    assert_false(save.called)
+    assert_equals(list(orders), [20, 20, 30, 30, 30])
+    iterPosts.assert_called_once_with(minOffset="minOffset")
+    save.assert_called_once_with()
+
+## parsed post cache tests
+class TestParsedPosts(object):
+
+    def setUp(self):
+        self.cacheDir = tempfile.mkdtemp()
+        self.dirPatch = patch('resources.order_parser.CACHE_DIR',
+                              self.cacheDir)
+        self.dirPatch.start()
+        OrderParser._parsed.clear()
+        OrderParser._unsaved.clear()
+        self.parser = OrderParser(4096)
+        self.post = {'ID': 7, 'author': {'ID': 3},
+                     'message': ('<pre class="prettyprint">add_team 1v1 '
+                                 '&quot;A B&quot; 3</pre>')}
+
+    def tearDown(self):
+        self.dirPatch.stop()
+        OrderParser._parsed.clear()
+        OrderParser._unsaved.clear()
+        shutil.rmtree(self.cacheDir)
+
+    def test_parseCachedPost(self):
+        expected = [{'type': 'add_team', 'orders': ('1v1', 'A B', '3'),
+                     'author': 3}]
+        with patch.object(OrderParser, 'parsePost',
+                          wraps=self.parser.parsePost) as parsePost:
+            assert_equals(self.parser.parseCachedPost(self.post), expected)
+            orders = self.parser.parseCachedPost(self.post)
+            assert_equals(orders, expected)
+            assert_equals(parsePost.call_count, 1)
+            orders[0]['type'] = 'changed'
+            assert_equals(self.parser.parseCachedPost(self.post), expected)
+            self.post['message'] = 'edited'
+            assert_equals(self.parser.parseCachedPost(self.post), list())
+            assert_equals(parsePost.call_count, 2)
+
+    def test_saveParsed(self):
+        self.parser.saveParsed()
+        assert_false(os.path.exists(self.parser._parsedPath))
+        expected = self.parser.parseCachedPost(self.post)
+        self.parser.saveParsed()
+        assert_true(os.path.exists(self.parser._parsedPath))
+        OrderParser._parsed.clear()
+        with patch.object(OrderParser, 'parsePost') as parsePost:
+            orders = OrderParser(4096).parseCachedPost(self.post)
+            assert_false(parsePost.called)
+        assert_equals(orders, expected)
+        assert_true(isinstance(orders[0]['orders'], tuple))
+        with open(self.parser._parsedPath, 'w') as parsedFile:
+            parsedFile.write("[1, 2")
+        assert_equals(self.parser._readParsed(), dict())
+
+    @patch('resources.order_parser.ThreadMirror.clearMirror')
+    def test_clearMirror(self, clearMirror):
+        self.parser.parseCachedPost(self.post)
+        self.parser.saveParsed()
+        self.parser.clearMirror()
+        clearMirror.assert_called_once_with()
+        assert_false(os.path.exists(self.parser._parsedPath))
+        assert_false('4096' in OrderParser._parsed)
+        self.parser.clearMirror()
@@ -0,0 +1,38 @@
+# order_record_tests.py
+## automated tests for the OrderRecord class
+
+# imports
+from nose.tools import assert_equals, assert_raises, assert_true, \
+    assert_false
+from resources.order_record import OrderRecord
+
+# tests
+def test_orderRecord():
+    record = OrderRecord({'type': 'SET_Limit', 'author': 12,
+                          'orders': ['1v1', 'Team', '3']})
+    assert_equals(record.kind, 'set_limit')
+    assert_equals(record['orders'], ('1v1', 'Team', '3'))
+    assert_equals(record['type'], 'SET_Limit')
+    assert_equals((record.team, record.limit), (None, None))
+    record.limit = 3
+    assert_equals(record, {'type': 'SET_Limit', 'author': 12,
+                           'orders': ('1v1', 'Team', '3')})
+    assert_equals(record.get('author'), 12)
+    assert_true('orders' in record)
+    assert_false('kind' in record)
+    assert_raises(KeyError, lambda: record['kind'])
+    assert_false(hasattr(record, '__dict__'))
+    record['type'] = 'ADD_TEAM'
+    assert_equals(record.kind, 'add_team')
+    assert_raises(KeyError, record.__setitem__, 'templates', [])
+    assert_equals(repr(record), repr(record.asDict()))
+
+def test_orderRecord_partial():
+    record = OrderRecord({'type': 'quit_league'})
+    assert_equals(record, {'type': 'quit_league'})
+    assert_equals(record, OrderRecord({'type': 'quit_league'}))
+    assert_true(record != {'type': 'quit_league', 'author': 1})
+    assert_false('orders' in record)
+    assert_equals(record.get('orders', tuple()), tuple())
+    assert_raises(KeyError, lambda: record['author'])
+    assert_false(hasattr(OrderRecord(dict()), 'kind'))
@@ -0,0 +1,74 @@
+# run_stats_tests.py
+## automated tests for run operation counters
+
+# imports
+import os
+import shutil
+import tempfile
+from nose.tools import assert_equals, assert_true, assert_false
+from mock import MagicMock
+from resources.run_stats import RunStats, CountingTable, CountingHandler, \
+    StatsStore
+
+# tests
+def test_runStats():
+    stats = RunStats()
+    stats.count(RunStats.SHEET_READS)
+    stats.count(RunStats.SHEET_READS, '1v1', 2)
+    stats.count('queryGame', '1v1')
+    stats.count('queryGame', '2v2')
+    stats.recordPhase({'League': '1v1', 'Phase': '_createGames', 'Time': 1})
+    report = stats.report
+    assert_equals(report['totals'], {'sheetReads': 3, 'queryGame': 2})
+    assert_equals(report['cluster'], {'sheetReads': 1})
+    assert_equals(report['leagues'], {'1v1': {'sheetReads': 2,
+        'queryGame': 1}, '2v2': {'queryGame': 1}})
+    assert_equals(report['phases'][0]['Phase'], '_createGames')
+    assert_true(report['time'] >= 0)
+
+def test_countingTable():
+    table, stats = MagicMock(), RunStats()
+    counting = CountingTable(table, stats, '1v1')
+    assert_equals(counting.findEntities({'ID': 1}),
+                  table.findEntities.return_value)
+    table.findEntities.assert_called_once_with({'ID': 1})
+    counting.getAllEntities()
+    counting.updateMatchingEntities({'ID': 1}, {'Rating': 3})
+    assert_equals(counting.reverseHeader, table.reverseHeader)
+    assert_equals(stats.report['leagues'], {'1v1': {'sheetReads': 2,
+                                                    'sheetWrites': 1}})
+
+def test_countingHandler():
+    handler, stats = MagicMock(), RunStats()
+    handler.token = 'token'
+    counting = CountingHandler(handler, stats, '1v1')
+    assert_equals(counting.createGame(1, 2), handler.createGame.return_value)
+    handler.createGame.assert_called_once_with(1, 2)
+    counting.queryGame(4)
+    counting.queryGame(5)
+    assert_equals(counting.token, 'token')
+    assert_equals(stats.report['totals'], {'createGame': 1, 'queryGame': 2})
+
+class TestStatsStore(object):
+
+    def setUp(self):
+        self.directory = os.path.join(tempfile.mkdtemp(), 'stats')
+        self.store = StatsStore(self.directory, history=2)
+
+    def tearDown(self):
+        shutil.rmtree(os.path.dirname(self.directory))
+
+    def test_saveAndFetch(self):
+        assert_equals(self.store.fetch('ID'), list())
+        for run in xrange(3): self.store.save('ID', {'run': run})
+        assert_equals(self.store.fetch('ID'), [{'run': 1}, {'run': 2}])
+        assert_equals(StatsStore(self.directory).fetch('ID'),
+                      [{'run': 1}, {'run': 2}])
+        assert_equals(self.store.fetch('other'), list())
+
+    def test_path(self):
+        assert_equals(self.store._path('../a/b_c-D'),
+                      os.path.join(self.directory, 'stats_ab_c-D.json'))
+        self.store.save('bad', {'value': object()})
+        assert_equals(len(self.store.fetch('bad')), 1)
+        assert_false(os.path.exists(self.store._path('bad')))
@@ -0,0 +1,102 @@
+# scheduler_tests.py
+## automated tests for the Scheduler and Task classes
+
+# imports
+import time
+from threading import Thread, Event
+from nose.tools import assert_equals, assert_true, assert_false
+from resources.scheduler import Scheduler, Executor, Task, \
+    Feed
+
+# tests
+## Task class tests
+def test_task():
+    task = Task('label', lambda a, b: a + b, 1, 2)
+    assert_equals(task.elapsed, None)
+    assert_true(task.run())
+    assert_true(task.wait())
+    assert_equals(task.result, 3)
+    assert_equals(task.report, {'label': 'label', 'time': task.elapsed,
+                                'timedOut': False, 'error': None})
+    assert_false(task.abandon())
+
+def test_task_error():
+    def fail(): raise ValueError("bad value")
+    task = Task('label', fail)
+    task.run()
+    assert_equals(task.result, None)
+    assert_equals(task.report['error'], "bad value")
+
+## Scheduler class tests
+def test_scheduler():
+    tasks = [Task(i, lambda x: x * 2, i) for i in xrange(10)]
+    assert_equals(Scheduler(3).run(tasks), tasks)
+    assert_equals([task.result for task in tasks], range(0, 20, 2))
+    assert_equals(Scheduler(0).workers, 1)
+    assert_equals(Scheduler(2).run(list()), list())
+
+def test_scheduler_deadline():
+    release = Event()
+    stuck = Task('stuck', release.wait)
+    quick = Task('quick', lambda: 'done')
+    Scheduler(2, deadline=0.05).run([stuck, quick])
+    assert_true(stuck.abandoned)
+    assert_true(stuck.report['timedOut'])
+    assert_equals(quick.result, 'done')
+    assert_false(quick.abandoned)
+    release.set()
+    stuck.finished.wait(1)
+    assert_true(stuck.finished.is_set())
+
+def test_scheduler_abandonedBound():
+    release, running = Event(), list()
+    def hang(label):
+        running.append(label)
+        release.wait(1)
+    tasks = [Task(i, hang, i) for i in xrange(6)]
+    start = time.time()
+    Scheduler(1, deadline=0.1).run(tasks)
+    assert_true(time.time() - start < 0.3)
+    assert_equals(running, [0,])
+    assert_true(all(task.abandoned for task in tasks))
+    assert_equals(tasks[1].report['time'], None)
+    release.set()
+    tasks[0].finished.wait(1)
+    assert_false(tasks[1].run())
+    assert_false(tasks[1].started.is_set())
+    assert_equals(running, [0,])
+
+## Executor class tests
+def test_executor():
+    executor = Executor(2)
+    tasks = [executor.submit(Task(i, lambda x: -x, i)) for i in xrange(5)]
+    for task in tasks: assert_true(task.wait(1))
+    assert_equals([task.result for task in tasks], [0, -1, -2, -3, -4])
+    assert_equals(len(executor._threads), 2)
+
+## Feed class tests
+def test_feed():
+    feed = Feed()
+    feed.append(1)
+    feed.append(2)
+    feed.close()
+    assert_equals(list(feed), [1, 2])
+    assert_equals(list(feed), [1, 2])
+    assert_equals(len(feed), 2)
+
+def test_feed_threaded():
+    feed, readers, results = Feed(), list(), [list(), list()]
+    for result in results:
+        reader = Thread(target=result.extend, args=(feed,))
+        reader.daemon = True
+        reader.start()
+        readers.append(reader)
+    for i in xrange(50): feed.append(i)
+    readers[0].join(0.05)
+    assert_true(readers[0].is_alive())
+    feed.close()
+    for reader in readers:
+        reader.join(1)
+        assert_false(reader.is_alive())
+    assert_equals(results, [range(50), range(50)])
+    assert_equals(list(feed), range(50))
@@ -0,0 +1,239 @@
+# thread_mirror_tests.py
+## automated tests for the ThreadMirror class
+
+# imports
+import os
+import shutil
+import datetime
+import tempfile
+from nose.tools import assert_equals, assert_true, assert_false, \
+    assert_raises
+from mock import patch, MagicMock
+from resources.thread_mirror import ThreadMirror
+from resources.constants import MIRROR_REVALIDATE, MIRROR_CACHE_SIZE
+
+# helpers
+def makePost(ID):
+    return {'ID': ID, 'author': {'ID': ID % 7, 'name': 'p', 'isMember': False,
+            'clan': None}, 'title': 't', 'message': 'm%d' % (ID),
+            'time': datetime.datetime(2017, 5, 1, 12, 0, ID % 60),
+            'hidden': False}
+
+def makePages(posts):
+    """returns a ForumPageParser side effect serving the given posts"""
+    def makePage(threadID, offset):
+        page = MagicMock()
+        page.posts = posts[offset:offset+20]
+        page.pageExists = bool(len(page.posts))
+        page.length = len(posts)
+        return page
+    return makePage
+
+class TestThreadMirror(object):
+
+    def setUp(self):
+        self.cacheDir = tempfile.mkdtemp()
+        self.dirPatch = patch('resources.thread_mirror.CACHE_DIR',
+                              self.cacheDir)
+        self.dirPatch.start()
+        ThreadMirror._mirrors.clear()
+        self.mirror = ThreadMirror(1024)
+
+    def tearDown(self):
+        self.dirPatch.stop()
+        ThreadMirror._mirrors.clear()
+        shutil.rmtree(self.cacheDir)
+
+    def test_path(self):
+        assert_equals(self.mirror._path,
+                      os.path.join(self.cacheDir, "thread_1024.json"))
+
+    def test_readWritePosts(self):
+        assert_equals(self.mirror._readPosts(), list())
+        posts = [makePost(1), makePost(2)]
+        self.mirror._writePosts(posts)
+        assert_equals(self.mirror._readPosts(), posts)
+        assert_true(isinstance(posts[0]['time'], datetime.datetime))
+        with open(self.mirror._path, 'w') as mirrorFile:
+            mirrorFile.write("{not json")
+        assert_equals(self.mirror._readPosts(), list())
+
+    @patch('resources.thread_mirror.ForumPageParser')
+    def test_sync(self, pageParser):
+        posts = [makePost(i) for i in xrange(45)]
+        pageParser.side_effect = makePages(posts[:25])
+        assert_equals(self.mirror.sync(), posts[:25])
+        assert_equals(pageParser.call_count, 2)
+        pageParser.reset_mock()
+        assert_equals(self.mirror.sync(), posts[:25])
+        assert_equals(pageParser.call_count, 0)
+        pageParser.side_effect = makePages(posts)
+        assert_equals(self.mirror.sync(force=True), posts)
+        assert_equals([c[0][1] for c in pageParser.call_args_list], [20, 40])
+
+    @patch('resources.thread_mirror.ForumPageParser')
+    def test_sync_fullPages(self, pageParser):
+        posts = [makePost(i) for i in xrange(40)]
+        pageParser.side_effect = makePages(posts)
+        assert_equals(self.mirror.sync(), posts)
+        pageParser.reset_mock()
+        posts.append(makePost(40))
+        assert_equals(self.mirror.sync(force=True), posts)
+        assert_equals([c[0][1] for c in pageParser.call_args_list], [40])
+
+    @patch('resources.thread_mirror.ForumPageParser')
+    def test_sync_deletedPosts(self, pageParser):
+        posts = [makePost(i) for i in xrange(30)]
+        pageParser.side_effect = makePages(posts)
+        self.mirror.sync()
+        pageParser.side_effect = makePages(posts[:25] + posts[26:])
+        synced = self.mirror.sync(force=True)
+        assert_equals([post['ID'] for post in synced],
+                      range(25) + range(26, 30))
+
+    @patch('resources.thread_mirror.ForumPageParser')
+    def test_sync_persisted(self, pageParser):
+        posts = [makePost(i) for i in xrange(22)]
+        pageParser.side_effect = makePages(posts)
+        self.mirror.sync()
+        ThreadMirror._mirrors.clear()
+        pageParser.reset_mock()
+        assert_equals(ThreadMirror("1024").sync(), posts)
+        assert_equals([c[0][1] for c in pageParser.call_args_list], [0, 20])
+
+    @patch('resources.thread_mirror.ForumPageParser')
+    def test_sync_concurrentPages(self, pageParser):
+        posts = [makePost(i) for i in xrange(130)]
+        pageParser.side_effect = makePages(posts)
+        assert_equals(self.mirror.sync(), posts)
+        assert_equals(sorted(c[0][1] for c in pageParser.call_args_list),
+                      range(0, 140, 20))
+        pageParser.reset_mock()
+        pageParser.side_effect = makePages(posts[:20])
+        assert_equals(ThreadMirror(2048).sync(), posts[:20])
+        assert_equals([c[0][1] for c in pageParser.call_args_list], [0, 20])
+
+    @patch('resources.thread_mirror.ForumPageParser')
+    def test_sync_grownThread(self, pageParser):
+        posts = [makePost(i) for i in xrange(50)]
+        serve = makePages(posts)
+        def stale(threadID, offset):
+            page = serve(threadID, offset)
+            page.length = 20
+            return page
+        pageParser.side_effect = stale
+        assert_equals(self.mirror.sync(), posts)
+        assert_equals([c[0][1] for c in pageParser.call_args_list],
+                      [0, 20, 40])
+
+    @patch('resources.thread_mirror.ForumPageParser')
+    def test_sync_pageError(self, pageParser):
+        serve = makePages([makePost(i) for i in xrange(70)])
+        def broken(threadID, offset):
+            if offset == 40: raise IOError("timed out")
+            return serve(threadID, offset)
+        pageParser.side_effect = broken
+        assert_raises(IOError, self.mirror.sync)
+        assert_equals(self.mirror.localPosts, list())
+
+    @patch('resources.thread_mirror.ForumPageParser')
+    def test_fetchFirstPage(self, pageParser):
+        posts = [makePost(i) for i in xrange(25)]
+        pageParser.side_effect = makePages(posts)
+        self.mirror.sync()
+        posts[0] = dict(posts[0], message='edited')
+        assert_equals(self.mirror.fetchFirstPage(), posts[:20])
+        pageParser.assert_called_with(1024, 0)
+        pageParser.side_effect = makePages(list())
+        assert_equals(self.mirror.fetchFirstPage(), list())
+
+    @patch('resources.thread_mirror.ForumPageParser')
+    def test_sync_revalidate(self, pageParser):
+        posts = [makePost(i) for i in xrange(70)]
+        pageParser.side_effect = makePages(posts)
+        self.mirror.sync()
+        posts[5] = dict(posts[5], message='edited')
+        posts[45] = dict(posts[45], message='edited')
+        pageParser.reset_mock()
+        assert_equals(self.mirror.sync(force=True)[45]['message'], 'm45')
+        assert_equals([c[0][1] for c in pageParser.call_args_list], [60])
+        self.mirror.mirror['checked'] -= MIRROR_REVALIDATE
+        pageParser.reset_mock()
+        assert_equals(self.mirror.sync(force=True), posts)
+        assert_equals([c[0][1] for c in pageParser.call_args_list],
+                      [0, 20, 40, 60])
+        assert_equals(ThreadMirror(1024)._readPosts(), posts)
+
+    @patch('resources.thread_mirror.ForumPageParser')
+    def test_sync_revalidateDeleted(self, pageParser):
+        posts = [makePost(i) for i in xrange(65)]
+        pageParser.side_effect = makePages(posts)
+        self.mirror.sync()
+        del posts[3]
+        self.mirror.mirror['checked'] = None
+        pageParser.reset_mock()
+        assert_equals(self.mirror.sync(force=True), posts)
+        assert_equals(sorted(c[0][1] for c in pageParser.call_args_list),
+                      [0, 0, 20, 40, 60])
+
+    def test_mirrorBound(self):
+        assert_equals(ThreadMirror._mirrors.maxSize, MIRROR_CACHE_SIZE)
+        for threadID in xrange(MIRROR_CACHE_SIZE + 5):
+            ThreadMirror(threadID).mirror
+        assert_equals(len(ThreadMirror._mirrors), MIRROR_CACHE_SIZE)
+
+    @patch('resources.thread_mirror.ForumPageParser')
+    def test_getPosts(self, pageParser):
+        posts = [makePost(i) for i in xrange(5)]
+        pageParser.side_effect = makePages(posts)
+        assert_equals(self.mirror.getPosts(), posts)
+        assert_equals(self.mirror.getPosts(minOffset=3), posts[3:])
+        assert_equals(pageParser.call_count, 1)
+
+    @patch('resources.thread_mirror.ForumPageParser')
+    def test_iterPosts(self, pageParser):
+        posts = [makePost(i) for i in xrange(45)]
+        pageParser.side_effect = makePages(posts)
+        stream = self.mirror.iterPosts(minOffset=25)
+        assert_equals(next(stream), posts[25])
+        assert_equals(pageParser.call_count, 3)
+        assert_equals(self.mirror.localPosts, list())
+        assert_equals(list(stream), posts[26:])
+        assert_equals(pageParser.call_count, 3)
+        assert_equals(self.mirror.localPosts, posts)
+        assert_equals(ThreadMirror(1024)._readPosts(), posts)
+        pageParser.reset_mock()
+        assert_equals(list(self.mirror.iterPosts(minOffset=40)), posts[40:])
+        assert_false(pageParser.called)
+
+    @patch('resources.thread_mirror.ForumPageParser')
+    def test_iterPosts_stale(self, pageParser):
+        posts = [makePost(i) for i in xrange(25)]
+        pageParser.side_effect = makePages(posts)
+        self.mirror.sync()
+        self.mirror.mirror['synced'] = 0
+        posts += [makePost(i) for i in xrange(25, 30)]
+        pageParser.reset_mock()
+        assert_equals(list(self.mirror.iterPosts(minOffset=3)), posts[3:])
+        pageParser.assert_called_once_with(1024, 20)
+        assert_equals(self.mirror.localPosts, posts)
+
+    @patch('resources.thread_mirror.ForumPageParser')
+    def test_localPosts(self, pageParser):
+        posts = [makePost(i) for i in xrange(3)]
+        pageParser.side_effect = makePages(posts)
+        assert_equals(self.mirror.localPosts, list())
+        self.mirror.sync()
+        pageParser.reset_mock()
+        assert_equals(self.mirror.localPosts, posts)
+        assert_false(pageParser.called)
+
+    @patch('resources.thread_mirror.ForumPageParser')
+    def test_clearMirror(self, pageParser):
+        pageParser.side_effect = makePages([makePost(1)])
+        self.mirror.sync()
+        assert_true(os.path.exists(self.mirror._path))
+        self.mirror.clearMirror()
+        assert_false(os.path.exists(self.mirror._path))
+        assert_false(self.mirror._key in ThreadMirror._mirrors)
+        self.mirror.clearMirror()
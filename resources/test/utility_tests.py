@@ -2,9 +2,11 @@
 ## tests for helper functions
 
 # imports
-from resources.utility import isInteger, WLHandler
+from resources.utility import isInteger, WLHandler, TTLCache
 from nose.tools import assert_true, assert_false, assert_equals
-from mock import patch
+from mock import patch, MagicMock
+from threading import Thread, Event
+import time
 
 def test_isInteger():
     assert_false(isInteger(""))
@@ -19,3 +21,66 @@ def test_WLHandler(handler, load):
     load.return_value = {'E-mail': 'e-mail', 'APIToken': 'token'}
     assert_equals(WLHandler(), handler.return_value)
     handler.assert_called_once_with('e-mail', 'token')
+
+@patch('resources.utility.time.time')
+def test_TTLCache(timeFn):
+    timeFn.return_value = 100
+    cache = TTLCache(ttl=10, maxSize=2)
+    assert_equals(cache.get('a'), None)
+    assert_equals(cache.set('a', 1), 1)
+    assert_true('a' in cache)
+    timeFn.return_value = 109
+    assert_equals(cache.get('a'), 1)
+    timeFn.return_value = 110
+    assert_equals(cache.get('a', 'default'), 'default')
+    assert_equals(len(cache), 0)
+    cache.set('b', 2, ttl=100)
+    cache.set('c', 3)
+    cache.set('d', 4)
+    assert_equals(len(cache), 2)
+    assert_false('c' in cache)
+    assert_true('b' in cache)
+    cache.invalidate('b')
+    assert_false('b' in cache)
+    cache.clear()
+    assert_equals(len(cache), 0)
+
+def test_TTLCache_fetch():
+    cache, makeFn = TTLCache(), MagicMock()
+    assert_equals(cache.fetch('key', makeFn), makeFn.return_value)
+    assert_equals(cache.fetch('key', makeFn), makeFn.return_value)
+    makeFn.assert_called_once_with()
+    cache.fetch('other', makeFn)
+    assert_equals(makeFn.call_count, 2)
+
+def test_TTLCache_fetchLocks():
+    cache = TTLCache(maxSize=2)
+    for i in xrange(1000): cache.fetch(i, lambda: i)
+    assert_equals(len(cache), 2)
+    assert_equals(len(cache._keyLocks), 0)
+    def fails(): raise IOError
+    try: cache.fetch('bad', fails)
+    except IOError: pass
+    assert_equals(len(cache._keyLocks), 0)
+    release = Event()
+    def waits():
+        release.wait(1)
+        return 'value'
+    threads = [Thread(target=cache.fetch, args=('slow', waits))
+               for _ in xrange(3)]
+    for thread in threads: thread.start()
+    while not cache._keyLocks: time.sleep(0.001)
+    assert_equals(cache._keyLocks.keys(), ['slow',])
+    release.set()
+    for thread in threads: thread.join(1)
+    assert_equals(cache.get('slow'), 'value')
+    assert_equals(len(cache._keyLocks), 0)
+
+def test_TTLCache_invalidateMatching():
+    cache = TTLCache()
+    cache.set(('a', 1), 1)
+    cache.set(('a', 2), 2)
+    cache.set(('b', 1), 3)
+    cache.invalidateMatching(lambda key: key[0] == 'a')
+    assert_equals(len(cache), 1)
+    assert_equals(cache.get(('b', 1)), 3)
@@ -0,0 +1,223 @@
+# thread_mirror.py
+## local mirror of forum threads
+
+# imports
+import os
+import json
+import time
+import datetime
+from threading import Lock, RLock
+from resources.utility import TTLCache
+from resources.scheduler import Scheduler, Task
+from resources.constants import TIMEFORMAT, CACHE_DIR, MIRROR_TTL, \
+    PAGE_WORKERS, MIRROR_REVALIDATE, MIRROR_RECHECK_PAGES, MIRROR_CACHE_SIZE
+from wl_parsers import ForumThreadParser
+from wl_parsers.forum_parser import ForumPageParser
+
+# main class
+class ThreadMirror(ForumThreadParser):
+    """
+    forum thread parser backed by a local copy of the thread's posts;
+    posts on full pages are kept and only later pages are fetched again,
+    except that every MIRROR_REVALIDATE seconds the first page and the
+    last MIRROR_RECHECK_PAGES full pages are refetched to pick up edits
+    (the copy on disk is only a warm start, revalidated once loaded)
+    takes a threadID (int or string)
+    """
+
+    PAGE_SIZE = 20
+    # thread ID -> {'posts': list, 'synced': time or None,
+    #               'checked': time or None}
+    _mirrors = TTLCache(MIRROR_REVALIDATE, MIRROR_CACHE_SIZE)
+    _threadLocks = dict()
+    _lock = Lock()
+
+    ## storage
+    @property
+    def _key(self):
+        return str(self.ID)
+
+    @property
+    def _path(self):
+        return os.path.join(CACHE_DIR, "thread_%s.json" % (self._key))
+
+    def _threadLock(self):
+        with self._lock: return self._threadLocks.setdefault(self._key,
+                                                             RLock())
+
+    @staticmethod
+    def _dumpPost(post):
+        post = dict(post)
+        post['time'] = datetime.datetime.strftime(post['time'], TIMEFORMAT)
+        return post
+
+    @staticmethod
+    def _loadPost(post):
+        post['time'] = datetime.datetime.strptime(post['time'], TIMEFORMAT)
+        return post
+
+    def _readPosts(self):
+        """reads mirrored posts from disk; an unreadable file mirrors nothing"""
+        try:
+            with open(self._path, 'r') as mirrorFile:
+                return [self._loadPost(post) for post in json.load(mirrorFile)]
+        except (IOError, OSError, ValueError, KeyError, TypeError):
+            return list()
+
+    def _writePosts(self, posts):
+        """writes mirrored posts to disk; failures only cost a refetch"""
+        try:
+            if not os.path.isdir(CACHE_DIR): os.makedirs(CACHE_DIR)
+            with open(self._path, 'w') as mirrorFile:
+                json.dump([self._dumpPost(post) for post in posts], mirrorFile)
+        except (IOError, OSError): pass
+
+    @property
+    def mirror(self):
+        mirror = self._mirrors.get(self._key)
+        if mirror is None:
+            mirror = self._mirrors.set(self._key, {'posts': self._readPosts(),
+                                                   'synced': None,
+                                                   'checked': None})
+        return mirror
+
+    @property
+    def localPosts(self):
+        """posts already mirrored, without touching the network"""
+        with self._threadLock(): return list(self.mirror['posts'])
+
+    def clearMirror(self):
+        """drops the local copy of the thread"""
+        with self._threadLock():
+            self._mirrors.invalidate(self._key)
+            try: os.remove(self._path)
+            except (IOError, OSError): pass
+
+    ## syncing
+    def _isFresh(self, mirror):
+        return (mirror['synced'] is not None and
+                time.time() - mirror['synced'] < MIRROR_TTL)
+
+    @staticmethod
+    def _isChecked(mirror):
+        return (mirror['checked'] is not None and
+                time.time() - mirror['checked'] < MIRROR_REVALIDATE)
+
+    @staticmethod
+    def _postIDs(posts):
+        return [post['ID'] for post in posts]
+
+    def _fetchPage(self, offset):
+        """returns the posts on the page at offset (None past the end)"""
+        page = ForumPageParser(self.ID, offset)
+        return page.posts if page.pageExists else None
+
+    def fetchFirstPage(self):
+        """returns the posts on the thread's first page, fresh from the forum"""
+        return self._fetchPage(0) or list()
+
+    def _fetchPages(self, offsets):
+        """fetches pages side by side; returns their posts in order"""
+        tasks = Scheduler(PAGE_WORKERS).run([Task(offset, self._fetchPage,
+                                                  offset)
+                                             for offset in offsets])
+        for task in tasks:
+            if task.error is not None: raise task.error
+        return [task.result for task in tasks]
+
+    def _iterPages(self, offset):
+        """
+        yields the posts on each page from offset to the thread's end;
+        the first page gives the thread's length, and the pages after it
+        are fetched PAGE_WORKERS at a time
+        """
+        page = ForumPageParser(self.ID, offset)
+        if not page.pageExists: return
+        pages, length = [page.posts,], page.length
+        while True:
+            for pagePosts in pages:
+                if pagePosts is None: return
+                yield pagePosts
+                if len(pagePosts) < self.PAGE_SIZE: return
+                offset += self.PAGE_SIZE
+            # past the known length (the thread grew), go a page at a time
+            offsets = range(offset, max(length, offset + 1), self.PAGE_SIZE)
+            pages = self._fetchPages(offsets[:PAGE_WORKERS])
+
+    def _keptPosts(self, mirror):
+        """
+        returns the mirrored posts that needn't be fetched again (those on
+        full pages) and whether the mirror was revalidated; revalidating
+        drops the last MIRROR_RECHECK_PAGES full pages and swaps in a fresh
+        first page, or drops everything if posts were deleted meanwhile
+        """
+        posts = mirror['posts']
+        kept = self.PAGE_SIZE * (len(posts) // self.PAGE_SIZE)
+        if self._isChecked(mirror): return posts[:kept], False
+        kept = max(0, kept - self.PAGE_SIZE * MIRROR_RECHECK_PAGES)
+        if not kept: return list(), True
+        firstPage = self.fetchFirstPage()
+        if (self._postIDs(firstPage) !=
+            self._postIDs(posts[:self.PAGE_SIZE])): return list(), True
+        return firstPage + posts[self.PAGE_SIZE:kept], True
+
+    def _fetchNewPosts(self, posts):
+        """
+        fetches the thread past the given posts (which end on a full page)
+        returns the full list of posts
+        """
+        posts = list(posts)
+        for pagePosts in self._iterPages(len(posts)): posts += pagePosts
+        return posts
+
+    def _publish(self, posts, checked=False):
+        """stores freshly fetched posts in the mirror and on disk"""
+        with self._threadLock():
+            mirror = self.mirror
+            if posts != mirror['posts']: self._writePosts(posts)
+            mirror['posts'], mirror['synced'] = posts, time.time()
+            if checked: mirror['checked'] = mirror['synced']
+
+    def sync(self, force=False):
+        """
+        brings the mirror up to date with the thread, skipping the
+        network if it was synced within MIRROR_TTL (unless forced)
+        returns the mirrored posts
+        """
+        with self._threadLock():
+            mirror = self.mirror
+            if force or not self._isFresh(mirror):
+                posts, checked = self._keptPosts(mirror)
+                self._publish(self._fetchNewPosts(posts), checked)
+            return self.mirror['posts']
+
+    def getPosts(self, minOffset=0):
+        """
+        returns a list of dictionaries of posts (as ForumThreadParser),
+        read from the synced mirror
+
+        PARAMS: minOffset (int, optional, default 0)
+        """
+        return self.sync()[minOffset:]
+
+    def iterPosts(self, minOffset=0):
+        """
+        yields posts (as getPosts) as the thread's pages come in, starting
+        with those already mirrored; the mirror is updated once the last
+        page has been read
+
+        PARAMS: minOffset (int, optional, default 0)
+        """
+        with self._threadLock():
+            mirror = self.mirror
+            fresh, posts = self._isFresh(mirror), mirror['posts']
+            checked = False
+            if not fresh: posts, checked = self._keptPosts(mirror)
+        for post in posts[minOffset:]: yield post
+        if fresh: return
+        posts = list(posts)
+        for pagePosts in self._iterPages(len(posts)):
+            start = max(0, minOffset - len(posts))
+            posts += pagePosts
+            for post in pagePosts[start:]: yield post
+        self._publish(posts, checked)
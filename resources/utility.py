@@ -3,7 +3,9 @@
 
 # imports
 import json
+import time
 import string
+from threading import Lock, RLock
 from resources.constants import API_CREDS
 from wl_api import APIHandler
 
@@ -20,3 +22,102 @@ def WLHandler():
         wlCreds = json.load(credsFile)
         wlHandler = APIHandler(wlCreds['E-mail'], wlCreds['APIToken'])
     return wlHandler
+
+# TTLCache
+class TTLCache(object):
+    """
+    thread-safe mapping whose entries expire after a time-to-live
+    :param ttl: seconds an entry stays fresh (None to never expire)
+    :param maxSize: maximum number of entries (None for no bound)
+    """
+
+    _MISSING = object()
+
+    def __init__(self, ttl=None, maxSize=None):
+        self.ttl = ttl
+        self.maxSize = maxSize
+        self._entries = dict()
+        self._keyLocks = dict()
+        self._lock = RLock()
+
+    def __len__(self):
+        with self._lock: return len(self._entries)
+
+    def __contains__(self, key):
+        return self.get(key, self._MISSING) is not self._MISSING
+
+    @staticmethod
+    def _expired(expiry, now):
+        return (expiry is not None and expiry <= now)
+
+    def _evict(self):
+        """drops expired entries, then the entry closest to expiring"""
+        now = time.time()
+        for key in list(self._entries):
+            if self._expired(self._entries[key][1], now):
+                del self._entries[key]
+        if len(self._entries) < self.maxSize: return
+        soonest = min(self._entries, key=lambda k: (self._entries[k][1]
+                      is not None, self._entries[k][1]))
+        del self._entries[soonest]
+
+    def get(self, key, default=None):
+        with self._lock:
+            if key not in self._entries: return default
+            value, expiry = self._entries[key]
+            if self._expired(expiry, time.time()):
+                del self._entries[key]
+                return default
+            return value
+
+    def set(self, key, value, ttl=None):
+        """stores a value; ttl overrides the cache-wide time-to-live"""
+        ttl = self.ttl if ttl is None else ttl
+        with self._lock:
+            if (self.maxSize is not None and key not in self._entries and
+                len(self._entries) >= self.maxSize): self._evict()
+            expiry = None if ttl is None else (time.time() + ttl)
+            self._entries[key] = (value, expiry)
+        return value
+
+    def _claimKeyLock(self, key):
+        """returns the lock for a key, counting the caller as a user"""
+        with self._lock:
+            entry = self._keyLocks.setdefault(key, [Lock(), 0])
+            entry[1] += 1
+            return entry[0]
+
+    def _releaseKeyLock(self, key):
+        """drops the lock for a key once its last user is done with it"""
+        with self._lock:
+            entry = self._keyLocks[key]
+            entry[1] -= 1
+            if entry[1] == 0: del self._keyLocks[key]
+
+    def fetch(self, key, makeFn, ttl=None):
+        """
+        returns the cached value for a key, calling makeFn to create it
+        if it's missing or stale; concurrent callers for the same key
+        wait on a single call to makeFn
+        """
+        value = self.get(key, self._MISSING)
+        if value is not self._MISSING: return value
+        try:
+            with self._claimKeyLock(key):
+                value = self.get(key, self._MISSING)
+                if value is self._MISSING:
+                    value = self.set(key, makeFn(), ttl)
+                return value
+        finally: self._releaseKeyLock(key)
+
+    def invalidate(self, key):
+        with self._lock: self._entries.pop(key, None)
+
+    def invalidateMatching(self, matchFn):
+        """drops every entry whose key satisfies matchFn"""
+        with self._lock:
+            for key in [k for k in self._entries if matchFn(k)]:
+                del self._entries[key]
+
+    def clear(self):
+        with self._lock: self._entries.clear()
@@ -2,10 +2,10 @@
 ## runs everything (infinite loop)
 
 # imports
-from main import run
+from main import runClusters
 
 # run everything
 if __name__ == '__main__':
     while True:
-        try: run()
+        try: runClusters()
         except KeyboardInterrupt: break